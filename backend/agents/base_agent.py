@@ -10,15 +10,203 @@ Version: 0.2.0
 License: MIT
 """
 
+import asyncio
+import json
 import logging
 from abc import ABC, abstractmethod
-from typing import Dict, List, Optional, Any
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
 from datetime import datetime
 import os
 from google import genai
+from modules.llm_cache import get_llm_cache
 
 logger = logging.getLogger(__name__)
 
+# Tamaño mínimo (tokens estimados) para que Gemini acepte una caché de contexto
+MIN_TOKENS_CACHE_CONTEXTO = 4096
+
+# Máximo de caracteres del texto del tema que se incluye en los prompts
+# cuando no se pueden contar los tokens
+MAX_CHARS_TEXTO_PROMPT = 50000  # ~12,500 tokens
+
+# Presupuesto real (en tokens de Gemini) del texto del tema en los prompts.
+# Un token nunca baja de ~3 caracteres en castellano: por debajo de
+# MAX_TOKENS_TEXTO_PROMPT * CHARS_POR_TOKEN_MIN caracteres no hace falta contar
+MAX_TOKENS_TEXTO_PROMPT = 12500
+CHARS_POR_TOKEN_MIN = 3
+
+# Tokens de cada texto ya contados: (modelo, huella, longitud) -> tokens
+# (None si no se pudo contar). Compartido por todos los agentes, así A, B y
+# C cuentan el mismo texto una sola vez
+_tokens_texto: Dict[Tuple[str, int, int], Optional[int]] = {}
+_MAX_TOKENS_TEXTO_CACHEADOS = 256
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+def cargar_json(texto: str) -> Any:
+    """
+    Parsea JSON usando orjson si está instalado (bastante más rápido)
+
+    Los errores de orjson heredan de json.JSONDecodeError, así que los
+    except existentes siguen funcionando igual.
+    """
+    if orjson is not None:
+        return orjson.loads(texto)
+    return json.loads(texto)
+
+
+@lru_cache(maxsize=4096)
+def _normalizar_cadena(texto: str) -> str:
+    """
+    casefold y espacios colapsados, memoizado por cadena
+
+    Los tres extractores devuelven muchas veces los mismos textos y leyes
+    ronda tras ronda, así que casi todas las llamadas son aciertos.
+    """
+    return ' '.join(texto.casefold().split())
+
+
+def normalizar_texto_referencia(referencia: Dict) -> str:
+    """
+    Texto de una referencia normalizado para detectar duplicados
+
+    Mismo criterio en todos los extractores y en el índice de referencias
+    previas que construye SistemaConvergencia (casefold y espacios colapsados).
+    """
+    return _normalizar_cadena(referencia.get('texto_completo') or referencia.get('texto') or '')
+
+
+def normalizar_ley_referencia(referencia: Dict) -> str:
+    """Campo 'ley' de una referencia normalizado igual que normalizar_texto_referencia"""
+    return _normalizar_cadena(referencia.get('ley') or '')
+
+
+def huella(texto_normalizado: str) -> int:
+    """
+    Huella de 64 bits de un texto ya normalizado (0 si está vacío)
+
+    Los índices de duplicados guardan estas huellas en lugar de las cadenas.
+    Usa xxhash si está instalado; si no, hash() de Python, que es estable
+    dentro del proceso (los índices nunca se persisten).
+    """
+    if not texto_normalizado:
+        return 0
+    if xxhash is not None:
+        return xxhash.xxh64_intdigest(texto_normalizado.encode('utf-8'))
+    return hash(texto_normalizado)
+
+
+def huellas_referencia(referencia: Dict) -> Tuple[int, int]:
+    """
+    Huellas (texto, ley) de una referencia, calculadas una sola vez
+
+    Se guardan en la propia referencia ('_huellas'): el filtro de duplicados
+    del extractor y los índices de SistemaConvergencia las reutilizan en
+    lugar de volver a buscar y normalizar los campos. SistemaConvergencia
+    quita la clave antes de devolver resultados.
+    """
+    huellas = referencia.get('_huellas')
+    if huellas is None:
+        huellas = referencia['_huellas'] = (
+            huella(normalizar_texto_referencia(referencia)),
+            huella(normalizar_ley_referencia(referencia)),
+        )
+    return huellas
+
+
+def truncar_texto_prompt(
+    texto: Union[str, bytes, bytearray],
+    max_chars: int = MAX_CHARS_TEXTO_PROMPT
+) -> Tuple[str, bool]:
+    """
+    Recorta el texto del tema a max_chars caracteres para el prompt
+
+    Acepta también el texto en UTF-8 sin decodificar: se decodifica solo
+    la parte que puede entrar en el prompt (a través de un memoryview,
+    sin copiar el resto del buffer).
+
+    Args:
+        texto: Texto del tema (str o bytes UTF-8)
+        max_chars: Máximo de caracteres
+
+    Returns:
+        Tupla (texto recortado, si se ha truncado)
+    """
+    if isinstance(texto, (bytes, bytearray)):
+        # Un carácter ocupa como máximo 4 bytes en UTF-8
+        vista = memoryview(texto)[:max_chars * 4]
+        texto = str(vista, 'utf-8', 'ignore')
+
+    if len(texto) <= max_chars:
+        return texto, False
+    return texto[:max_chars], True
+
+
+def _metricas_iniciales() -> Dict[str, int]:
+    """Métricas de un agente a cero (al crearlo y al resetearlas)"""
+    return {
+        'total_llamadas': 0,
+        'total_tokens_prompt': 0,
+        'total_tokens_respuesta': 0,
+        'total_errores': 0,
+        'total_timeouts': 0,
+        'total_cache_hits': 0,
+        'tiempo_total_ms': 0
+    }
+
+
+def _objeto_json_completo(texto: str) -> Optional[str]:
+    """
+    Devuelve el primer objeto JSON de nivel superior si ya está cerrado
+
+    Recorre el texto contando llaves (ignorando las que van dentro de
+    strings) para detectar cuándo una respuesta en streaming ya contiene
+    el objeto completo.
+
+    Args:
+        texto: Texto acumulado hasta ahora
+
+    Returns:
+        Substring con el objeto JSON completo o None si aún no se ha cerrado
+    """
+    inicio = texto.find('{')
+    if inicio == -1:
+        return None
+
+    profundidad = 0
+    en_string = False
+    escapado = False
+
+    for i in range(inicio, len(texto)):
+        c = texto[i]
+        if en_string:
+            if escapado:
+                escapado = False
+            elif c == '\\':
+                escapado = True
+            elif c == '"':
+                en_string = False
+        elif c == '"':
+            en_string = True
+        elif c == '{':
+            profundidad += 1
+        elif c == '}':
+            profundidad -= 1
+            if profundidad == 0:
+                return texto[inicio:i + 1]
+
+    return None
+
 
 class BaseAgent(ABC):
     """
@@ -36,7 +224,9 @@ class BaseAgent(ABC):
         nombre: str,
         modelo: str = "gemini-2.5-pro",
         temperatura: float = 0.1,
-        api_key: Optional[str] = None
+        api_key: Optional[str] = None,
+        request_timeout: float = 15.0,
+        client: Optional[genai.Client] = None
     ):
         """
         Inicializa el agente base
@@ -46,29 +236,110 @@ class BaseAgent(ABC):
             modelo: Modelo de Gemini a usar
             temperatura: Temperatura para generación (0.0-1.0)
             api_key: API key de Gemini (si no se proporciona, usa .env)
+            request_timeout: Timeout (s) por llamada async; se reintenta una vez con el doble
+            client: Cliente de Gemini ya creado para compartir sus conexiones
+                (opcional; todos los que lo compartan deben usar el mismo event loop)
         """
         self.nombre = nombre
         self.modelo = modelo
         self.temperatura = temperatura
+        self.request_timeout = request_timeout
 
         # Configurar cliente de Gemini
         self.api_key = api_key or os.getenv('GEMINI_API_KEY')
         if not self.api_key:
             raise ValueError("GEMINI_API_KEY no encontrada")
 
-        self.client = genai.Client(api_key=self.api_key)
+        self.client = client or genai.Client(api_key=self.api_key)
+
+        # Máximo de llamadas concurrentes a Gemini en las variantes async
+        self.max_paralelo = int(os.getenv('GEMINI_MAX_PARALLEL', '8'))
+
+        # Caché de contexto explícita: (prefijo del prompt, nombre en Gemini)
+        self._cache_contexto: Optional[Tuple[str, str]] = None
+        self._cache_no_soportada = False
 
         # Métricas
-        self.metricas = {
-            'total_llamadas': 0,
-            'total_tokens_prompt': 0,
-            'total_tokens_respuesta': 0,
-            'total_errores': 0,
-            'tiempo_total_ms': 0
-        }
+        self.metricas = _metricas_iniciales()
 
         logger.info(f"✅ Agente '{self.nombre}' inicializado (modelo: {self.modelo}, temp: {self.temperatura})")
 
+    def limite_chars_texto(self, texto: Union[str, bytes]) -> int:
+        """
+        Máximo de caracteres del texto que caben en MAX_TOKENS_TEXTO_PROMPT tokens
+
+        Los textos cortos no se cuentan. Para los largos se cuentan los tokens
+        con Gemini (una vez por texto) y se recorta en proporción; si no se
+        pueden contar (o el texto llega en bytes), se vuelve al límite fijo
+        MAX_CHARS_TEXTO_PROMPT.
+
+        Args:
+            texto: Texto del tema
+
+        Returns:
+            Límite de caracteres para truncar_texto_prompt
+        """
+        if len(texto) <= MAX_TOKENS_TEXTO_PROMPT * CHARS_POR_TOKEN_MIN:
+            return len(texto)
+        if not isinstance(texto, str):
+            return MAX_CHARS_TEXTO_PROMPT
+
+        clave = (self.modelo, huella(texto), len(texto))
+        if clave not in _tokens_texto:
+            try:
+                respuesta = self.client.models.count_tokens(model=self.modelo, contents=texto)
+                self._guardar_tokens_texto(clave, respuesta.total_tokens)
+            except Exception as e:
+                logger.warning(f"[{self.nombre}] No se pudieron contar los tokens del texto: {e}")
+                self._guardar_tokens_texto(clave, None)
+
+        return self._limite_por_tokens(texto, _tokens_texto[clave])
+
+    async def contar_tokens_texto_async(self, texto: Union[str, bytes]) -> Optional[int]:
+        """
+        Cuenta por adelantado (sin bloquear el event loop) los tokens de un texto largo
+
+        Deja el resultado en la caché que usa limite_chars_texto, de modo que
+        construir los prompts después no hace ninguna llamada.
+
+        Args:
+            texto: Texto del tema
+
+        Returns:
+            Tokens del texto, o None si es corto o no se pudieron contar
+        """
+        if len(texto) <= MAX_TOKENS_TEXTO_PROMPT * CHARS_POR_TOKEN_MIN or not isinstance(texto, str):
+            return None
+
+        clave = (self.modelo, huella(texto), len(texto))
+        if clave not in _tokens_texto:
+            try:
+                respuesta = await self._con_timeout(
+                    lambda: self.client.aio.models.count_tokens(model=self.modelo, contents=texto)
+                )
+                self._guardar_tokens_texto(clave, respuesta.total_tokens)
+            except Exception as e:
+                logger.warning(f"[{self.nombre}] No se pudieron contar los tokens del texto: {e}")
+                self._guardar_tokens_texto(clave, None)
+
+        return _tokens_texto[clave]
+
+    @staticmethod
+    def _guardar_tokens_texto(clave: Tuple[str, int, int], tokens: Optional[int]):
+        """Guarda un recuento en la caché compartida (descartando el más antiguo si está llena)"""
+        if len(_tokens_texto) >= _MAX_TOKENS_TEXTO_CACHEADOS:
+            _tokens_texto.pop(next(iter(_tokens_texto)))
+        _tokens_texto[clave] = tokens
+
+    @staticmethod
+    def _limite_por_tokens(texto: str, tokens: Optional[int]) -> int:
+        """Caracteres del texto que caben en el presupuesto según su recuento de tokens"""
+        if tokens is None:
+            return MAX_CHARS_TEXTO_PROMPT
+        if tokens <= MAX_TOKENS_TEXTO_PROMPT:
+            return len(texto)
+        return len(texto) * MAX_TOKENS_TEXTO_PROMPT // tokens
+
     @abstractmethod
     def procesar(self, entrada: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -99,58 +370,331 @@ class BaseAgent(ABC):
         """
         inicio = datetime.now()
 
+        prompt_completo = self._componer_prompt(prompt, system_instruction)
+        clave_cache, respuesta_cacheada = self._buscar_cache_llm(prompt_completo)
+        if respuesta_cacheada is not None:
+            return respuesta_cacheada
+
         try:
             self.metricas['total_llamadas'] += 1
 
-            # Configurar la llamada
-            config = {
-                'temperature': self.temperatura,
-                'max_output_tokens': 65000
-            }
-
-            # Agregar system instruction si se proporciona
-            if system_instruction:
-                # En la nueva API, el system instruction se pasa como parte del prompt
-                prompt_completo = f"{system_instruction}\n\n{prompt}"
-            else:
-                prompt_completo = prompt
-
             # Llamar a Gemini
             response = self.client.models.generate_content(
                 model=self.modelo,
                 contents=prompt_completo,
-                config=config
+                config=self._config_generacion()
             )
 
-            # Extraer texto
-            texto_respuesta = response.text
+            texto = self._registrar_respuesta(
+                response.text, prompt_completo, inicio,
+                getattr(response, 'usage_metadata', None)
+            )
+            self._guardar_cache_llm(clave_cache, texto)
+            return texto
 
-            # Actualizar métricas
-            tiempo_ms = (datetime.now() - inicio).total_seconds() * 1000
-            self.metricas['tiempo_total_ms'] += tiempo_ms
+        except Exception as e:
+            self.metricas['total_errores'] += 1
+            logger.error(f"[{self.nombre}] Error en generación: {e}")
+            raise
 
-            # Estimación de tokens (aproximada)
-            # 1 token ≈ 4 caracteres en español
-            tokens_prompt = len(prompt_completo) // 4
-            tokens_respuesta = len(texto_respuesta) // 4
+    async def generar_contenido_async(
+        self,
+        prompt: str,
+        system_instruction: Optional[str] = None
+    ) -> str:
+        """
+        Variante asíncrona de generar_contenido (cliente aio de google-genai)
+
+        Permite lanzar varias llamadas a la vez con asyncio.gather para
+        solapar la latencia de red. Si la llamada supera request_timeout se
+        reintenta una vez con el doble de margen, para recortar la cola de
+        latencia.
+
+        Args:
+            prompt: Prompt para el modelo
+            system_instruction: Instrucción de sistema (opcional)
+
+        Returns:
+            Texto generado por el modelo
+        """
+        inicio = datetime.now()
+
+        prompt_completo = self._componer_prompt(prompt, system_instruction)
+        clave_cache, respuesta_cacheada = await self._buscar_cache_llm_async(prompt_completo)
+        if respuesta_cacheada is not None:
+            return respuesta_cacheada
 
-            self.metricas['total_tokens_prompt'] += tokens_prompt
-            self.metricas['total_tokens_respuesta'] += tokens_respuesta
+        try:
+            self.metricas['total_llamadas'] += 1
 
-            logger.debug(
-                f"[{self.nombre}] Llamada exitosa: "
-                f"{tokens_prompt} tokens prompt, "
-                f"{tokens_respuesta} tokens respuesta, "
-                f"{tiempo_ms:.0f}ms"
+            config = self._config_generacion()
+
+            # Si el prefijo está en la caché de contexto, enviar solo el resto
+            contenido = prompt_completo
+            if self._cache_contexto and prompt_completo.startswith(self._cache_contexto[0]):
+                prefijo, nombre_cache = self._cache_contexto
+                contenido = prompt_completo[len(prefijo):]
+                config['cached_content'] = nombre_cache
+
+            response = await self._con_timeout(
+                lambda: self.client.aio.models.generate_content(
+                    model=self.modelo,
+                    contents=contenido,
+                    config=config
+                )
             )
 
-            return texto_respuesta
+            texto = self._registrar_respuesta(
+                response.text, prompt_completo, inicio,
+                getattr(response, 'usage_metadata', None)
+            )
+            if clave_cache is not None:
+                await asyncio.to_thread(self._guardar_cache_llm, clave_cache, texto)
+            return texto
 
         except Exception as e:
             self.metricas['total_errores'] += 1
             logger.error(f"[{self.nombre}] Error en generación: {e}")
             raise
 
+    async def generar_json_stream_async(
+        self,
+        prompt: str,
+        system_instruction: Optional[str] = None
+    ) -> str:
+        """
+        Genera una respuesta JSON en streaming y corta en cuanto se cierra el objeto
+
+        Útil para respuestas cortas de un solo objeto: no hay que esperar al
+        resto de la respuesta (cierre del bloque markdown, texto extra...).
+        Con timeout y reintento.
+
+        Args:
+            prompt: Prompt para el modelo
+            system_instruction: Instrucción de sistema (opcional)
+
+        Returns:
+            Primer objeto JSON completo (o el texto acumulado si no lo hay)
+        """
+        inicio = datetime.now()
+
+        try:
+            self.metricas['total_llamadas'] += 1
+
+            prompt_completo = self._componer_prompt(prompt, system_instruction)
+            config = self._config_generacion()
+
+            async def _consumir() -> str:
+                partes = []
+                stream = await self.client.aio.models.generate_content_stream(
+                    model=self.modelo,
+                    contents=prompt_completo,
+                    config=config
+                )
+                async for chunk in stream:
+                    if chunk.text:
+                        partes.append(chunk.text)
+                        objeto = _objeto_json_completo("".join(partes))
+                        if objeto is not None:
+                            return objeto
+                return "".join(partes)
+
+            texto_respuesta = await self._con_timeout(_consumir)
+
+            return self._registrar_respuesta(texto_respuesta, prompt_completo, inicio)
+
+        except Exception as e:
+            self.metricas['total_errores'] += 1
+            logger.error(f"[{self.nombre}] Error en generación: {e}")
+            raise
+
+    async def crear_cache_contexto_async(
+        self,
+        prefijo: str,
+        system_instruction: Optional[str] = None,
+        ttl: str = "900s"
+    ) -> bool:
+        """
+        Crea una caché de contexto en Gemini con la system instruction y un prefijo
+
+        Las llamadas de generar_contenido_async cuyo prompt empiece por ese
+        prefijo solo envían el resto y reutilizan el prefijo ya procesado.
+        Si el modelo no admite cachés (p.ej. modelos -exp) o el prefijo es
+        demasiado corto, no se crea nada y todo sigue funcionando sin caché.
+
+        Args:
+            prefijo: Parte inicial común a varios prompts
+            system_instruction: Instrucción de sistema (opcional)
+            ttl: Tiempo de vida de la caché
+
+        Returns:
+            True si la caché está activa
+        """
+        await self.liberar_cache_contexto_async()
+
+        if self._cache_no_soportada or len(prefijo) // 4 < MIN_TOKENS_CACHE_CONTEXTO:
+            return False
+
+        prefijo_completo = self._componer_prompt(prefijo, system_instruction)
+
+        try:
+            cache = await self.client.aio.caches.create(
+                model=self.modelo,
+                config={'contents': [prefijo_completo], 'ttl': ttl}
+            )
+        except Exception as e:
+            # No reintentar en cada documento
+            self._cache_no_soportada = True
+            logger.info(f"[{self.nombre}] Caché de contexto no disponible: {e}")
+            return False
+
+        self._cache_contexto = (prefijo_completo, cache.name)
+        logger.debug(f"[{self.nombre}] Caché de contexto creada: {cache.name}")
+        return True
+
+    async def liberar_cache_contexto_async(self):
+        """Borra la caché de contexto activa, si la hay"""
+        if self._cache_contexto is None:
+            return
+
+        nombre_cache = self._cache_contexto[1]
+        self._cache_contexto = None
+
+        try:
+            await self.client.aio.caches.delete(name=nombre_cache)
+        except Exception as e:
+            # Caducará sola al vencer el ttl
+            logger.debug(f"[{self.nombre}] No se pudo borrar la caché {nombre_cache}: {e}")
+
+    async def _con_timeout(self, llamada: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Ejecuta una llamada async con request_timeout, reintentando una vez
+
+        Args:
+            llamada: Función que crea la corutina de la llamada (una por intento)
+
+        Returns:
+            Resultado de la llamada
+        """
+        try:
+            return await asyncio.wait_for(llamada(), self.request_timeout)
+        except asyncio.TimeoutError:
+            self.metricas['total_timeouts'] += 1
+            logger.warning(
+                f"[{self.nombre}] Timeout ({self.request_timeout:.0f}s), reintentando..."
+            )
+            return await asyncio.wait_for(llamada(), self.request_timeout * 2)
+
+    def _config_generacion(self) -> Dict[str, Any]:
+        """Configuración de la llamada a Gemini"""
+        return {
+            'temperature': self.temperatura,
+            'max_output_tokens': 65000
+        }
+
+    def _buscar_cache_llm(self, prompt_completo: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Busca la respuesta de un prompt en la caché de respuestas (si está activa)
+
+        Args:
+            prompt_completo: Prompt con la system instruction ya antepuesta
+
+        Returns:
+            Tupla (clave, respuesta); clave None si la caché está desactivada,
+            respuesta None si no hay acierto
+        """
+        llm_cache = get_llm_cache()
+        if llm_cache is None:
+            return None, None
+
+        clave = llm_cache.get_key(self.modelo, self.temperatura, prompt_completo)
+        respuesta = llm_cache.get(clave)
+        self._registrar_acierto_cache(respuesta)
+
+        return clave, respuesta
+
+    async def _buscar_cache_llm_async(self, prompt_completo: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Variante asíncrona de _buscar_cache_llm: la lectura del disco va a un
+        hilo para no bloquear el event loop
+        """
+        llm_cache = get_llm_cache()
+        if llm_cache is None:
+            return None, None
+
+        clave = llm_cache.get_key(self.modelo, self.temperatura, prompt_completo)
+        respuesta = await asyncio.to_thread(llm_cache.get, clave)
+        self._registrar_acierto_cache(respuesta)
+
+        return clave, respuesta
+
+    def _registrar_acierto_cache(self, respuesta: Optional[str]):
+        """Cuenta (y registra) un acierto de la caché de respuestas"""
+        if respuesta is not None:
+            self.metricas['total_cache_hits'] += 1
+            logger.debug(f"[{self.nombre}] 🎯 Respuesta desde caché LLM")
+
+    def _guardar_cache_llm(self, clave: Optional[str], respuesta: str):
+        """Guarda una respuesta en la caché de respuestas (si está activa)"""
+        llm_cache = get_llm_cache()
+        if clave is not None and llm_cache is not None:
+            llm_cache.set(clave, respuesta)
+
+    def _componer_prompt(self, prompt: str, system_instruction: Optional[str]) -> str:
+        """
+        Antepone la system instruction al prompt
+
+        En la nueva API, el system instruction se pasa como parte del prompt
+        """
+        if system_instruction:
+            return f"{system_instruction}\n\n{prompt}"
+        return prompt
+
+    def _registrar_respuesta(
+        self,
+        texto_respuesta: str,
+        prompt_completo: str,
+        inicio: datetime,
+        usage: Optional[Any] = None
+    ) -> str:
+        """
+        Actualiza las métricas con una respuesta recibida
+
+        Args:
+            texto_respuesta: Texto generado por el modelo
+            prompt_completo: Prompt enviado (para estimar tokens)
+            inicio: Momento de inicio de la llamada
+            usage: usage_metadata de la respuesta, si Gemini lo devuelve
+
+        Returns:
+            El mismo texto_respuesta
+        """
+        # Actualizar métricas
+        tiempo_ms = (datetime.now() - inicio).total_seconds() * 1000
+        self.metricas['tiempo_total_ms'] += tiempo_ms
+
+        # Conteo exacto del modelo si viene en la respuesta; si no (p.ej.
+        # streaming cortado antes del final), estimación: 1 token ≈ 4 caracteres
+        tokens_prompt = getattr(usage, 'prompt_token_count', None)
+        tokens_respuesta = getattr(usage, 'candidates_token_count', None)
+
+        if tokens_prompt is None:
+            tokens_prompt = len(prompt_completo) // 4
+        if tokens_respuesta is None:
+            tokens_respuesta = len(texto_respuesta) // 4
+
+        self.metricas['total_tokens_prompt'] += tokens_prompt
+        self.metricas['total_tokens_respuesta'] += tokens_respuesta
+
+        logger.debug(
+            f"[{self.nombre}] Llamada exitosa: "
+            f"{tokens_prompt} tokens prompt, "
+            f"{tokens_respuesta} tokens respuesta, "
+            f"{tiempo_ms:.0f}ms"
+        )
+
+        return texto_respuesta
+
     def obtener_metricas(self) -> Dict[str, Any]:
         """
         Obtiene las métricas del agente
@@ -171,13 +715,7 @@ class BaseAgent(ABC):
 
     def resetear_metricas(self):
         """Resetea las métricas del agente"""
-        self.metricas = {
-            'total_llamadas': 0,
-            'total_tokens_prompt': 0,
-            'total_tokens_respuesta': 0,
-            'total_errores': 0,
-            'tiempo_total_ms': 0
-        }
+        self.metricas = _metricas_iniciales()
         logger.info(f"[{self.nombre}] Métricas reseteadas")
 
     def __repr__(self) -> str:
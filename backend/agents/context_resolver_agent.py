@@ -14,16 +14,81 @@ Version: 0.2.0
 License: MIT
 """
 
+import asyncio
 import json
 import logging
 import re
-from typing import Dict, List, Any, Optional
+from collections import Counter, defaultdict
+from functools import lru_cache
+from typing import Dict, List, Any, Optional, Tuple
 from datetime import datetime
-from .base_agent import BaseAgent
+from .base_agent import BaseAgent, cargar_json
 from modules.legal_abbreviations import SIGLAS_LEYES, SIGLAS_BOE_ID
 
 logger = logging.getLogger(__name__)
 
+try:
+    import ahocorasick
+except ImportError:
+    # Sin pyahocorasick se busca referencia a referencia con regex
+    ahocorasick = None
+
+# Todas las siglas de SIGLAS_LEYES en una alternancia (las más largas primero:
+# LECrim antes que LEC)
+SIGLAS_RE = re.compile(
+    r'\b(' + '|'.join(sorted(map(re.escape, SIGLAS_LEYES), key=len, reverse=True)) + r')\b'
+)
+
+# Bloque markdown ```json ... ``` alrededor de las respuestas JSON
+_PATRON_FENCE = re.compile(r'^\s*```(?:json)?\s*|\s*```\s*$')
+
+
+@lru_cache(maxsize=1024)
+def _patron_flexible(texto_ref: str) -> re.Pattern:
+    """Compila (una vez por texto) el patrón flexible de búsqueda de una referencia"""
+    return re.compile(texto_ref.lower().replace('.', r'\.?').replace(' ', r'\s+'))
+
+
+# Mapeo de siglas y system instruction: no dependen de la entrada, se
+# construyen una sola vez al importar el módulo
+_BLOQUE_SIGLAS = "\n".join(f"- {sigla} = {nombre}" for sigla, nombre in SIGLAS_LEYES.items())
+
+_SYSTEM_INSTRUCTION = f"""Eres un experto en legislación española especializado en análisis contextual de documentos legales.
+
+Tu tarea es identificar a qué LEY pertenece cada artículo basándote en el contexto proporcionado.
+
+REGLAS CRÍTICAS PARA CONFIANZA 100%:
+- Si el documento CLARAMENTE trata sobre una ley específica (ej: documento sobre LJV), todos los artículos sin ley explícita pertenecen a esa ley → confianza 100
+- Si ves menciones repetidas de una ley en el contexto amplio → confianza 100
+- Si el artículo aparece en una sección que claramente habla de una ley → confianza 100
+- Si el contexto dice "artículo X de la [LEY]" → confianza 100
+- Si el contexto menciona siglas (LJV, CE, LEC, LOPJ, CP, LECrim, etc.) de forma consistente → confianza 100
+
+REFERENCIAS CONTEXTUALES QUE DEBES RESOLVER:
+- "la presente ley" / "esta ley" / "dicha ley" → Identifica la ley principal del documento o del contexto cercano
+- "el presente código" / "este código" → Identifica el código (CP, CC, etc.)
+- "la presente norma" / "esta norma" → Identifica la norma del contexto
+- "la citada ley" / "la mencionada ley" → Busca la ley mencionada anteriormente en el contexto
+
+IMPORTANTE: Cuando veas "la presente ley", "esta ley", etc., NO las copies literalmente. Debes identificar a qué ley específica se refieren basándote en el contexto del documento.
+
+SOLO asigna confianza < 100 si:
+- Hay AMBIGÜEDAD real entre múltiples leyes
+- El contexto es completamente insuficiente (muy raro con 1500 chars)
+- Detectas información CONTRADICTORIA
+
+MAPEO COMPLETO DE SIGLAS LEGALES:
+{_BLOQUE_SIGLAS}
+
+IMPORTANTE: Sé DECISIVO. Si el contexto te da suficiente información para identificar la ley, asigna confianza 100. No seas conservador innecesariamente.
+
+NOMBRES COMPLETOS: Siempre devuelve nombres completos de leyes, no siglas. Por ejemplo:
+- "CP" → "Código Penal" o "Ley Orgánica 10/1995, de 23 de noviembre, del Código Penal"
+- "LECrim" → "Ley de Enjuiciamiento Criminal"
+- "LOPJ" → "Ley Orgánica 6/1985, de 1 de julio, del Poder Judicial"
+
+Devuelve SOLO JSON, sin texto adicional."""
+
 
 class ContextResolverAgent(BaseAgent):
     """
@@ -46,7 +111,7 @@ class ContextResolverAgent(BaseAgent):
         """
         super().__init__(
             nombre="ContextResolver",
-            modelo="gemini-2.0-flash-exp",
+            modelo="gemini-2.0-flash",
             temperatura=0.2,  # Balanceado para análisis contextual
             api_key=api_key
         )
@@ -57,6 +122,17 @@ class ContextResolverAgent(BaseAgent):
         """
         Resuelve referencias incompletas usando contexto del documento
 
+        Envoltorio síncrono de aprocesar (ver su docstring)
+        """
+        return asyncio.run(self.aprocesar(entrada))
+
+    async def aprocesar(self, entrada: Dict) -> Dict:
+        """
+        Resuelve referencias incompletas usando contexto del documento
+
+        Los batches se envían a Gemini de forma concurrente (limitado por
+        GEMINI_MAX_PARALLEL).
+
         Args:
             entrada = {
                 'referencias': List[Dict],  # Todas las referencias
@@ -87,15 +163,8 @@ class ContextResolverAgent(BaseAgent):
         inicio = datetime.now()
 
         # 1. Filtrar referencias incompletas (confianza < 100%)
-        refs_completas = []
-        refs_incompletas = []
-
-        for ref in referencias:
-            confianza = ref.get('confianza', 100)
-            if confianza < 100:
-                refs_incompletas.append(ref)
-            else:
-                refs_completas.append(ref)
+        refs_completas = [r for r in referencias if r.get('confianza', 100) >= 100]
+        refs_incompletas = [r for r in referencias if r.get('confianza', 100) < 100]
 
         logger.info(f"   Referencias completas (100%): {len(refs_completas)}")
         logger.info(f"   Referencias incompletas (<100%): {len(refs_incompletas)}")
@@ -118,84 +187,158 @@ class ContextResolverAgent(BaseAgent):
         confianzas_antes = [r.get('confianza', 100) for r in refs_incompletas]
         confianza_antes = sum(confianzas_antes) / len(confianzas_antes) if confianzas_antes else 100
 
-        # 3. Procesar referencias incompletas en batches
+        # 3. Heurística sin IA: si el inicio del documento está dominado por una
+        # sigla, las refs sin ley ni otra señal se asignan a esa ley directamente
+        contexto_documento = texto_original[:5000]
+        ley_heuristica = self._detectar_ley_principal_heuristico(contexto_documento)
+
+        if ley_heuristica:
+            referencias_mejoradas, refs_para_ia = self._resolver_por_ley_principal(
+                refs_incompletas, ley_heuristica
+            )
+            logger.info(f"   📚 Ley principal (heurística): {ley_heuristica} → {len(referencias_mejoradas)} refs resueltas sin IA")
+        else:
+            referencias_mejoradas, refs_para_ia = [], refs_incompletas
+
+        # 4. Procesar el resto de referencias incompletas en batches (concurrentes)
+        #    Productor/consumidores sobre una cola acotada: los prompts se
+        #    construyen a medida que los workers los consumen y cada respuesta
+        #    se parsea en cuanto llega
         batch_size = 10
-        referencias_mejoradas = []
         llamadas_ia = 0
+        ley_principal = ley_heuristica
+
+        # Localizar todas las referencias en una sola pasada sobre el texto
+        # (en minúsculas una sola vez por documento)
+        texto_lower = texto_original.lower()
+        posiciones = self._buscar_posiciones(refs_para_ia, texto_lower)
+
+        # Refs con el mismo texto caen en la misma posición y, por tanto, en el
+        # mismo contexto: se envía un representante por grupo a la IA
+        grupos = defaultdict(list)
+        for ref, posicion in zip(refs_para_ia, posiciones):
+            grupos[(ref.get('texto_completo', ''), posicion)].append(ref)
+
+        refs_unicas = [grupo[0] for grupo in grupos.values()]
+        posiciones_unicas = [posicion for _, posicion in grupos]
+
+        if len(refs_unicas) < len(refs_para_ia):
+            logger.info(f"   {len(refs_para_ia)} refs → {len(refs_unicas)} únicas para IA")
+
+        total_batches = (len(refs_unicas) - 1) // batch_size + 1
+        resultados_batches: List[Optional[List[Dict]]] = [None] * total_batches
+
+        system_instruction = self._get_system_instruction()
+        num_workers = max(1, min(self.max_paralelo, total_batches))
+        cola: asyncio.Queue = asyncio.Queue(maxsize=num_workers)
+
+        async def _productor():
+            # La detección de ley principal viaja en el primer prompt (tarea de
+            # nivel documento) para ahorrar una llamada aparte, salvo que ya la
+            # haya resuelto la heurística
+            tarea_documento_pendiente = ley_heuristica is None
+
+            for n, i in enumerate(range(0, len(refs_unicas), batch_size)):
+                batch = refs_unicas[i:i + batch_size]
+
+                logger.info(f"   Preparando batch {n + 1}/{total_batches} ({len(batch)} refs)...")
+
+                try:
+                    # Extraer contextos
+                    contextos = self._extraer_contextos(
+                        batch, texto_original, posiciones_unicas[i:i + batch_size]
+                    )
+
+                    if not contextos:
+                        logger.warning(f"   No se pudo extraer contexto para este batch")
+                        resultados_batches[n] = batch  # Mantener originales
+                        continue
+
+                    # Construir prompt (el primero incluye la tarea de ley principal)
+                    prompt = self._construir_prompt(
+                        contextos,
+                        texto_original,
+                        contexto_documento if tarea_documento_pendiente else None
+                    )
+                    tarea_documento_pendiente = False
+
+                except Exception as e:
+                    logger.error(f"   Error preparando batch: {e}")
+                    resultados_batches[n] = batch  # Mantener originales
+                    continue
 
-        for i in range(0, len(refs_incompletas), batch_size):
-            batch = refs_incompletas[i:i + batch_size]
+                await cola.put((n, batch, prompt))
 
-            logger.info(f"   Procesando batch {i//batch_size + 1}/{(len(refs_incompletas)-1)//batch_size + 1} ({len(batch)} refs)...")
+            for _ in range(num_workers):
+                await cola.put(None)
 
-            try:
-                # Extraer contextos
-                contextos = self._extraer_contextos(batch, texto_original)
+        async def _worker():
+            nonlocal llamadas_ia, ley_principal
 
-                if not contextos:
-                    logger.warning(f"   No se pudo extraer contexto para este batch")
-                    referencias_mejoradas.extend(batch)  # Mantener originales
-                    continue
+            while (item := await cola.get()) is not None:
+                n, batch, prompt = item
 
-                # Construir prompt
-                prompt = self._construir_prompt(contextos)
+                try:
+                    respuesta = await self.generar_contenido_async(prompt, system_instruction)
+                except Exception as e:
+                    logger.error(f"   Error procesando batch: {e}")
+                    resultados_batches[n] = batch  # Mantener originales
+                    continue
 
-                # Llamar a IA
-                respuesta = self.generar_contenido(prompt, self._get_system_instruction())
                 llamadas_ia += 1
 
                 # Parsear respuesta
-                batch_resuelto = self._parsear_respuesta(respuesta, batch)
-                referencias_mejoradas.extend(batch_resuelto)
-
-            except Exception as e:
-                logger.error(f"   Error procesando batch: {e}")
-                referencias_mejoradas.extend(batch)  # Mantener originales
+                batch_resuelto, ley_batch = self._parsear_respuesta(respuesta, batch)
+                resultados_batches[n] = batch_resuelto
+                ley_principal = ley_principal or ley_batch
+
+        await asyncio.gather(_productor(), *[_worker() for _ in range(num_workers)])
+
+        # Repartir cada resolución entre las refs de su grupo
+        resueltas_unicas = [ref for batch_resuelto in resultados_batches for ref in batch_resuelto]
+
+        for grupo, ref_resuelta in zip(grupos.values(), resueltas_unicas):
+            referencias_mejoradas.append(ref_resuelta)
+            for ref in grupo[1:]:
+                referencias_mejoradas.append(self._replicar_resolucion(ref, ref_resuelta))
+
+        # 5. SEGUNDA PASADA: Resolver referencias que aún están < 100%
+        referencias_segunda_pasada = [r for r in referencias_mejoradas if r.get('confianza', 0) >= 100]
+        indices_incompletas = [i for i, r in enumerate(referencias_mejoradas) if r.get('confianza', 0) < 100]
+
+        if indices_incompletas:
+            logger.info(f"   🔄 Segunda pasada para {len(indices_incompletas)} referencias aún < 100%...")
+
+            # Ley principal del documento: si el primer batch no la resolvió,
+            # llamada dedicada como antes
+            if not ley_principal:
+                ley_principal = await self._detectar_ley_principal_async(contexto_documento)
+
+            # Procesar con contexto ampliado. Las refs sin resolver pueden ser
+            # los dicts del llamante: se copian antes de modificarlas
+            for i in indices_incompletas:
+                ref = referencias_mejoradas[i]
+
+                # Si detectamos ley principal y la ref no tiene info contradictoria, asignarla
+                if ley_principal and not ref.get('ley'):
+                    ref = referencias_mejoradas[i] = dict(ref)
+                    ref['ley'] = ley_principal
+                    ref['confianza'] = 100
+                    ref['_contexto_resuelto'] = True
+                    ref['_razonamiento_contexto'] = f"Asignado por contexto del documento completo (ley principal: {ley_principal})"
+                    logger.debug(f"   ✅ Segunda pasada: {ref.get('texto_completo', '')[:40]} → {ley_principal} (100%)\"")
+                elif ref.get('confianza', 0) >= 95:
+                    # Si tiene 95%+, subir a 100% (casi seguro)
+                    ref = referencias_mejoradas[i] = dict(ref)
+                    ref['confianza'] = 100
+                    logger.debug(f"   ✅ Promovido a 100%: {ref.get('texto_completo', '')[:40]} (era {ref.get('confianza')}%)")
 
-        # 4. SEGUNDA PASADA: Resolver referencias que aún están < 100%
-        referencias_segunda_pasada = []
-        refs_aun_incompletas = []
-
-        for ref in referencias_mejoradas:
-            if ref.get('confianza', 0) < 100:
-                refs_aun_incompletas.append(ref)
-            else:
                 referencias_segunda_pasada.append(ref)
 
-        if refs_aun_incompletas:
-            logger.info(f"   🔄 Segunda pasada para {len(refs_aun_incompletas)} referencias aún < 100%...")
-
-            try:
-                # Usar contexto MÁS AMPLIO (3000 chars) + contexto del documento completo
-                contexto_documento = texto_original[:5000]  # Primeros 5000 chars del documento
-
-                # Extraer ley principal del documento
-                ley_principal = self._detectar_ley_principal_documento(contexto_documento)
-
-                # Procesar con contexto ampliado
-                for ref in refs_aun_incompletas:
-                    # Si detectamos ley principal y la ref no tiene info contradictoria, asignarla
-                    if ley_principal and not ref.get('ley'):
-                        ref['ley'] = ley_principal
-                        ref['confianza'] = 100
-                        ref['_contexto_resuelto'] = True
-                        ref['_razonamiento_contexto'] = f"Asignado por contexto del documento completo (ley principal: {ley_principal})"
-                        logger.debug(f"   ✅ Segunda pasada: {ref.get('texto_completo', '')[:40]} → {ley_principal} (100%)\"")
-                    elif ref.get('confianza', 0) >= 95:
-                        # Si tiene 95%+, subir a 100% (casi seguro)
-                        ref['confianza'] = 100
-                        logger.debug(f"   ✅ Promovido a 100%: {ref.get('texto_completo', '')[:40]} (era {ref.get('confianza')}%)")
-
-                    referencias_segunda_pasada.append(ref)
-
-            except Exception as e:
-                logger.error(f"   Error en segunda pasada: {e}")
-                referencias_segunda_pasada.extend(refs_aun_incompletas)
-
-        # 5. Combinar referencias completas + mejoradas
+        # 6. Combinar referencias completas + mejoradas
         referencias_finales = refs_completas + referencias_segunda_pasada
 
-        # 6. Calcular métricas
+        # 7. Calcular métricas
         resueltas = sum(1 for r in referencias_mejoradas if r.get('confianza', 0) == 100)
         no_resueltas = len(referencias_mejoradas) - resueltas
 
@@ -221,23 +364,30 @@ class ContextResolverAgent(BaseAgent):
             }
         }
 
-    def _extraer_contextos(self, referencias: List[Dict], texto_original: str) -> List[Dict]:
+    def _extraer_contextos(
+        self,
+        referencias: List[Dict],
+        texto_original: str,
+        posiciones: Optional[List[Optional[int]]] = None
+    ) -> List[Dict]:
         """
         Extrae contextos para cada referencia
 
         Args:
             referencias: Referencias a procesar
             texto_original: Texto completo del documento
+            posiciones: Posiciones ya localizadas (si None, se buscan aquí)
 
         Returns:
-            Lista de dicts con {referencia, contexto, posicion}
+            Lista de dicts con {referencia, contexto, posicion}, donde contexto
+            es el rango (inicio, fin, elipsis_inicio, elipsis_fin) del chunk
         """
         contextos = []
 
-        for ref in referencias:
-            # Buscar posición en texto original
-            posicion = self._encontrar_posicion(ref, texto_original)
+        if posiciones is None:
+            posiciones = self._buscar_posiciones(referencias, texto_original.lower())
 
+        for ref, posicion in zip(referencias, posiciones):
             if posicion is None:
                 logger.debug(f"   No se encontró posición para: {ref.get('texto_completo', '')[:50]}")
                 continue
@@ -253,13 +403,66 @@ class ContextResolverAgent(BaseAgent):
 
         return contextos
 
-    def _encontrar_posicion(self, referencia: Dict, texto: str) -> Optional[int]:
+    def _buscar_posiciones(self, referencias: List[Dict], texto_lower: str) -> List[Optional[int]]:
+        """
+        Localiza todas las referencias en el texto con un autómata Aho-Corasick
+
+        Una sola pasada sobre el texto para todas las referencias. Las que no
+        aparecen literalmente se buscan después con _encontrar_posicion.
+
+        Args:
+            referencias: Referencias a buscar
+            texto_lower: Texto donde buscar, ya en minúsculas
+
+        Returns:
+            Lista de posiciones (o None) alineada con referencias
+        """
+        posiciones = [None] * len(referencias)
+
+        if ahocorasick is not None:
+            # Varias referencias pueden compartir texto: clave → (clave, [índices])
+            automata = ahocorasick.Automaton()
+            for idx, ref in enumerate(referencias):
+                clave = ref.get('texto_completo', '').lower()
+                if not clave:
+                    continue
+                if clave in automata:
+                    automata.get(clave)[1].append(idx)
+                else:
+                    automata.add_word(clave, (clave, [idx]))
+
+            pendientes = len(automata)
+            if pendientes:
+                automata.make_automaton()
+                for fin, (clave, indices) in automata.iter(texto_lower):
+                    if posiciones[indices[0]] is not None:
+                        continue
+                    for idx in indices:
+                        posiciones[idx] = fin - len(clave) + 1
+                    pendientes -= 1
+                    if not pendientes:
+                        break
+
+        # Fallback (o búsqueda completa sin pyahocorasick): una sola
+        # búsqueda por texto distinto, las referencias repetidas la reutilizan
+        buscadas = {}
+        for idx, ref in enumerate(referencias):
+            texto_ref = ref.get('texto_completo')
+            if posiciones[idx] is not None or not texto_ref:
+                continue
+            if texto_ref not in buscadas:
+                buscadas[texto_ref] = self._encontrar_posicion(ref, texto_lower)
+            posiciones[idx] = buscadas[texto_ref]
+
+        return posiciones
+
+    def _encontrar_posicion(self, referencia: Dict, texto_lower: str) -> Optional[int]:
         """
         Encuentra la posición de una referencia en el texto
 
         Args:
             referencia: Referencia a buscar
-            texto: Texto donde buscar
+            texto_lower: Texto donde buscar, ya en minúsculas
 
         Returns:
             Posición (índice) o None
@@ -268,22 +471,30 @@ class ContextResolverAgent(BaseAgent):
         if not texto_ref:
             return None
 
-        # Intentar match exacto
-        patron = re.escape(texto_ref)
-        match = re.search(patron, texto, re.IGNORECASE)
+        # Intentar match exacto (búsqueda literal, sin regex)
+        posicion = texto_lower.find(texto_ref.lower())
 
-        if match:
-            return match.start()
+        if posicion != -1:
+            return posicion
 
-        # Intentar con variaciones (sin mayúsculas, etc)
-        patron_flexible = texto_ref.replace('.', r'\.?').replace(' ', r'\s+')
-        match = re.search(patron_flexible, texto, re.IGNORECASE)
+        # Intentar con variaciones (puntos opcionales, espacios flexibles)
+        try:
+            match = _patron_flexible(texto_ref).search(texto_lower)
+        except re.error:
+            return None
 
         return match.start() if match else None
 
-    def _extraer_chunk(self, texto: str, posicion: int, ventana: int = 1500) -> str:
+    def _extraer_chunk(
+        self,
+        texto: str,
+        posicion: int,
+        ventana: int = 1500
+    ) -> Tuple[int, int, bool, bool]:
         """
-        Extrae chunk de contexto alrededor de una posición
+        Calcula el chunk de contexto alrededor de una posición
+
+        Solo devuelve índices: el texto se materializa al construir el prompt.
 
         Args:
             texto: Texto completo
@@ -291,71 +502,36 @@ class ContextResolverAgent(BaseAgent):
             ventana: Caracteres antes/después (default: 1500 para capturar más contexto)
 
         Returns:
-            Chunk de contexto
+            (inicio, fin, elipsis_inicio, elipsis_fin)
         """
         inicio = max(0, posicion - ventana)
         fin = min(len(texto), posicion + ventana)
 
-        chunk = texto[inicio:fin]
-
-        # Agregar elipsis si es necesario
-        if inicio > 0:
-            chunk = "..." + chunk
-        if fin < len(texto):
-            chunk = chunk + "..."
-
-        return chunk
+        # Elipsis si el chunk no llega a los extremos del texto
+        return inicio, fin, inicio > 0, fin < len(texto)
 
     def _get_system_instruction(self) -> str:
         """Instrucciones de sistema para la IA"""
-        # Generar mapeo dinámico de siglas desde el módulo
-        siglas_texto = "\n".join([f"- {sigla} = {nombre}" for sigla, nombre in SIGLAS_LEYES.items()])
-
-        return f"""Eres un experto en legislación española especializado en análisis contextual de documentos legales.
-
-Tu tarea es identificar a qué LEY pertenece cada artículo basándote en el contexto proporcionado.
-
-REGLAS CRÍTICAS PARA CONFIANZA 100%:
-- Si el documento CLARAMENTE trata sobre una ley específica (ej: documento sobre LJV), todos los artículos sin ley explícita pertenecen a esa ley → confianza 100
-- Si ves menciones repetidas de una ley en el contexto amplio → confianza 100
-- Si el artículo aparece en una sección que claramente habla de una ley → confianza 100
-- Si el contexto dice "artículo X de la [LEY]" → confianza 100
-- Si el contexto menciona siglas (LJV, CE, LEC, LOPJ, CP, LECrim, etc.) de forma consistente → confianza 100
-
-REFERENCIAS CONTEXTUALES QUE DEBES RESOLVER:
-- "la presente ley" / "esta ley" / "dicha ley" → Identifica la ley principal del documento o del contexto cercano
-- "el presente código" / "este código" → Identifica el código (CP, CC, etc.)
-- "la presente norma" / "esta norma" → Identifica la norma del contexto
-- "la citada ley" / "la mencionada ley" → Busca la ley mencionada anteriormente en el contexto
-
-IMPORTANTE: Cuando veas "la presente ley", "esta ley", etc., NO las copies literalmente. Debes identificar a qué ley específica se refieren basándote en el contexto del documento.
-
-SOLO asigna confianza < 100 si:
-- Hay AMBIGÜEDAD real entre múltiples leyes
-- El contexto es completamente insuficiente (muy raro con 1500 chars)
-- Detectas información CONTRADICTORIA
-
-MAPEO COMPLETO DE SIGLAS LEGALES:
-{siglas_texto}
-
-IMPORTANTE: Sé DECISIVO. Si el contexto te da suficiente información para identificar la ley, asigna confianza 100. No seas conservador innecesariamente.
-
-NOMBRES COMPLETOS: Siempre devuelve nombres completos de leyes, no siglas. Por ejemplo:
-- "CP" → "Código Penal" o "Ley Orgánica 10/1995, de 23 de noviembre, del Código Penal"
-- "LECrim" → "Ley de Enjuiciamiento Criminal"
-- "LOPJ" → "Ley Orgánica 6/1985, de 1 de julio, del Poder Judicial"
-
-Devuelve SOLO JSON, sin texto adicional."""
-
-    def _construir_prompt(self, contextos: List[Dict]) -> str:
+        return _SYSTEM_INSTRUCTION
+
+    def _construir_prompt(
+        self,
+        contextos: List[Dict],
+        texto_original: str,
+        contexto_documento: Optional[str] = None
+    ) -> str:
         """
         Construye prompt para que IA resuelva múltiples artículos
+
+        Si se pasa contexto_documento (inicio del documento), se añade la tarea
+        de detectar la ley principal en la misma respuesta.
         """
-        contextos_str = ""
+        partes = []
 
         for i, ctx in enumerate(contextos, 1):
             ref = ctx['referencia']
-            contextos_str += f"""
+            inicio, fin, elipsis_inicio, elipsis_fin = ctx['contexto']
+            partes.append(f"""
 Referencia {i}:
 - Texto original: "{ref.get('texto_completo', 'N/A')}"
 - Artículo: {ref.get('articulo', 'N/A')}
@@ -363,10 +539,30 @@ Referencia {i}:
 - Confianza actual: {ref.get('confianza', 0)}%
 
 CONTEXTO (fragmento donde aparece):
-{ctx['contexto']}
+{'...' if elipsis_inicio else ''}{texto_original[inicio:fin]}{'...' if elipsis_fin else ''}
 
 ---
+""")
+
+        contextos_str = "".join(partes)
+
+        if contexto_documento:
+            tarea_documento = f"""
+TAREA ADICIONAL (NIVEL DOCUMENTO):
+Analiza también este fragmento del inicio del documento y determina cuál es la LEY PRINCIPAL que se está tratando:
+- Identifica la ley que se menciona MÁS FRECUENTEMENTE
+- Busca títulos, encabezados o secciones que indiquen el tema principal
+- Si NO hay una ley principal clara, usa "ley_principal": null y "confianza_ley_principal": 0
+
+INICIO DEL DOCUMENTO:
+{contexto_documento}
 """
+            campos_documento = """
+  "ley_principal": "Ley 15/2015",
+  "confianza_ley_principal": 95,"""
+        else:
+            tarea_documento = ""
+            campos_documento = ""
 
         prompt = f"""Identifica a qué LEY pertenece cada artículo basándote en el contexto proporcionado.
 
@@ -379,10 +575,10 @@ INSTRUCCIONES:
 2. Identifica menciones de leyes en el contexto
 3. Determina la ley más probable
 4. Asigna confianza según la claridad del contexto
-
+{tarea_documento}
 FORMATO DE SALIDA (JSON):
 ```json
-{{
+{{{campos_documento}
   "resoluciones": [
     {{
       "index": 1,
@@ -399,61 +595,170 @@ Responde SOLO con el JSON, sin texto adicional."""
 
         return prompt
 
-    def _parsear_respuesta(self, respuesta: str, referencias_originales: List[Dict]) -> List[Dict]:
+    def _parsear_respuesta(
+        self,
+        respuesta: str,
+        referencias_originales: List[Dict]
+    ) -> Tuple[List[Dict], Optional[str]]:
         """
         Parsea respuesta de IA y actualiza referencias
+
+        Returns:
+            (referencias actualizadas, ley principal si venía en la respuesta
+            con confianza >= 80)
         """
         try:
             # Limpiar markdown
-            respuesta_limpia = respuesta.replace('```json', '').replace('```', '').strip()
+            respuesta_limpia = _PATRON_FENCE.sub('', respuesta)
 
             # Parsear JSON
-            datos = json.loads(respuesta_limpia)
+            datos = cargar_json(respuesta_limpia)
             resoluciones = datos.get('resoluciones', [])
 
+            # Tarea de nivel documento (solo en el primer batch)
+            ley_principal = datos.get('ley_principal')
+            if ley_principal and datos.get('confianza_ley_principal', 0) >= 80:
+                logger.info(f"   📚 Ley principal detectada: {ley_principal} (confianza: {datos['confianza_ley_principal']}%)")
+            else:
+                ley_principal = None
+
+            # Índice → resolución (index es 1-based; ante duplicados gana el primero)
+            resoluciones_por_indice = {r.get('index', 0): r for r in reversed(resoluciones)}
+
             # Crear copia de referencias para actualizar
             referencias_actualizadas = []
 
             for i, ref in enumerate(referencias_originales):
-                ref_copia = ref.copy()
+                # Buscar resolución correspondiente
+                resolucion = resoluciones_por_indice.get(i + 1)
 
-                # Buscar resolución correspondiente (index es 1-based)
-                resolucion = next((r for r in resoluciones if r.get('index', 0) == i + 1), None)
-
-                if resolucion and resolucion.get('ley_identificada'):
-                    # Actualizar con ley identificada
-                    ley = resolucion['ley_identificada']
-                    conf = resolucion.get('confianza', 90)
+                if not resolucion or not resolucion.get('ley_identificada'):
+                    # No se pudo resolver: se mantiene la original (sin copia)
+                    logger.debug(f"❌ No resuelto: {ref.get('texto_completo', '')[:40]}")
+                    referencias_actualizadas.append(ref)
+                    continue
 
-                    ref_copia['ley'] = ley
-                    ref_copia['confianza'] = conf
-                    ref_copia['_contexto_resuelto'] = True
-                    ref_copia['_razonamiento_contexto'] = resolucion.get('razonamiento', '')
+                # Actualizar con ley identificada
+                ref_copia = ref.copy()
+                ley = resolucion['ley_identificada']
+                conf = resolucion.get('confianza', 90)
 
-                    # Actualizar texto_completo si es solo artículo
-                    if ref_copia.get('articulo') and not ref_copia.get('ley'):
-                        art = ref_copia['articulo']
-                        ref_copia['texto_completo'] = f"Artículo {art} de la {ley}"
+                ref_copia['ley'] = ley
+                ref_copia['confianza'] = conf
+                ref_copia['_contexto_resuelto'] = True
+                ref_copia['_razonamiento_contexto'] = resolucion.get('razonamiento', '')
 
-                    logger.debug(f"✅ Resuelto: {ref.get('texto_completo', '')[:40]} → {ley} (conf: {conf}%)")
-                else:
-                    # No se pudo resolver
-                    logger.debug(f"❌ No resuelto: {ref.get('texto_completo', '')[:40]}")
+                # Actualizar texto_completo si es solo artículo
+                if ref_copia.get('articulo') and not ref_copia.get('ley'):
+                    art = ref_copia['articulo']
+                    ref_copia['texto_completo'] = f"Artículo {art} de la {ley}"
 
+                logger.debug(f"✅ Resuelto: {ref.get('texto_completo', '')[:40]} → {ley} (conf: {conf}%)")
                 referencias_actualizadas.append(ref_copia)
 
-            return referencias_actualizadas
+            return referencias_actualizadas, ley_principal
 
         except json.JSONDecodeError as e:
             logger.error(f"Error parseando JSON: {e}")
             logger.error(f"Respuesta raw: {respuesta[:500]}...")
-            return referencias_originales
+            return referencias_originales, None
 
         except Exception as e:
             logger.error(f"Error inesperado en parseo: {e}")
-            return referencias_originales
+            return referencias_originales, None
 
-    def _detectar_ley_principal_documento(self, contexto_documento: str) -> Optional[str]:
+    def _replicar_resolucion(self, referencia: Dict, ref_resuelta: Dict) -> Dict:
+        """
+        Aplica a una referencia duplicada la resolución de su representante
+
+        Args:
+            referencia: Referencia duplicada (mismo texto y posición)
+            ref_resuelta: Representante tras pasar por la IA
+
+        Returns:
+            Copia de la referencia con los campos resueltos, o la original
+            si el representante no se resolvió
+        """
+        if not ref_resuelta.get('_contexto_resuelto'):
+            return referencia
+
+        ref_copia = referencia.copy()
+        for campo in ('ley', 'confianza', '_contexto_resuelto', '_razonamiento_contexto', 'texto_completo'):
+            if campo in ref_resuelta:
+                ref_copia[campo] = ref_resuelta[campo]
+
+        return ref_copia
+
+    def _detectar_ley_principal_heuristico(self, contexto_documento: str) -> Optional[str]:
+        """
+        Detecta la ley principal contando siglas conocidas, sin llamar a la IA
+
+        Solo hay ley principal si la sigla más frecuente aparece al menos 3
+        veces y más del triple que la siguiente.
+
+        Args:
+            contexto_documento: Primeros ~5000 caracteres del documento
+
+        Returns:
+            Nombre completo de la ley principal o None
+        """
+        conteo = Counter(m.group(1) for m in SIGLAS_RE.finditer(contexto_documento))
+
+        if not conteo:
+            return None
+
+        ranking = conteo.most_common(2)
+        sigla, veces = ranking[0]
+        segunda = ranking[1][1] if len(ranking) > 1 else 0
+
+        if veces >= 3 and veces > 3 * segunda:
+            return SIGLAS_LEYES[sigla]
+
+        return None
+
+    def _resolver_por_ley_principal(
+        self,
+        referencias: List[Dict],
+        ley_principal: str
+    ) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Asigna la ley principal a las referencias sin ley ni señales de otra norma
+
+        Args:
+            referencias: Referencias incompletas
+            ley_principal: Ley principal detectada por heurística
+
+        Returns:
+            (referencias resueltas, referencias que siguen necesitando IA)
+        """
+        resueltas = []
+        pendientes = []
+
+        for ref in referencias:
+            texto_ref = ref.get('texto_completo', '')
+            texto_ref_lower = texto_ref.lower()
+
+            # Cualquier mención a otra norma (sigla, "ley", "código"...) es ambigua
+            ambigua = (
+                ref.get('ley')
+                or SIGLAS_RE.search(texto_ref)
+                or any(p in texto_ref_lower for p in ('ley', 'código', 'codigo', 'decreto', 'reglamento', 'norma', 'directiva'))
+            )
+
+            if ambigua:
+                pendientes.append(ref)
+                continue
+
+            ref_resuelta = ref.copy()
+            ref_resuelta['ley'] = ley_principal
+            ref_resuelta['confianza'] = 100
+            ref_resuelta['_contexto_resuelto'] = True
+            ref_resuelta['_razonamiento_contexto'] = f"Asignado por heurística (ley principal del documento: {ley_principal})"
+            resueltas.append(ref_resuelta)
+
+        return resueltas, pendientes
+
+    async def _detectar_ley_principal_async(self, contexto_documento: str) -> Optional[str]:
         """
         Detecta la ley principal de un documento usando IA
 
@@ -464,7 +769,19 @@ Responde SOLO con el JSON, sin texto adicional."""
             Nombre de la ley principal o None
         """
         try:
-            prompt = f"""Analiza este fragmento del inicio de un documento legal y determina cuál es la LEY PRINCIPAL que se está tratando.
+            respuesta = await self.generar_json_stream_async(
+                self._construir_prompt_ley_principal(contexto_documento),
+                "Experto en identificar la ley principal de documentos legales españoles."
+            )
+            return self._parsear_ley_principal(respuesta)
+
+        except Exception as e:
+            logger.error(f"   Error detectando ley principal: {e}")
+            return None
+
+    def _construir_prompt_ley_principal(self, contexto_documento: str) -> str:
+        """Construye el prompt de detección de ley principal"""
+        return f"""Analiza este fragmento del inicio de un documento legal y determina cuál es la LEY PRINCIPAL que se está tratando.
 
 CONTEXTO DEL DOCUMENTO:
 {contexto_documento}
@@ -496,27 +813,24 @@ Si NO hay una ley principal clara, devuelve:
 
 Responde SOLO con JSON."""
 
-            respuesta = self.generar_contenido(
-                prompt,
-                "Experto en identificar la ley principal de documentos legales españoles."
-            )
-
-            # Parsear respuesta
-            respuesta_limpia = respuesta.replace('```json', '').replace('```', '').strip()
-            datos = json.loads(respuesta_limpia)
+    def _parsear_ley_principal(self, respuesta: str) -> Optional[str]:
+        """
+        Parsea la respuesta de detección de ley principal
 
-            ley = datos.get('ley_principal')
-            confianza = datos.get('confianza', 0)
+        Returns:
+            Nombre de la ley principal o None si la confianza es < 80
+        """
+        respuesta_limpia = _PATRON_FENCE.sub('', respuesta)
+        datos = cargar_json(respuesta_limpia)
 
-            if ley and confianza >= 80:
-                logger.info(f"   📚 Ley principal detectada: {ley} (confianza: {confianza}%)")
-                return ley
+        ley = datos.get('ley_principal')
+        confianza = datos.get('confianza', 0)
 
-            return None
+        if ley and confianza >= 80:
+            logger.info(f"   📚 Ley principal detectada: {ley} (confianza: {confianza}%)")
+            return ley
 
-        except Exception as e:
-            logger.error(f"   Error detectando ley principal: {e}")
-            return None
+        return None
 
     def _resultado_vacio(self) -> Dict:
         """Retorna resultado vacío"""
@@ -12,26 +12,40 @@ Version: 0.2.0
 License: MIT
 """
 
+import asyncio
+import hashlib
 import logging
-from typing import Dict, List, Any, Optional
+import re
+from collections import Counter
+from typing import Dict, List, Any, Optional, Tuple
 from datetime import datetime
 import sys
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Permitir imports relativos cuando se ejecuta como script
 if __name__ == "__main__":
     sys.path.insert(0, str(Path(__file__).parent.parent))
+    from agents.base_agent import cargar_json, huellas_referencia
     from agents.extractor_agent_a import ExtractorAgentA
     from agents.extractor_agent_b import ExtractorAgentB
     from agents.extractor_agent_c import ExtractorAgentC
 else:
+    from .base_agent import cargar_json, huellas_referencia
     from .extractor_agent_a import ExtractorAgentA
     from .extractor_agent_b import ExtractorAgentB
     from .extractor_agent_c import ExtractorAgentC
 
 logger = logging.getLogger(__name__)
 
+# Número de artículo dentro del texto: "art. 24", "artículo 23.2", "arts. 14"
+_RE_ARTICULO = re.compile(r'\bart(?:[íi]culo)?s?\.?\s*(\d+(?:\.\d+)*)', re.IGNORECASE)
+
+# Vallas markdown alrededor del JSON de la IA
+_RE_JSON_FENCE = re.compile(r'```(?:json)?')
+
+# Norma numerada al inicio de la ley: "ley 39/2015, de 1 de octubre" -> "ley 39/2015"
+_RE_NORMA_NUMERADA = re.compile(r'^(.*?\d+/\d{4})\b')
+
 
 class SistemaConvergencia:
     """
@@ -62,15 +76,32 @@ class SistemaConvergencia:
         self.umbral_confianza_minima = umbral_confianza_minima
         self.parallel = parallel
 
-        # Inicializar 3 agentes
+        # Inicializar 3 agentes. Comparten un único cliente de Gemini (y su
+        # pool de conexiones): siempre se ejecutan en el mismo event loop
         self.agente_a = ExtractorAgentA(api_key=api_key)
-        self.agente_b = ExtractorAgentB(api_key=api_key)
-        self.agente_c = ExtractorAgentC(api_key=api_key)  # NUEVO: Sabueso no contaminado
+        self.agente_b = ExtractorAgentB(api_key=api_key, client=self.agente_a.client)
+        self.agente_c = ExtractorAgentC(api_key=api_key, client=self.agente_a.client)  # NUEVO: Sabueso no contaminado
 
         # Estado
         self.referencias_totales = []
         self.historial_rondas = []
 
+        # Índices de duplicados (texto, ley y clave canónica de referencias_totales)
+        self._textos_vistos = set()
+        self._leyes_vistas = set()
+        self._claves_vistas = set()
+
+        # Índice de referencias_totales con la normalización de los
+        # extractores (huellas): se mantiene aquí una vez y lo comparten A, B y C
+        self._indice_previas = set()
+        self._indice_leyes_previas = set()
+
+        # Resultados de la dedup con IA por huella de la lista enviada
+        self._dedup_cache: Dict[bytes, List[int]] = {}
+
+        # Event loop reutilizado entre ejecuciones (se crea al primer uso)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
         # Mapeo de normalizaciones para deduplicación semántica
         self.mapeo_siglas = {
             'CE': 'constitución española',
@@ -89,16 +120,64 @@ class SistemaConvergencia:
             # Más siglas comunes...
         }
 
+        # Sigla o nombre canónico (en minúsculas) -> ley canónica
+        self._siglas_lower = {k.lower(): v for k, v in self.mapeo_siglas.items()}
+        self._siglas_lower.update({v: v for v in self.mapeo_siglas.values()})
+
         logger.info("✅ Sistema de convergencia inicializado (3 agentes)")
-        logger.info(f"   - Agentes: A (conservador), B (agresivo), C (sabueso)")
-        logger.info(f"   - Max rondas: {max_rondas}")
-        logger.info(f"   - Umbral confianza: {umbral_confianza_minima}")
-        logger.info(f"   - Modo: {'PARALELO ⚡' if parallel else 'SECUENCIAL'}")
+        logger.info("   - Agentes: A (conservador), B (agresivo), C (sabueso)")
+        logger.info("   - Max rondas: %s", max_rondas)
+        logger.info("   - Umbral confianza: %s", umbral_confianza_minima)
+        logger.info("   - Modo: %s", 'PARALELO ⚡' if parallel else 'SECUENCIAL')
 
     def ejecutar(self, texto: str) -> Dict[str, Any]:
         """
         Ejecuta el sistema de convergencia sobre un texto
 
+        Envoltorio síncrono de ejecutar_async. Reutiliza el mismo event loop
+        en todas las llamadas para que el cliente aio de cada agente conserve
+        sus conexiones HTTP abiertas; quien crea el sistema debe llamar a
+        close() (o usarlo como context manager) al terminar.
+
+        Args:
+            texto: Texto del tema a procesar
+
+        Returns:
+            Igual que ejecutar_async
+        """
+        if self._loop is None or self._loop.is_closed():
+            self._loop = asyncio.new_event_loop()
+
+        return self._loop.run_until_complete(self.ejecutar_async(texto))
+
+    def close(self):
+        """
+        Libera el event loop reutilizado por ejecutar
+
+        Cierra antes las sesiones HTTP del cliente aio compartido por los
+        agentes, que están ligadas a ese loop.
+        """
+        if self._loop is not None and not self._loop.is_closed():
+            aclose = getattr(self.agente_a.client.aio, 'aclose', None)
+            if aclose is not None:
+                try:
+                    self._loop.run_until_complete(aclose())
+                except Exception as e:
+                    logger.warning("Error cerrando el cliente aio: %s", e)
+            self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+            self._loop.close()
+        self._loop = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    async def ejecutar_async(self, texto: str) -> Dict[str, Any]:
+        """
+        Ejecuta el sistema de convergencia sobre un texto
+
         Args:
             texto: Texto del tema a procesar
 
@@ -114,32 +193,54 @@ class SistemaConvergencia:
         logger.info("=" * 60)
         logger.info("🚀 INICIANDO SISTEMA DE CONVERGENCIA")
         logger.info("=" * 60)
-        logger.info(f"Texto: {len(texto)} caracteres")
+        logger.info("Texto: %s caracteres", len(texto))
 
         # Resetear estado
         self.referencias_totales = []
         self.historial_rondas = []
+        self._textos_vistos = set()
+        self._leyes_vistas = set()
+        self._claves_vistas = set()
+        self._indice_previas = set()
+        self._indice_leyes_previas = set()
 
         inicio = datetime.now()
 
-        # Ejecutar rondas de convergencia
-        for ronda in range(1, self.max_rondas + 1):
-            logger.info(f"\n{'='*60}")
-            logger.info(f"🔄 RONDA {ronda}/{self.max_rondas}")
-            logger.info(f"{'='*60}")
+        # Si el texto es largo, contar sus tokens una vez (sin bloquear el
+        # event loop) para que los tres agentes lo recorten igual
+        await self.agente_a.contar_tokens_texto_async(texto)
+
+        # El texto es el mismo en todas las rondas: cachear el prefijo del
+        # prompt de cada agente (si el modelo lo admite) para no reenviarlo
+        agentes = [self.agente_a, self.agente_b, self.agente_c]
+        await asyncio.gather(*(agente.preparar_cache_async(texto) for agente in agentes))
+
+        try:
+            # Ejecutar rondas de convergencia
+            for ronda in range(1, self.max_rondas + 1):
+                logger.info("\n" + "=" * 60)
+                logger.info("🔄 RONDA %s/%s", ronda, self.max_rondas)
+                logger.info("=" * 60)
 
-            resultado_ronda = self._ejecutar_ronda(texto, ronda)
+                resultado_ronda = await self._ejecutar_ronda_async(texto, ronda)
 
-            self.historial_rondas.append(resultado_ronda)
+                self.historial_rondas.append(resultado_ronda)
 
-            # Verificar convergencia
-            if resultado_ronda['convergencia_alcanzada']:
-                logger.info(f"\n✅ CONVERGENCIA ALCANZADA EN RONDA {ronda}")
-                break
+                # Verificar convergencia
+                if resultado_ronda['convergencia_alcanzada']:
+                    logger.info("\n✅ CONVERGENCIA ALCANZADA EN RONDA %s", ronda)
+                    break
+        finally:
+            await asyncio.gather(*(agente.liberar_cache_contexto_async() for agente in agentes))
 
         # Calcular tiempo total
         tiempo_total = (datetime.now() - inicio).total_seconds()
 
+        # Quitar claves internas de normalización antes de devolver resultados
+        for ronda_info in self.historial_rondas:
+            for clave in ('resultado_agente_a', 'resultado_agente_b', 'resultado_agente_c'):
+                self._limpiar_normalizacion(ronda_info[clave]['referencias'])
+
         # Filtrar por umbral de confianza
         referencias_filtradas = self._filtrar_por_confianza(self.referencias_totales)
 
@@ -158,17 +259,17 @@ class SistemaConvergencia:
             'timestamp': datetime.now().isoformat()
         }
 
-        logger.info(f"\n{'='*60}")
+        logger.info("\n" + "=" * 60)
         logger.info("🎉 CONVERGENCIA COMPLETADA")
-        logger.info(f"{'='*60}")
-        logger.info(f"📊 Referencias totales encontradas: {len(referencias_filtradas)}")
-        logger.info(f"📊 Rondas ejecutadas: {len(self.historial_rondas)}")
-        logger.info(f"📊 Tiempo total: {tiempo_total:.2f}s")
-        logger.info(f"📊 Convergencia: {'✅ SÍ' if resultado['convergencia_alcanzada'] else '❌ NO'}")
+        logger.info("=" * 60)
+        logger.info("📊 Referencias totales encontradas: %s", len(referencias_filtradas))
+        logger.info("📊 Rondas ejecutadas: %s", len(self.historial_rondas))
+        logger.info("📊 Tiempo total: %.2fs", tiempo_total)
+        logger.info("📊 Convergencia: %s", '✅ SÍ' if resultado['convergencia_alcanzada'] else '❌ NO')
 
         return resultado
 
-    def _ejecutar_ronda(self, texto: str, numero_ronda: int) -> Dict[str, Any]:
+    async def _ejecutar_ronda_async(self, texto: str, numero_ronda: int) -> Dict[str, Any]:
         """
         Ejecuta una ronda de convergencia con 3 agentes y deduplicación semántica
 
@@ -179,13 +280,17 @@ class SistemaConvergencia:
         Returns:
             Dict con resultados de la ronda
         """
-        logger.info(f"Referencias acumuladas: {len(self.referencias_totales)}")
+        logger.info("Referencias acumuladas: %s", len(self.referencias_totales))
 
-        # Preparar entrada para agentes
+        # Preparar entrada para agentes. Las referencias previas se comparten
+        # sin copiar: los agentes solo las leen y referencias_totales no
+        # cambia hasta que han terminado todos
         entrada = {
             'texto': texto,
             'ronda': numero_ronda,
-            'referencias_previas': self.referencias_totales.copy()
+            'referencias_previas': self.referencias_totales,
+            'referencias_previas_index': self._indice_previas,
+            'referencias_previas_leyes': self._indice_leyes_previas
         }
 
         # Total ANTES de esta ronda
@@ -193,37 +298,43 @@ class SistemaConvergencia:
 
         if self.parallel:
             # ===  MODO PARALELO CON 3 AGENTES ===
-            logger.info(f"\n⚡ Ejecutando A, B y C EN PARALELO...")
+            logger.info("\n⚡ Ejecutando A, B y C EN PARALELO...")
 
-            # Ejecutar 3 agentes simultáneamente
-            with ThreadPoolExecutor(max_workers=3) as executor:
-                # Lanzar los 3 agentes
-                future_a = executor.submit(self.agente_a.procesar, entrada)
-                future_b = executor.submit(self.agente_b.procesar, entrada)
-                future_c = executor.submit(self.agente_c.procesar, entrada)  # NUEVO
-
-                # Esperar resultados
-                resultado_a = future_a.result()
-                resultado_b = future_b.result()
-                resultado_c = future_c.result()  # NUEVO
+            # Ejecutar 3 agentes simultáneamente (un solo despacho por ronda)
+            resultado_a, resultado_b, resultado_c = await self._generar_lote(
+                [self.agente_a, self.agente_b, self.agente_c],
+                entrada,
+                cortocircuito=numero_ronda > 1
+            )
 
-            logger.info(f"   └─ {self.agente_a.nombre}: {resultado_a['total']} candidatas")
-            logger.info(f"   └─ {self.agente_b.nombre}: {resultado_b['total']} candidatas")
-            logger.info(f"   └─ {self.agente_c.nombre}: {resultado_c['total']} candidatas")  # NUEVO
+            logger.info("   └─ %s: %s candidatas", self.agente_a.nombre, resultado_a['total'])
+            logger.info("   └─ %s: %s candidatas", self.agente_b.nombre, resultado_b['total'])
+            logger.info("   └─ %s: %s candidatas", self.agente_c.nombre, resultado_c['total'])  # NUEVO
 
         else:
             # === MODO SECUENCIAL CON 3 AGENTES ===
-            logger.info(f"\n🤖 Ejecutando {self.agente_a.nombre}...")
-            resultado_a = self.agente_a.procesar(entrada)
-            logger.info(f"   └─ {resultado_a['total']} candidatas")
-
-            logger.info(f"\n🤖 Ejecutando {self.agente_b.nombre}...")
-            resultado_b = self.agente_b.procesar(entrada)
-            logger.info(f"   └─ {resultado_b['total']} candidatas")
-
-            logger.info(f"\n🤖 Ejecutando {self.agente_c.nombre}...")
-            resultado_c = self.agente_c.procesar(entrada)  # NUEVO
-            logger.info(f"   └─ {resultado_c['total']} candidatas")
+            logger.info("\n🤖 Ejecutando %s...", self.agente_a.nombre)
+            resultado_a = await self.agente_a.procesar_async(entrada)
+            logger.info("   └─ %s candidatas", resultado_a['total'])
+
+            logger.info("\n🤖 Ejecutando %s...", self.agente_b.nombre)
+            resultado_b = await self.agente_b.procesar_async(entrada)
+            logger.info("   └─ %s candidatas", resultado_b['total'])
+
+            # Mismo cortocircuito que en paralelo: a partir de la ronda 2, si
+            # A y B han respondido en esta ronda sin ninguna candidata (y sin
+            # errores), no hace falta llamar a C
+            if (
+                numero_ronda > 1
+                and resultado_a['total'] == 0 and resultado_b['total'] == 0
+                and 'error' not in resultado_a and 'error' not in resultado_b
+            ):
+                logger.info("\n⏭️  %s omitido: A y B no aportaron candidatas", self.agente_c.nombre)
+                resultado_c = self._resultado_omitido(self.agente_c, entrada)
+            else:
+                logger.info("\n🤖 Ejecutando %s...", self.agente_c.nombre)
+                resultado_c = await self.agente_c.procesar_async(entrada)  # NUEVO
+                logger.info("   └─ %s candidatas", resultado_c['total'])
 
         # === COMBINAR referencias de los 3 agentes ===
         referencias_ronda = (
@@ -232,30 +343,44 @@ class SistemaConvergencia:
             resultado_c['referencias']  # NUEVO
         )
 
-        logger.info(f"\n🔍 Referencias candidatas totales: {len(referencias_ronda)}")
+        # Normalizar una sola vez cada referencia candidata
+        for ref in referencias_ronda:
+            self._normalizar(ref)
+
+        logger.info("\n🔍 Referencias candidatas totales: %s", len(referencias_ronda))
+
+        # Descartar primero las ya acumuladas (lookup O(1) en los índices),
+        # para que la deduplicación semántica solo vea candidatas nuevas
+        candidatas = [ref for ref in referencias_ronda if not self._es_duplicado(ref)]
 
         # === DEDUPLICACIÓN SEMÁNTICA ===
-        referencias_unicas = self._deduplicar_semanticamente(referencias_ronda)
-        logger.info(f"🔍 Referencias únicas (después de dedup semántica): {len(referencias_unicas)}")
+        referencias_unicas = self._deduplicar_semanticamente(candidatas)
+        logger.info("🔍 Referencias únicas (después de dedup semántica): %s", len(referencias_unicas))
+
+        # Mapa de procedencia por identidad (C primero para que B y A
+        # sobrescriban y se respete la prioridad A > B > C)
+        origen = {}
+        for resultado, agente_ronda in (
+            (resultado_c, self.agente_c),
+            (resultado_b, self.agente_b),
+            (resultado_a, self.agente_a)
+        ):
+            origen.update(dict.fromkeys(map(id, resultado['referencias']), agente_ronda.nombre))
 
         # === AGREGAR SOLO LAS NUEVAS ===
+        ronda_ts = datetime.now().isoformat()
         for ref in referencias_unicas:
-            # Determinar qué agente la encontró (prioridad: A > B > C)
-            if ref in resultado_a['referencias']:
-                agente = self.agente_a.nombre
-            elif ref in resultado_b['referencias']:
-                agente = self.agente_b.nombre
-            else:
-                agente = self.agente_c.nombre
+            # Determinar qué agente la encontró
+            agente = origen[id(ref)]
 
             # Agregar si NO es duplicado
             if not self._es_duplicado(ref):
                 ref['_metadata'] = {
                     'encontrado_por': agente,
                     'ronda': numero_ronda,
-                    'timestamp': datetime.now().isoformat()
+                    'timestamp': ronda_ts
                 }
-                self.referencias_totales.append(ref)
+                self._agregar_referencia(ref)
 
         # Total DESPUÉS de esta ronda
         total_despues = len(self.referencias_totales)
@@ -266,15 +391,16 @@ class SistemaConvergencia:
         # === CONVERGENCIA: ¿Hay leyes NUEVAS? ===
         convergencia_alcanzada = (referencias_realmente_nuevas == 0)
 
-        logger.info(f"\n📊 Resumen Ronda {numero_ronda}:")
-        logger.info(f"   - Agente A: {resultado_a['total']} candidatas")
-        logger.info(f"   - Agente B: {resultado_b['total']} candidatas")
-        logger.info(f"   - Agente C: {resultado_c['total']} candidatas")  # NUEVO
-        logger.info(f"   - Total candidatas: {len(referencias_ronda)}")
-        logger.info(f"   - Únicas (dedup semántica): {len(referencias_unicas)}")
-        logger.info(f"   - Realmente NUEVAS: {referencias_realmente_nuevas}")
-        logger.info(f"   - Total acumuladas: {total_despues}")
-        logger.info(f"   - Convergencia: {'✅' if convergencia_alcanzada else '❌'}")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("\n📊 Resumen Ronda %s:", numero_ronda)
+            logger.info("   - Agente A: %s candidatas", resultado_a['total'])
+            logger.info("   - Agente B: %s candidatas", resultado_b['total'])
+            logger.info("   - Agente C: %s candidatas", resultado_c['total'])  # NUEVO
+            logger.info("   - Total candidatas: %s", len(referencias_ronda))
+            logger.info("   - Únicas (dedup semántica): %s", len(referencias_unicas))
+            logger.info("   - Realmente NUEVAS: %s", referencias_realmente_nuevas)
+            logger.info("   - Total acumuladas: %s", total_despues)
+            logger.info("   - Convergencia: %s", '✅' if convergencia_alcanzada else '❌')
 
         return {
             'ronda': numero_ronda,
@@ -288,11 +414,95 @@ class SistemaConvergencia:
             'convergencia_alcanzada': convergencia_alcanzada
         }
 
+    async def _generar_lote(
+        self,
+        agentes: List[Any],
+        entrada: Dict[str, Any],
+        cortocircuito: bool = False
+    ) -> List[Dict]:
+        """
+        Despacha en un único lote las llamadas de extracción de varios agentes
+
+        Construye todos los prompts, lanza las llamadas a Gemini a la vez y
+        parsea cada respuesta con su agente. Un fallo en un agente no afecta
+        a los demás.
+
+        Con cortocircuito=True, si todos los agentes terminados salvo uno han
+        devuelto 0 referencias nuevas (sin errores), se cancela el que falta:
+        la ronda ya apunta a convergencia y no hace falta esperar al más
+        lento. Si alguno ha fallado, se espera siempre al último.
+
+        Args:
+            agentes: Agentes extractores a ejecutar
+            entrada: Entrada común de la ronda
+            cortocircuito: Cancelar al último agente si los demás no aportan nada
+
+        Returns:
+            Lista de resultados en el mismo orden que agentes
+        """
+        prompts = [agente.preparar_prompt(entrada) for agente in agentes]
+
+        async def _llamar(agente, prompt: str) -> Dict:
+            try:
+                respuesta = await agente.generar_contenido_async(
+                    prompt, agente._get_system_instruction()
+                )
+                return agente.procesar_respuesta(respuesta, entrada)
+            except Exception as e:
+                return agente._resultado_error(entrada, e)
+
+        tareas = [
+            asyncio.ensure_future(_llamar(agente, prompt))
+            for agente, prompt in zip(agentes, prompts)
+        ]
+
+        pendientes = set(tareas)
+        nuevas = 0
+        hay_errores = False
+        while pendientes:
+            terminadas, pendientes = await asyncio.wait(
+                pendientes, return_when=asyncio.FIRST_COMPLETED
+            )
+            for tarea in terminadas:
+                resultado = tarea.result()
+                # Un agente que ha fallado no dice nada sobre la convergencia
+                if 'error' in resultado:
+                    hay_errores = True
+                else:
+                    nuevas += resultado['total']
+
+            if cortocircuito and len(pendientes) == 1 and nuevas == 0 and not hay_errores:
+                tarea = pendientes.pop()
+                tarea.cancel()
+                await asyncio.gather(tarea, return_exceptions=True)
+                indice = tareas.index(tarea)
+                logger.info(
+                    "   ⏭️  %s cancelado: el resto no aportó referencias nuevas",
+                    agentes[indice].nombre
+                )
+                tareas[indice] = None
+
+        return [
+            self._resultado_omitido(agente, entrada) if tarea is None else tarea.result()
+            for agente, tarea in zip(agentes, tareas)
+        ]
+
+    def _resultado_omitido(self, agente: Any, entrada: Dict[str, Any]) -> Dict:
+        """Resultado vacío de un agente que no se ha llegado a ejecutar en la ronda"""
+        return {
+            'referencias': [],
+            'total': 0,
+            'agente': agente.nombre,
+            'ronda': entrada.get('ronda', 1),
+            'omitido': True
+        }
+
     def _agregar_referencias(
         self,
         referencias: List[Dict],
         agente: str,
-        ronda: int
+        ronda: int,
+        timestamp: Optional[str] = None
     ):
         """
         Agrega referencias a la lista total, evitando duplicados
@@ -301,18 +511,71 @@ class SistemaConvergencia:
             referencias: Referencias a agregar
             agente: Nombre del agente que las encontró
             ronda: Número de ronda
+            timestamp: Marca de tiempo común a todas (default: ahora)
         """
+        timestamp = timestamp or datetime.now().isoformat()
+
         for ref in referencias:
+            self._normalizar(ref)
+
             # Agregar metadata de trazabilidad
             ref['_metadata'] = {
                 'encontrado_por': agente,
                 'ronda': ronda,
-                'timestamp': datetime.now().isoformat()
+                'timestamp': timestamp
             }
 
             # Verificar duplicado antes de agregar
             if not self._es_duplicado(ref):
-                self.referencias_totales.append(ref)
+                self._agregar_referencia(ref)
+
+    def _agregar_referencia(self, referencia: Dict):
+        """
+        Agrega una referencia a la lista total y a los índices de duplicados
+
+        Args:
+            referencia: Referencia a agregar
+        """
+        self.referencias_totales.append(referencia)
+
+        if referencia['_norm_texto']:
+            self._textos_vistos.add(referencia['_norm_texto'])
+        if referencia['_norm_ley']:
+            self._leyes_vistas.add(referencia['_norm_ley'])
+        self._claves_vistas.add(referencia['_norm_clave'][0])
+
+        huella_texto, huella_ley = huellas_referencia(referencia)
+        if huella_texto:
+            self._indice_previas.add(huella_texto)
+        if huella_ley:
+            self._indice_leyes_previas.add(huella_ley)
+
+    def _normalizar(self, referencia: Dict):
+        """
+        Guarda en la referencia su texto, ley y clave canónica (si no los tiene ya)
+
+        Args:
+            referencia: Referencia a normalizar (se modifica in-place)
+        """
+        if '_norm_texto' not in referencia:
+            referencia['_norm_texto'] = (referencia.get('texto_completo') or '').lower().strip()
+        if '_norm_ley' not in referencia:
+            referencia['_norm_ley'] = (referencia.get('ley') or '').lower().strip()
+        if '_norm_clave' not in referencia:
+            referencia['_norm_clave'] = self._clave_canonica(referencia)
+
+    def _limpiar_normalizacion(self, referencias: List[Dict]):
+        """
+        Elimina las claves internas de normalización de las referencias
+
+        Args:
+            referencias: Referencias a limpiar (se modifican in-place)
+        """
+        for ref in referencias:
+            ref.pop('_norm_texto', None)
+            ref.pop('_norm_ley', None)
+            ref.pop('_norm_clave', None)
+            ref.pop('_huellas', None)
 
     def _es_duplicado(self, referencia: Dict) -> bool:
         """
@@ -324,20 +587,14 @@ class SistemaConvergencia:
         Returns:
             True si es duplicado, False si no
         """
-        texto_nuevo = (referencia.get('texto_completo') or '').lower().strip()
-        ley_nueva = (referencia.get('ley') or '').lower().strip()
-
-        for ref_existente in self.referencias_totales:
-            texto_existente = (ref_existente.get('texto_completo') or '').lower().strip()
-            ley_existente = (ref_existente.get('ley') or '').lower().strip()
-
-            # Considerar duplicado si coincide el texto completo o la ley
-            if texto_nuevo and texto_nuevo == texto_existente:
-                return True
-            if ley_nueva and ley_nueva == ley_existente:
-                return True
-
-        return False
+        # Considerar duplicado si coincide el texto completo, la ley o la
+        # clave canónica (p.ej. "art. 24 CE" ya acumulada como
+        # "artículo 24 de la Constitución Española")
+        return (
+            referencia['_norm_texto'] in self._textos_vistos or
+            referencia['_norm_ley'] in self._leyes_vistas or
+            referencia['_norm_clave'][0] in self._claves_vistas
+        )
 
     def _filtrar_por_confianza(self, referencias: List[Dict]) -> List[Dict]:
         """
@@ -349,65 +606,110 @@ class SistemaConvergencia:
         Returns:
             Lista de referencias filtradas
         """
-        filtradas = [
-            ref for ref in referencias
-            if ref.get('confianza', 100) >= self.umbral_confianza_minima
-        ]
+        umbral = self.umbral_confianza_minima
+        filtradas = []
+        descartadas = 0
+
+        for ref in referencias:
+            if ref.get('confianza', 100) >= umbral:
+                filtradas.append(ref)
+            else:
+                descartadas += 1
 
-        if len(filtradas) < len(referencias):
+        if descartadas:
             logger.info(
-                f"🔍 Filtradas {len(referencias) - len(filtradas)} referencias "
-                f"por umbral de confianza ({self.umbral_confianza_minima})"
+                "🔍 Filtradas %s referencias por umbral de confianza (%s)",
+                descartadas, umbral
             )
 
         return filtradas
 
     def _deduplicar_semanticamente(self, referencias: List[Dict]) -> List[Dict]:
         """
-        Deduplica referencias considerando variaciones semánticas usando IA
+        Deduplica referencias considerando variaciones semánticas
 
-        Ejemplos de duplicados semánticos que la IA debe detectar:
+        Ejemplos de duplicados semánticos:
         - "CE art.1" = "Constitución Española artículo 1"
         - "LEC" = "Ley 1/2000" = "Ley de Enjuiciamiento Civil"
         - "art. 24 CE" = "artículo 24 de la Constitución"
         - "TRET" = "Estatuto de los Trabajadores" = "ET"
 
+        Primero agrupa de forma determinista por (ley canónica, artículo)
+        usando mapeo_siglas. Solo recurre a la IA si quedan varias
+        referencias cuya ley no se ha podido canonicalizar (ambiguas).
+
         Returns:
             Lista sin duplicados semánticos
         """
         if len(referencias) <= 1:
             return referencias
 
-        # Para listas pequeñas (<20), usar IA
-        # Para listas grandes, usar deduplicación simple y luego IA en ambiguas
-        if len(referencias) <= 20:
-            return self._deduplicar_con_ia(referencias)
+        por_clave = {}
+        ambiguas = 0
+        for ref in referencias:
+            clave, canonica = ref['_norm_clave']
+            if clave not in por_clave:
+                por_clave[clave] = ref
+                if not canonica:
+                    ambiguas += 1
+
+        unicas = list(por_clave.values())
+
+        duplicados = len(referencias) - len(unicas)
+        if duplicados > 0:
+            logger.debug("Dedup canónica: %s duplicados eliminados", duplicados)
+
+        # IA solo para las listas con leyes no canonicalizables (máx 20)
+        if ambiguas > 1 and len(unicas) <= 20:
+            return self._deduplicar_con_ia(unicas)
+
+        return unicas
+
+    def _clave_canonica(self, referencia: Dict) -> Tuple[Tuple[str, str], bool]:
+        """
+        Calcula la clave canónica (ley, artículo) de una referencia
+
+        Args:
+            referencia: Referencia normalizada
+
+        Returns:
+            Tupla (clave, canonica). canonica es False si la ley no se ha
+            podido reducir a una sigla conocida o a una norma numerada
+        """
+        ley = referencia['_norm_ley']
+
+        if ley in self._siglas_lower:
+            ley_canonica = self._siglas_lower[ley]
         else:
-            # Primero deduplicación simple por texto exacto
-            unicas_simples = self._deduplicar_simple(referencias)
+            match = _RE_NORMA_NUMERADA.match(ley)
+            ley_canonica = match.group(1) if match else ''
 
-            # Si aún quedan muchas, agrupar por similitud y usar IA
-            if len(unicas_simples) > 20:
-                return unicas_simples  # Por ahora, retornar sin IA para no saturar
-            else:
-                return self._deduplicar_con_ia(unicas_simples)
+        if not ley_canonica:
+            # Sin ley reconocible: solo se agrupan textos idénticos
+            return ('', referencia['_norm_texto']), False
+
+        articulo = (referencia.get('articulo') or '').lower().strip()
+        if not articulo:
+            match = _RE_ARTICULO.search(referencia['_norm_texto'])
+            articulo = match.group(1) if match else ''
+
+        return (ley_canonica, articulo), True
 
     def _deduplicar_simple(self, referencias: List[Dict]) -> List[Dict]:
         """
         Deduplicación simple por texto exacto (sin IA)
         """
-        unicas = []
-        textos_vistos = set()
-
+        # Un dict por clave normalizada: setdefault conserva la primera
+        # aparición y el orden de entrada en una sola operación por referencia
+        por_texto = {}
         for ref in referencias:
-            texto = ref.get('texto_completo', '').lower().strip()
-            if texto and texto not in textos_vistos:
-                textos_vistos.add(texto)
-                unicas.append(ref)
+            if ref['_norm_texto']:
+                por_texto.setdefault(ref['_norm_texto'], ref)
+        unicas = list(por_texto.values())
 
         duplicados = len(referencias) - len(unicas)
         if duplicados > 0:
-            logger.debug(f"Dedup simple: {duplicados} duplicados exactos eliminados")
+            logger.debug("Dedup simple: %s duplicados exactos eliminados", duplicados)
 
         return unicas
 
@@ -424,38 +726,46 @@ class SistemaConvergencia:
         if len(referencias) <= 1:
             return referencias
 
-        logger.info(f"🤖 Usando IA para deduplicar {len(referencias)} referencias...")
+        # Las rondas cercanas a la convergencia suelen repetir la misma lista:
+        # reutilizar el veredicto anterior en lugar de volver a llamar a la IA
+        clave = hashlib.blake2b(
+            "\n".join(
+                f"{ref['_norm_texto']}\x1f{ref['_norm_ley']}\x1f{ref.get('articulo') or ''}"
+                for ref in referencias
+            ).encode(),
+            digest_size=16
+        ).digest()
+
+        if clave in self._dedup_cache:
+            logger.debug("Dedup IA: lista de %s referencias ya evaluada", len(referencias))
+            return [referencias[i] for i in self._dedup_cache[clave]]
+
+        logger.info("🤖 Usando IA para deduplicar %s referencias...", len(referencias))
 
         try:
             # Construir prompt para IA
             prompt = self._construir_prompt_deduplicacion(referencias)
 
             # Llamar a IA usando uno de los agentes existentes
-            # Reutilizamos la IA del agente A (más conservador)
-            import google.genai as genai
-
-            model = genai.GenerativeModel(
-                model_name="gemini-2.0-flash-exp",
-                generation_config={"temperature": 0.1}
-            )
-
-            response = model.generate_content(prompt)
-            respuesta = response.text
+            # Reutilizamos la IA del agente A (más conservador), con su
+            # cliente ya inicializado
+            respuesta = self.agente_a.generar_contenido(prompt)
 
             # Parsear respuesta
             indices_unicos = self._parsear_respuesta_deduplicacion(respuesta, len(referencias))
+            self._dedup_cache[clave] = indices_unicos
 
             # Filtrar referencias
             unicas = [referencias[i] for i in indices_unicos if i < len(referencias)]
 
             duplicados = len(referencias) - len(unicas)
             if duplicados > 0:
-                logger.info(f"🔍 IA detectó {duplicados} duplicados semánticos")
+                logger.info("🔍 IA detectó %s duplicados semánticos", duplicados)
 
             return unicas
 
         except Exception as e:
-            logger.warning(f"Error en deduplicación con IA: {e}. Usando dedup simple.")
+            logger.warning("Error en deduplicación con IA: %s. Usando dedup simple.", e)
             return self._deduplicar_simple(referencias)
 
     def _construir_prompt_deduplicacion(self, referencias: List[Dict]) -> str:
@@ -521,16 +831,13 @@ Responde SOLO con el JSON, sin texto adicional."""
         """
         Parsea respuesta de IA para obtener índices únicos
         """
-        import re
-        import json
-
         try:
             # Limpiar markdown
-            respuesta_limpia = respuesta.replace('```json', '').replace('```', '').strip()
+            respuesta_limpia = _RE_JSON_FENCE.sub('', respuesta).strip()
 
             # Parsear JSON
-            data = json.loads(respuesta_limpia)
-            indices = data.get('indices_unicos', [])
+            data = cargar_json(respuesta_limpia)
+            indices = data.get('indices_unicos', list(range(total_refs)))
 
             # Validar índices
             indices_validos = [i for i in indices if 0 <= i < total_refs]
@@ -538,7 +845,7 @@ Responde SOLO con el JSON, sin texto adicional."""
             return indices_validos
 
         except Exception as e:
-            logger.warning(f"Error parseando respuesta de deduplicación: {e}")
+            logger.warning("Error parseando respuesta de deduplicación: %s", e)
             # Fallback: retornar todos los índices (no deduplicar)
             return list(range(total_refs))
 
@@ -552,27 +859,25 @@ Responde SOLO con el JSON, sin texto adicional."""
         if not self.historial_rondas:
             return {'error': 'No se ha ejecutado ninguna convergencia'}
 
-        # Referencias por agente
-        refs_por_agente = {}
-        for ref in self.referencias_totales:
-            agente = ref.get('_metadata', {}).get('encontrado_por', 'desconocido')
-            refs_por_agente[agente] = refs_por_agente.get(agente, 0) + 1
+        # Referencias por agente, por ronda y confianza en una sola pasada
+        refs_por_agente = Counter()
+        refs_por_ronda = Counter()
+        suma_confianza = 0
 
-        # Referencias por ronda
-        refs_por_ronda = {}
         for ref in self.referencias_totales:
-            ronda = ref.get('_metadata', {}).get('ronda', 0)
-            refs_por_ronda[f'ronda_{ronda}'] = refs_por_ronda.get(f'ronda_{ronda}', 0) + 1
+            metadata = ref.get('_metadata', {})
+            refs_por_agente[metadata.get('encontrado_por', 'desconocido')] += 1
+            refs_por_ronda[f"ronda_{metadata.get('ronda', 0)}"] += 1
+            suma_confianza += ref.get('confianza', 0)
 
-        # Distribución de confianza
-        confianzas = [ref.get('confianza', 0) for ref in self.referencias_totales]
-        confianza_promedio = sum(confianzas) / len(confianzas) if confianzas else 0
+        total = len(self.referencias_totales)
+        confianza_promedio = suma_confianza / total if total else 0
 
         return {
-            'total_referencias': len(self.referencias_totales),
+            'total_referencias': total,
             'total_rondas': len(self.historial_rondas),
-            'referencias_por_agente': refs_por_agente,
-            'referencias_por_ronda': refs_por_ronda,
+            'referencias_por_agente': dict(refs_por_agente),
+            'referencias_por_ronda': dict(refs_por_ronda),
             'confianza_promedio': confianza_promedio,
             'convergencia_alcanzada': self.historial_rondas[-1]['convergencia_alcanzada'],
         }
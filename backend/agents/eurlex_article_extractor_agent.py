@@ -14,14 +14,25 @@ Version: 0.2.0
 License: MIT
 """
 
+import asyncio
+import gzip
+import hashlib
+import json
 import logging
+import os
 import requests
-from bs4 import BeautifulSoup
-from typing import Dict, List, Any, Optional
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup, SoupStrainer
+import soupsieve as sv
+from typing import Dict, List, Any, Optional, Tuple
 from pathlib import Path
 from functools import lru_cache
 import re
 import sys
+import threading
+from cachetools import LFUCache
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
 # Permitir imports relativos cuando se ejecuta como script
 if __name__ == "__main__":
@@ -32,6 +43,82 @@ else:
 
 logger = logging.getLogger(__name__)
 
+# Parser HTML en C (lexbor); si no está instalado se usa BeautifulSoup
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+# Tamaño máximo (descomprimido) de un documento EUR-Lex descargado
+MAX_BYTES_HTML = 16 * 1024 * 1024
+
+# Selectores CSS precompilados para el parseo con BeautifulSoup
+_SEL_TITULO = sv.compile('div.eli-title')
+_SEL_APARTADOS = sv.compile(':scope > div[id]:not([id=""]):not([class]:not([class=""]))')
+
+# Heurística de limpieza: espacios repetidos dentro de una línea y
+# caracteres de control o de sustitución (restos de mala decodificación)
+_RE_ESPACIOS_REPETIDOS = re.compile(r'[ \t\u00a0]{3,}')
+_RE_CARACTERES_BASURA = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\ufffd]')
+
+
+def _texto_nodo(nodo: Any, separador: str) -> str:
+    """
+    Texto de un nodo selectolax equivalente a get_text(separator, strip=True) de bs4
+
+    Une los fragmentos de texto no vacíos (ya sin espacios en los extremos)
+    con el separador indicado.
+    """
+    return separador.join(
+        fragmento
+        for fragmento in (n.text_content.strip() for n in nodo.traverse(include_text=True) if n.tag == '-text')
+        if fragmento
+    )
+
+# Partes fijas del prompt de limpieza con IA
+_PROMPT_LIMPIEZA_INSTRUCCIONES = """INSTRUCCIONES:
+1. Mantén el contenido exacto, NO cambies el significado
+2. Mejora el formato y legibilidad
+3. Separa claramente apartados y subapartados
+4. Elimina saltos de línea innecesarios
+5. Mantén la numeración de apartados (1., 2., a), b), etc.)
+6. Asegúrate de que el título del artículo esté claro
+
+Devuelve SOLO el texto limpio y formateado, sin explicaciones."""
+
+_SYSTEM_LIMPIEZA = "Eres un experto en formateo de textos legales europeos. Limpia y formatea preservando exactitud."
+
+
+def _necesita_limpieza(texto: str) -> bool:
+    """
+    Indica si merece la pena limpiar un texto con IA
+
+    El HTML de EUR-Lex suele estar bien estructurado; solo se limpia si
+    hay muchas líneas sueltas muy cortas (numeración separada de su
+    apartado), espacios repetidos o caracteres basura.
+    """
+    lineas = texto.splitlines()
+    cortas = sum(1 for linea in lineas if len(linea.strip()) < 5)
+    if lineas and cortas / len(lineas) > 0.2:
+        return True
+
+    if _RE_ESPACIOS_REPETIDOS.search(texto):
+        return True
+
+    return len(_RE_CARACTERES_BASURA.findall(texto)) > len(texto) * 0.001
+
+
+class _LFUCacheConMetricas(LFUCache):
+    """LFUCache que cuenta las expulsiones por falta de espacio"""
+
+    def __init__(self, maxsize: int):
+        super().__init__(maxsize=maxsize)
+        self.evictions = 0
+
+    def popitem(self):
+        self.evictions += 1
+        return super().popitem()
+
 
 class EurlexArticleExtractorAgent(BaseAgent):
     """
@@ -42,20 +129,22 @@ class EurlexArticleExtractorAgent(BaseAgent):
     - Scraping HTML optimizado
     - Soporte multi-idioma (ES, EN, FR)
     - Limpieza de texto con IA
-    - Caché LRU para artículos frecuentes
+    - Caché LFU para artículos frecuentes
     """
 
     def __init__(
         self,
         api_key: str = None,
-        cache_size: int = 200
+        cache_size: int = 200,
+        cache_dir: Optional[str] = None
     ):
         """
         Inicializa el Agente Extractor EUR-Lex
 
         Args:
             api_key: API key de Gemini (opcional)
-            cache_size: Tamaño del caché LRU
+            cache_size: Tamaño del caché de artículos
+            cache_dir: Directorio para caché en disco del HTML descargado
         """
         super().__init__(
             nombre="Agente4-EurlexExtractor",
@@ -67,6 +156,34 @@ class EurlexArticleExtractorAgent(BaseAgent):
         self.cache_size = cache_size
         self.idiomas_soportados = ['ES', 'EN', 'FR', 'DE', 'IT']
 
+        # Caché en disco del HTML descargado (sobrevive a reinicios)
+        if cache_dir is None:
+            base_path = Path(__file__).parent.parent.parent
+            cache_dir = str(base_path / "data" / "cache" / "eurlex_html")
+
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.cache_days = 30  # Pasado este tiempo se revalida con ETag/Last-Modified
+
+        # Caché LFU de artículos: unos pocos reglamentos (RGPD, DSA, DMA)
+        # concentran casi todas las consultas y un lote de artículos fríos
+        # no debe expulsarlos, como pasaría con un LRU
+        self._cache_articulos = _LFUCacheConMetricas(maxsize=cache_size)
+        self._cache_lock = threading.Lock()
+        self._cache_hits = 0
+        self._cache_misses = 0
+
+        # Caché en memoria del HTML por documento, propia de cada instancia
+        # (un lru_cache sobre el método se compartiría entre instancias y
+        # las mantendría vivas)
+        self._descargar_html = lru_cache(maxsize=8)(self._descargar_html_documento)
+
+        # Sesión HTTP reutilizada (keep-alive): una sola conexión TLS con
+        # eur-lex.europa.eu para todas las descargas, también en paralelo
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=32))
+        self.session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+
         logger.info(f"✅ Agente EUR-Lex Extractor inicializado (caché: {cache_size})")
 
     def procesar(self, entrada: Dict[str, Any]) -> Dict[str, Any]:
@@ -108,50 +225,78 @@ class EurlexArticleExtractorAgent(BaseAgent):
             logger.warning(f"Idioma {idioma} no soportado, usando ES")
             idioma = 'ES'
 
-        # Extraer artículo (con caché)
+        # Extraer artículo (con caché). Se devuelve una copia: la limpieza
+        # con IA no debe modificar la entrada guardada en caché
         resultado = self._extraer_articulo_cached(celex, articulo, idioma)
 
         if not resultado['exito']:
             return resultado
 
-        # Opcional: limpiar con IA
+        resultado = dict(resultado)
+
+        # Opcional: limpiar con IA (solo si el texto lo necesita)
         if limpiar_con_ia and resultado.get('texto_completo'):
-            texto_limpio = self._limpiar_texto_con_ia(resultado['texto_completo'], articulo)
-            if texto_limpio:
-                resultado['texto_completo'] = texto_limpio
-                resultado['_limpiado_ia'] = True
+            if _necesita_limpieza(resultado['texto_completo']):
+                texto_limpio = self._limpiar_texto_con_ia(resultado['texto_completo'], articulo)
+                if texto_limpio:
+                    resultado['texto_completo'] = texto_limpio
+                    resultado['_limpiado_ia'] = True
+            else:
+                resultado['_limpiado_ia'] = False
 
         resultado['agente'] = self.nombre
         logger.info(f"[{self.nombre}] ✅ Artículo {articulo} extraído ({len(resultado.get('texto_completo', ''))} chars)")
 
         return resultado
 
-    @lru_cache(maxsize=200)
     def _extraer_articulo_cached(
         self,
         celex: str,
         articulo: str,
-        idioma: str
+        idioma: str,
+        arbol: Any = None
     ) -> Dict[str, Any]:
         """
-        Extrae artículo con caché LRU
+        Extrae artículo con caché LFU
+
+        Solo se cachean las extracciones exitosas (igual que las descargas,
+        un error puntual de red no debe quedarse fijado).
 
         Args:
             celex: CELEX
             articulo: Número de artículo
             idioma: Código idioma
+            arbol: Documento ya parseado (de _parsear_documento), opcional
 
         Returns:
             Dict con información del artículo
         """
+        # Cadenas internadas: las claves repetidas comparten objeto (hash ya
+        # calculado, comparación por identidad y menos memoria en la caché)
+        clave = (sys.intern(celex), sys.intern(articulo), sys.intern(idioma))
+
+        with self._cache_lock:
+            resultado = self._cache_articulos.get(clave)
+            if resultado is not None:
+                self._cache_hits += 1
+                return resultado
+            self._cache_misses += 1
+
         logger.debug(f"Extrayendo artículo (caché habilitado): {celex} art. {articulo} ({idioma})")
-        return self._extraer_articulo_eurlex(celex, articulo, idioma)
+        resultado = self._extraer_articulo_eurlex(celex, articulo, idioma, arbol)
+
+        if resultado['exito']:
+            with self._cache_lock:
+                self._cache_articulos[clave] = resultado
+
+        return resultado
 
     def _extraer_articulo_eurlex(
         self,
         celex: str,
         articulo: str,
-        idioma: str
+        idioma: str,
+        arbol: Any = None
     ) -> Dict[str, Any]:
         """
         Extrae artículo de EUR-Lex mediante scraping HTML
@@ -160,46 +305,36 @@ class EurlexArticleExtractorAgent(BaseAgent):
             celex: CELEX
             articulo: Número de artículo
             idioma: Código idioma
+            arbol: Documento ya parseado; si no se pasa, se descarga y se
+                parsea solo lo necesario para este artículo
 
         Returns:
             Dict con datos del artículo
         """
         # Construir URL
-        url = f"https://eur-lex.europa.eu/legal-content/{idioma}/TXT/HTML/?uri=CELEX:{celex}"
+        url = self._url_documento(celex, idioma)
 
         try:
-            # Petición HTTP
-            response = requests.get(url, timeout=15)
-            response.raise_for_status()
-
-            # Parsear HTML
-            soup = BeautifulSoup(response.text, 'html.parser')
-
             # Normalizar número de artículo (puede venir como "17" o "art_17")
             art_id = articulo.replace('art_', '').replace('Art_', '').strip()
             art_id_full = f"art_{art_id}"
 
-            # Buscar div del artículo
-            div_articulo = soup.find('div', id=art_id_full)
-
-            if not div_articulo:
-                logger.warning(f"Artículo {art_id} no encontrado en {url}")
-                return self._respuesta_error(f"Artículo {art_id} no encontrado", celex, articulo, url)
+            if arbol is None:
+                # Petición HTTP (una sola descarga por documento)
+                html = self._descargar_html(celex, idioma)
+                arbol = self._parsear_documento(html, art_id_full)
 
             # Extraer componentes del artículo
-            texto_completo = div_articulo.get_text(separator='\n', strip=True)
+            if LexborHTMLParser is not None:
+                partes = self._parsear_articulo_lexbor(arbol, art_id_full)
+            else:
+                partes = self._parsear_articulo_bs4(arbol, art_id_full)
 
-            # Extraer título del artículo (si existe)
-            titulo_div = div_articulo.find('div', class_='eli-title')
-            titulo_articulo = titulo_div.get_text(strip=True) if titulo_div else ''
+            if partes is None:
+                logger.warning(f"Artículo {art_id} no encontrado en {url}")
+                return self._respuesta_error(f"Artículo {art_id} no encontrado", celex, articulo, url)
 
-            # Extraer apartados (divs internos sin clase específica)
-            apartados = []
-            for div in div_articulo.find_all('div', recursive=False):
-                if div.get('id') and not div.get('class'):
-                    texto_apartado = div.get_text(separator=' ', strip=True)
-                    if texto_apartado:
-                        apartados.append(texto_apartado)
+            texto_completo, titulo_articulo, apartados = partes
 
             logger.debug(f"✅ Artículo extraído: {len(texto_completo)} chars, {len(apartados)} apartados")
 
@@ -226,6 +361,218 @@ class EurlexArticleExtractorAgent(BaseAgent):
             traceback.print_exc()
             return self._respuesta_error(f"Error: {e}", celex, articulo, url)
 
+    @staticmethod
+    def _url_documento(celex: str, idioma: str) -> str:
+        """URL del HTML completo de un documento EUR-Lex"""
+        return f"https://eur-lex.europa.eu/legal-content/{idioma}/TXT/HTML/?uri=CELEX:{celex}"
+
+    def _descargar_html_documento(self, celex: str, idioma: str) -> str:
+        """
+        Descarga el HTML de un documento EUR-Lex (con caché por documento)
+
+        Todos los artículos de un mismo CELEX salen del mismo HTML, así que
+        se descarga una sola vez. Además se guarda comprimido en disco: si
+        la copia tiene menos de cache_days se usa sin red y, si es más
+        antigua, se revalida con una petición condicional (304 = sigue
+        valiendo). Los errores HTTP no se cachean.
+
+        Args:
+            celex: CELEX
+            idioma: Código idioma
+
+        Returns:
+            HTML del documento
+        """
+        ruta_html, ruta_meta = self._rutas_cache_html(celex, idioma)
+
+        html = None
+        meta = {}
+        if ruta_html.exists():
+            try:
+                with gzip.open(ruta_html, 'rt', encoding='utf-8') as f:
+                    html = f.read()
+                if ruta_meta.exists():
+                    with open(ruta_meta, 'r', encoding='utf-8') as f:
+                        meta = json.load(f)
+            except Exception as e:
+                logger.warning(f"Error leyendo caché EUR-Lex de {celex}: {e}")
+                html = None
+
+        if html is not None:
+            edad = datetime.now() - datetime.fromtimestamp(ruta_html.stat().st_mtime)
+            if edad <= timedelta(days=self.cache_days):
+                logger.debug(f"HTML de {celex} ({idioma}) desde caché en disco")
+                return html
+
+        # Petición condicional si hay copia caducada en disco
+        cabeceras = {}
+        if html is not None:
+            if meta.get('etag'):
+                cabeceras['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                cabeceras['If-Modified-Since'] = meta['last_modified']
+
+        # En streaming: el cuerpo se lee por bloques con un tope de tamaño
+        url = self._url_documento(celex, idioma)
+        with self.session.get(url, timeout=15, headers=cabeceras, stream=True) as response:
+            if response.status_code == 304 and html is not None:
+                ruta_html.touch()
+                logger.debug(f"HTML de {celex} ({idioma}) revalidado (304)")
+                return html
+
+            response.raise_for_status()
+
+            html = self._leer_cuerpo(response)
+
+        self._guardar_cache_html(ruta_html, ruta_meta, html, response.headers)
+        return html
+
+    @staticmethod
+    def _leer_cuerpo(response: Any) -> str:
+        """
+        Lee el cuerpo (ya descomprimido) de una respuesta en streaming
+
+        Args:
+            response: Respuesta HTTP abierta con stream=True
+
+        Returns:
+            HTML decodificado
+
+        Raises:
+            ValueError: Si el documento supera MAX_BYTES_HTML
+        """
+        cuerpo = bytearray()
+        for bloque in response.iter_content(chunk_size=64 * 1024):
+            cuerpo += bloque
+            if len(cuerpo) > MAX_BYTES_HTML:
+                raise ValueError(f"Documento EUR-Lex demasiado grande (> {MAX_BYTES_HTML} bytes)")
+
+        return cuerpo.decode(response.encoding or 'utf-8', errors='replace')
+
+    def _rutas_cache_html(self, celex: str, idioma: str) -> Tuple[Path, Path]:
+        """Rutas del HTML comprimido y de sus cabeceras de validación"""
+        clave = hashlib.sha1(f"{celex}|{idioma}".encode('utf-8')).hexdigest()
+        return self.cache_dir / f"{clave}.html.gz", self.cache_dir / f"{clave}.meta"
+
+    def _guardar_cache_html(self, ruta_html: Path, ruta_meta: Path, html: str, headers: Any):
+        """
+        Guarda el HTML en disco de forma atómica (fichero temporal + replace)
+
+        Args:
+            ruta_html: Ruta del HTML comprimido
+            ruta_meta: Ruta de las cabeceras de validación
+            html: HTML del documento
+            headers: Cabeceras de la respuesta (ETag, Last-Modified)
+        """
+        meta = {
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified')
+        }
+
+        try:
+            tmp_meta = ruta_meta.with_name(f"{ruta_meta.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp_meta, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+
+            tmp_html = ruta_html.with_name(f"{ruta_html.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            with gzip.open(tmp_html, 'wt', encoding='utf-8') as f:
+                f.write(html)
+
+            os.replace(tmp_meta, ruta_meta)
+            os.replace(tmp_html, ruta_html)
+
+        except Exception as e:
+            logger.warning(f"Error guardando caché EUR-Lex en {ruta_html}: {e}")
+
+    @staticmethod
+    def _parsear_documento(html: str, art_id_full: Optional[str] = None) -> Any:
+        """
+        Parsea el HTML de un documento EUR-Lex
+
+        Con selectolax (lexbor) se parsea el documento completo. Con
+        BeautifulSoup, si se indica art_id_full solo se materializa el
+        subárbol de ese artículo (lxml + SoupStrainer): el resto del
+        documento (preámbulo, índice...) no se construye.
+
+        Args:
+            html: HTML del documento
+            art_id_full: id del único artículo que se va a buscar (opcional)
+
+        Returns:
+            Árbol para _parsear_articulo_lexbor / _parsear_articulo_bs4
+        """
+        if LexborHTMLParser is not None:
+            return LexborHTMLParser(html)
+
+        if art_id_full is not None:
+            return BeautifulSoup(html, 'lxml', parse_only=SoupStrainer('div', id=art_id_full))
+
+        return BeautifulSoup(html, 'lxml')
+
+    def _parsear_articulo_lexbor(
+        self,
+        tree: Any,
+        art_id_full: str
+    ) -> Optional[Tuple[str, str, List[str]]]:
+        """
+        Extrae texto, título y apartados de un artículo con selectolax (lexbor)
+
+        Args:
+            tree: Documento EUR-Lex parseado con LexborHTMLParser
+            art_id_full: id del div del artículo (ej: "art_17")
+
+        Returns:
+            Tupla (texto_completo, titulo_articulo, apartados) o None si no existe
+        """
+        # Buscar div del artículo
+        div_articulo = tree.css_first(f'div[id="{art_id_full}"]')
+        if div_articulo is None:
+            return None
+
+        texto_completo = _texto_nodo(div_articulo, '\n')
+
+        # Extraer título del artículo (si existe)
+        titulo_div = div_articulo.css_first('div.eli-title')
+        titulo_articulo = _texto_nodo(titulo_div, '') if titulo_div is not None else ''
+
+        # Extraer apartados (divs hijos directos con id y sin clase)
+        apartados = []
+        for div in div_articulo.iter():
+            if div.tag == 'div' and div.attributes.get('id') and not div.attributes.get('class'):
+                texto_apartado = _texto_nodo(div, ' ')
+                if texto_apartado:
+                    apartados.append(texto_apartado)
+
+        return texto_completo, titulo_articulo, apartados
+
+    def _parsear_articulo_bs4(
+        self,
+        soup: Any,
+        art_id_full: str
+    ) -> Optional[Tuple[str, str, List[str]]]:
+        """
+        Igual que _parsear_articulo_lexbor, con BeautifulSoup (fallback)
+        """
+        # Buscar div del artículo
+        div_articulo = soup.find('div', id=art_id_full)
+        if not div_articulo:
+            return None
+
+        texto_completo = '\n'.join(div_articulo.stripped_strings)
+
+        # Extraer título del artículo (si existe)
+        titulo_div = _SEL_TITULO.select_one(div_articulo)
+        titulo_articulo = ''.join(titulo_div.stripped_strings) if titulo_div else ''
+
+        # Extraer apartados (divs internos sin clase específica)
+        apartados = []
+        for div in _SEL_APARTADOS.select(div_articulo):
+            texto_apartado = ' '.join(div.stripped_strings)
+            if texto_apartado:
+                apartados.append(texto_apartado)
+
+        return texto_completo, titulo_articulo, apartados
+
     def _limpiar_texto_con_ia(
         self,
         texto: str,
@@ -244,27 +591,16 @@ class EurlexArticleExtractorAgent(BaseAgent):
         # Limitar longitud del texto para IA
         texto_para_ia = texto[:8000] if len(texto) > 8000 else texto
 
-        prompt = f"""Limpia y formatea el siguiente texto de un artículo de legislación europea.
-
-ARTÍCULO: {num_articulo}
-
-TEXTO CRUDO:
-{texto_para_ia}
-
-INSTRUCCIONES:
-1. Mantén el contenido exacto, NO cambies el significado
-2. Mejora el formato y legibilidad
-3. Separa claramente apartados y subapartados
-4. Elimina saltos de línea innecesarios
-5. Mantén la numeración de apartados (1., 2., a), b), etc.)
-6. Asegúrate de que el título del artículo esté claro
-
-Devuelve SOLO el texto limpio y formateado, sin explicaciones."""
+        prompt = "".join([
+            "Limpia y formatea el siguiente texto de un artículo de legislación europea.\n\n",
+            f"ARTÍCULO: {num_articulo}\n\nTEXTO CRUDO:\n{texto_para_ia}\n\n",
+            _PROMPT_LIMPIEZA_INSTRUCCIONES
+        ])
 
         try:
             respuesta = self.generar_contenido(
                 prompt,
-                system_instruction="Eres un experto en formateo de textos legales europeos. Limpia y formatea preservando exactitud."
+                system_instruction=_SYSTEM_LIMPIEZA
             )
 
             texto_limpio = respuesta.strip()
@@ -281,6 +617,54 @@ Devuelve SOLO el texto limpio y formateado, sin explicaciones."""
             logger.error(f"Error limpiando texto con IA: {e}")
             return None
 
+    def _limpiar_batch(
+        self,
+        textos: List[str],
+        nums: List[str],
+        max_workers: int = 4
+    ) -> List[Optional[str]]:
+        """
+        Limpia varios artículos con IA en paralelo
+
+        Args:
+            textos: Textos crudos
+            nums: Números de artículo (mismo orden)
+            max_workers: Llamadas simultáneas a Gemini
+
+        Returns:
+            Textos limpios (None donde la limpieza falla), en el mismo orden
+        """
+        if not textos:
+            return []
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(textos))) as executor:
+            return list(executor.map(self._limpiar_texto_con_ia, textos, nums))
+
+    def _aplicar_limpieza(self, resultados: List[Dict[str, Any]]):
+        """
+        Aplica _limpiar_batch a los resultados exitosos (modifica in-place)
+
+        Args:
+            resultados: Resultados de procesar()
+        """
+        pendientes = []
+        for resultado in resultados:
+            if resultado.get('exito') and resultado.get('texto_completo'):
+                if _necesita_limpieza(resultado['texto_completo']):
+                    pendientes.append(resultado)
+                else:
+                    resultado['_limpiado_ia'] = False
+
+        textos_limpios = self._limpiar_batch(
+            [r['texto_completo'] for r in pendientes],
+            [r['articulo'] for r in pendientes]
+        )
+
+        for resultado, texto_limpio in zip(pendientes, textos_limpios):
+            if texto_limpio:
+                resultado['texto_completo'] = texto_limpio
+                resultado['_limpiado_ia'] = True
+
     def _respuesta_error(
         self,
         mensaje: str,
@@ -315,7 +699,8 @@ Devuelve SOLO el texto limpio y formateado, sin explicaciones."""
         self,
         celex: str,
         articulos: List[str],
-        idioma: str = 'ES'
+        idioma: str = 'ES',
+        limpiar_con_ia: bool = False
     ) -> Dict[str, Any]:
         """
         Extrae múltiples artículos del mismo documento
@@ -324,26 +709,141 @@ Devuelve SOLO el texto limpio y formateado, sin explicaciones."""
             celex: CELEX
             articulos: Lista de números de artículo
             idioma: Código idioma
+            limpiar_con_ia: Limpiar los textos con IA (en paralelo, tras extraer)
 
         Returns:
             Dict con lista de artículos extraídos
         """
+        celex = celex.strip()
+        idioma = idioma.upper()
+        articulos = [str(num_art).strip() for num_art in articulos]
+
         logger.info(f"[{self.nombre}] Extrayendo {len(articulos)} artículos de {celex}")
 
-        resultados = []
-        exitosos = 0
+        # Validar idioma (igual que procesar)
+        if idioma not in self.idiomas_soportados:
+            logger.warning(f"Idioma {idioma} no soportado, usando ES")
+            idioma = 'ES'
+
+        # Descargar y parsear el documento una sola vez; cada artículo se
+        # busca después en ese mismo árbol
+        url = self._url_documento(celex, idioma)
+        try:
+            if not celex:
+                raise ValueError("CELEX requerido")
+            arbol = self._parsear_documento(self._descargar_html(celex, idioma))
+        except Exception as e:
+            logger.warning(f"[{self.nombre}] No se pudo descargar {celex}: {e}")
+            resultados = [
+                self._respuesta_error(f"Error: {e}", celex, num_art, url)
+                for num_art in articulos
+            ]
+        else:
+            resultados = []
+            for num_art in articulos:
+                if not num_art:
+                    resultados.append(self._respuesta_error("CELEX o artículo requerido"))
+                    continue
 
-        for num_art in articulos:
-            resultado = self.procesar({
-                'celex': celex,
-                'articulo': num_art,
-                'idioma': idioma
-            })
+                resultado = self._extraer_articulo_cached(celex, num_art, idioma, arbol)
+                if resultado['exito']:
+                    resultado = dict(resultado)
+                    resultado['agente'] = self.nombre
+                resultados.append(resultado)
 
-            resultados.append(resultado)
+        if limpiar_con_ia:
+            self._aplicar_limpieza(resultados)
 
-            if resultado.get('exito'):
-                exitosos += 1
+        exitosos = sum(1 for resultado in resultados if resultado.get('exito'))
+
+        logger.info(f"[{self.nombre}] ✅ {exitosos}/{len(articulos)} artículos extraídos")
+
+        return {
+            'articulos': resultados,
+            'total': len(articulos),
+            'exitosos': exitosos,
+            'fallidos': len(articulos) - exitosos,
+            'celex': celex,
+            'idioma': idioma,
+            'agente': self.nombre
+        }
+
+    async def extraer_articulos_async(
+        self,
+        entradas: List[Dict[str, Any]],
+        max_concurrencia: int = 8
+    ) -> List[Dict[str, Any]]:
+        """
+        Extrae artículos de uno o varios documentos en paralelo (asyncio)
+
+        Primero descarga en paralelo cada documento distinto (una vez por
+        CELEX + idioma) y después extrae los artículos, de forma que el
+        tiempo total se acerca al de la descarga más lenta en lugar de a la
+        suma de todas. Las descargas y el parseo reutilizan la sesión HTTP
+        y las cachés (memoria y disco) en hilos auxiliares.
+
+        Args:
+            entradas: Lista de dicts como los de procesar() (celex, articulo, idioma...)
+            max_concurrencia: Máximo de descargas/extracciones simultáneas
+
+        Returns:
+            Lista de resultados en el mismo orden que las entradas
+        """
+        semaforo = asyncio.Semaphore(max_concurrencia)
+
+        async def descargar(celex: str, idioma: str):
+            async with semaforo:
+                try:
+                    await asyncio.to_thread(self._descargar_html, celex, idioma)
+                except Exception as e:
+                    logger.warning(f"[{self.nombre}] No se pudo descargar {celex}: {e}")
+
+        async def extraer(entrada: Dict[str, Any]) -> Dict[str, Any]:
+            async with semaforo:
+                return await asyncio.to_thread(self.procesar, entrada)
+
+        documentos = {
+            (str(entrada.get('celex', '')).strip(), entrada.get('idioma', 'ES').upper())
+            for entrada in entradas
+        }
+        await asyncio.gather(*(
+            descargar(celex, idioma)
+            for celex, idioma in documentos
+            if celex and idioma in self.idiomas_soportados
+        ))
+
+        return list(await asyncio.gather(*(extraer(entrada) for entrada in entradas)))
+
+    async def extraer_multiples_articulos_async(
+        self,
+        celex: str,
+        articulos: List[str],
+        idioma: str = 'ES',
+        limpiar_con_ia: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Versión async de extraer_multiples_articulos
+
+        Args:
+            celex: CELEX
+            articulos: Lista de números de artículo
+            idioma: Código idioma
+            limpiar_con_ia: Limpiar los textos con IA (en paralelo, tras extraer)
+
+        Returns:
+            Dict con lista de artículos extraídos
+        """
+        logger.info(f"[{self.nombre}] Extrayendo {len(articulos)} artículos de {celex} (async)")
+
+        resultados = await self.extraer_articulos_async([
+            {'celex': celex, 'articulo': num_art, 'idioma': idioma}
+            for num_art in articulos
+        ])
+
+        if limpiar_con_ia:
+            await asyncio.to_thread(self._aplicar_limpieza, resultados)
+
+        exitosos = sum(1 for resultado in resultados if resultado.get('exito'))
 
         logger.info(f"[{self.nombre}] ✅ {exitosos}/{len(articulos)} artículos extraídos")
 
@@ -359,24 +859,45 @@ Devuelve SOLO el texto limpio y formateado, sin explicaciones."""
 
     def limpiar_cache(self):
         """Limpia el caché de artículos"""
-        self._extraer_articulo_cached.cache_clear()
+        with self._cache_lock:
+            self._cache_articulos.clear()
+            self._cache_articulos.evictions = 0
+            self._cache_hits = 0
+            self._cache_misses = 0
+        self._descargar_html.cache_clear()
         logger.info(f"[{self.nombre}] Caché limpiado")
 
     def obtener_info_cache(self) -> Dict[str, Any]:
         """
         Obtiene información del caché
 
+        Si 'evictions' crece mientras 'currsize' está en 'maxsize', el
+        conjunto de artículos consultados no cabe y conviene subir cache_size.
+
         Returns:
             Dict con estadísticas del caché
         """
-        cache_info = self._extraer_articulo_cached.cache_info()
+        with self._cache_lock:
+            hits = self._cache_hits
+            misses = self._cache_misses
+            evictions = self._cache_articulos.evictions
+            currsize = self._cache_articulos.currsize
+
+        html_info = self._descargar_html.cache_info()
 
         return {
-            'hits': cache_info.hits,
-            'misses': cache_info.misses,
-            'maxsize': cache_info.maxsize,
-            'currsize': cache_info.currsize,
-            'hit_rate': cache_info.hits / (cache_info.hits + cache_info.misses) if (cache_info.hits + cache_info.misses) > 0 else 0
+            'hits': hits,
+            'misses': misses,
+            'evictions': evictions,
+            'maxsize': self._cache_articulos.maxsize,
+            'currsize': currsize,
+            'hit_rate': hits / (hits + misses) if (hits + misses) > 0 else 0,
+            'html': {
+                'hits': html_info.hits,
+                'misses': html_info.misses,
+                'maxsize': html_info.maxsize,
+                'currsize': html_info.currsize
+            }
         }
 
 
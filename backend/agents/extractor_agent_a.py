@@ -15,12 +15,87 @@ License: MIT
 import json
 import logging
 import re
-from typing import Dict, List, Any
-from .base_agent import BaseAgent
+from typing import AbstractSet, Any, Dict, List, Optional, Union
+from .base_agent import (
+    BaseAgent, MAX_TOKENS_TEXTO_PROMPT, _objeto_json_completo,
+    cargar_json, huella, huellas_referencia, normalizar_texto_referencia, truncar_texto_prompt,
+)
 from modules.siglas_loader import cargar_siglas_para_prompt
 
 logger = logging.getLogger(__name__)
 
+# Patrones compilados una sola vez al cargar el módulo
+_JSON_MD_RE = re.compile(r'```json\s*(\{.*?\})\s*```', re.DOTALL)
+_JSON_RE = re.compile(r'\{.*"referencias".*\}', re.DOTALL)
+_LEY_RE = re.compile(r'(?:Ley|Real\s+Decreto|RD)\s+(\d+/\d{4})', re.IGNORECASE)
+
+# Instrucción de sistema, idéntica en todas las llamadas
+_SYSTEM_INSTRUCTION = """Eres un asistente legal especializado en extracción de referencias legales para oposiciones del Estado español.
+
+Tu tarea es identificar TODAS las referencias legales (leyes, artículos, reales decretos, constitución, etc.) mencionadas en textos de temas de oposiciones.
+
+REGLAS CRÍTICAS:
+1. SOLO incluye referencias que aparezcan EXPLÍCITAMENTE en el texto
+2. NO inventes ni deduzcas referencias que no estén escritas
+3. NO incluyas referencias genéricas como "la ley" sin especificar cuál
+4. SÉ EXTREMADAMENTE CONSERVADOR: en caso de duda, NO incluyas la referencia
+5. Extrae el texto EXACTO de la referencia tal como aparece
+
+IMPORTANTE: Devuelve SOLO JSON válido, sin texto adicional."""
+
+# Parte final del prompt (formato JSON, tipos y niveles de confianza),
+# idéntica en todas las llamadas
+_PROMPT_FORMATO = """FORMATO DE RESPUESTA (JSON):
+```json
+{
+  "referencias": [
+    {
+      "texto_completo": "Artículo 24 de la Constitución Española",
+      "tipo": "artículo",
+      "ley": "Constitución Española",
+      "articulo": "24",
+      "contexto": "El artículo 24 de la Constitución Española reconoce el derecho...",
+      "confianza": 100
+    },
+    {
+      "texto_completo": "Ley 39/2015, de 1 de octubre, del Procedimiento Administrativo Común",
+      "tipo": "ley",
+      "ley": "Ley 39/2015",
+      "fecha": "1 de octubre de 2015",
+      "nombre_completo": "del Procedimiento Administrativo Común de las Administraciones Públicas",
+      "contexto": "La Ley 39/2015 establece...",
+      "confianza": 100
+    },
+    {
+      "texto_completo": "artículo 23.2.b de la LPAC",
+      "tipo": "artículo",
+      "ley": "LPAC",
+      "articulo": "23.2.b",
+      "contexto": "Según el artículo 23.2.b de la LPAC...",
+      "confianza": 95
+    }
+  ]
+}
+```
+
+TIPOS DE REFERENCIAS A BUSCAR:
+- Leyes (Ley X/YYYY)
+- Real Decreto (RD X/YYYY, Real Decreto X/YYYY)
+- Artículos de leyes (Artículo X de la Ley Y)
+- Constitución Española (artículos específicos)
+- Reglamentos
+- Directivas UE
+- Tratados internacionales
+- Siglas (LPAC, LRJSP, LEC, LJCA, etc.)
+
+NIVEL DE CONFIANZA:
+- 100: Referencia completamente explícita
+- 90-99: Referencia muy clara
+- 80-89: Referencia clara pero puede tener ambigüedad menor
+- NO incluyas referencias con confianza < 80
+
+Responde SOLO con el JSON, sin texto adicional antes o después."""
+
 
 class ExtractorAgentA(BaseAgent):
     """
@@ -33,18 +108,21 @@ class ExtractorAgentA(BaseAgent):
     - Incluye contexto de cada referencia
     """
 
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, client=None):
         """
         Inicializa el Agente 1A (Conservador)
 
         Args:
             api_key: API key de Gemini (opcional)
+            client: Cliente de Gemini compartido con otros agentes (opcional)
         """
         super().__init__(
             nombre="Agente1A-Conservador",
             modelo="gemini-2.0-flash-exp",
             temperatura=0.1,  # Muy conservador
-            api_key=api_key
+            api_key=api_key,
+            request_timeout=120.0,  # La extracción devuelve JSON largo
+            client=client
         )
 
     def procesar(self, entrada: Dict[str, Any]) -> Dict[str, Any]:
@@ -64,6 +142,45 @@ class ExtractorAgentA(BaseAgent):
                 - 'agente': str - Nombre del agente
                 - 'ronda': int - Número de ronda
         """
+        prompt = self.preparar_prompt(entrada)
+
+        # Llamar a Gemini
+        try:
+            respuesta_raw = self.generar_contenido(prompt, self._get_system_instruction())
+            return self.procesar_respuesta(respuesta_raw, entrada)
+
+        except Exception as e:
+            return self._resultado_error(entrada, e)
+
+    async def procesar_async(self, entrada: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Variante asíncrona de procesar (cliente aio de google-genai)
+
+        Args:
+            entrada: Igual que en procesar
+
+        Returns:
+            Igual que procesar
+        """
+        prompt = self.preparar_prompt(entrada)
+
+        try:
+            respuesta_raw = await self.generar_contenido_async(prompt, self._get_system_instruction())
+            return self.procesar_respuesta(respuesta_raw, entrada)
+
+        except Exception as e:
+            return self._resultado_error(entrada, e)
+
+    def preparar_prompt(self, entrada: Dict[str, Any]) -> str:
+        """
+        Construye el prompt de extracción para una entrada
+
+        Args:
+            entrada: Igual que en procesar
+
+        Returns:
+            Prompt listo para enviar a Gemini
+        """
         texto = entrada.get('texto', '')
         ronda = entrada.get('ronda', 1)
         referencias_previas = entrada.get('referencias_previas', [])
@@ -72,59 +189,98 @@ class ExtractorAgentA(BaseAgent):
         logger.info(f"[{self.nombre}] Texto: {len(texto)} caracteres")
         logger.info(f"[{self.nombre}] Referencias previas: {len(referencias_previas)}")
 
-        # Construir prompt
-        prompt = self._construir_prompt(texto, ronda, referencias_previas)
+        return self._construir_prompt(texto, ronda, referencias_previas)
 
-        # System instruction
-        system_instruction = self._get_system_instruction()
+    async def preparar_cache_async(self, texto: str) -> bool:
+        """
+        Cachea en Gemini el prefijo del prompt (con el texto) para todas las rondas
 
-        # Llamar a Gemini
-        try:
-            respuesta_raw = self.generar_contenido(prompt, system_instruction)
+        Args:
+            texto: Texto del tema
 
-            # Parsear respuesta JSON
-            referencias = self._parsear_respuesta(respuesta_raw)
+        Returns:
+            True si la caché está activa
+        """
+        return await self.crear_cache_contexto_async(
+            self._prefijo_prompt(texto), self._get_system_instruction()
+        )
 
-            # Filtrar referencias ya encontradas
-            if referencias_previas:
-                referencias_nuevas = self._filtrar_duplicados(referencias, referencias_previas)
-            else:
-                referencias_nuevas = referencias
+    def procesar_respuesta(self, respuesta_raw: str, entrada: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Parsea la respuesta de Gemini y filtra las referencias ya encontradas
 
-            logger.info(f"[{self.nombre}] Encontradas {len(referencias_nuevas)} referencias nuevas")
+        Args:
+            respuesta_raw: Respuesta de Gemini
+            entrada: Entrada con la que se construyó el prompt
 
-            return {
-                'referencias': referencias_nuevas,
-                'total': len(referencias_nuevas),
-                'agente': self.nombre,
-                'ronda': ronda,
-                'temperatura': self.temperatura
-            }
+        Returns:
+            Igual que procesar
+        """
+        ronda = entrada.get('ronda', 1)
+        referencias_previas = entrada.get('referencias_previas', [])
 
-        except Exception as e:
-            logger.error(f"[{self.nombre}] Error en procesamiento: {e}")
-            return {
-                'referencias': [],
-                'total': 0,
-                'agente': self.nombre,
-                'ronda': ronda,
-                'error': str(e)
-            }
+        # Parsear respuesta JSON
+        referencias = self._parsear_respuesta(respuesta_raw)
+
+        # Filtrar referencias ya encontradas
+        if referencias_previas:
+            referencias_nuevas = self._filtrar_duplicados(
+                referencias, referencias_previas, entrada.get('referencias_previas_index')
+            )
+        else:
+            referencias_nuevas = referencias
+
+        logger.info(f"[{self.nombre}] Encontradas {len(referencias_nuevas)} referencias nuevas")
+
+        return {
+            'referencias': referencias_nuevas,
+            'total': len(referencias_nuevas),
+            'agente': self.nombre,
+            'ronda': ronda,
+            'temperatura': self.temperatura
+        }
+
+    def _resultado_error(self, entrada: Dict[str, Any], error: Exception) -> Dict[str, Any]:
+        """Resultado vacío cuando falla la llamada o el procesamiento"""
+        logger.error(f"[{self.nombre}] Error en procesamiento: {error}")
+        return {
+            'referencias': [],
+            'total': 0,
+            'agente': self.nombre,
+            'ronda': entrada.get('ronda', 1),
+            'error': str(error)
+        }
 
     def _get_system_instruction(self) -> str:
         """Devuelve la instrucción de sistema para el agente"""
-        return """Eres un asistente legal especializado en extracción de referencias legales para oposiciones del Estado español.
+        return _SYSTEM_INSTRUCTION
 
-Tu tarea es identificar TODAS las referencias legales (leyes, artículos, reales decretos, constitución, etc.) mencionadas en textos de temas de oposiciones.
+    def _prefijo_prompt(self, texto: Union[str, bytes]) -> str:
+        """
+        Parte inicial del prompt (instrucción + texto), común a todas las rondas
 
-REGLAS CRÍTICAS:
-1. SOLO incluye referencias que aparezcan EXPLÍCITAMENTE en el texto
-2. NO inventes ni deduzcas referencias que no estén escritas
-3. NO incluyas referencias genéricas como "la ley" sin especificar cuál
-4. SÉ EXTREMADAMENTE CONSERVADOR: en caso de duda, NO incluyas la referencia
-5. Extrae el texto EXACTO de la referencia tal como aparece
+        Args:
+            texto: Texto del tema (str o bytes UTF-8)
 
-IMPORTANTE: Devuelve SOLO JSON válido, sin texto adicional."""
+        Returns:
+            Prefijo del prompt
+        """
+        # Truncar texto si es muy largo (Gemini tiene límite)
+        max_chars = self.limite_chars_texto(texto)
+        texto, truncado = truncar_texto_prompt(texto, max_chars)
+        marca_truncado = "\n\n[... texto truncado ...]" if truncado else ""
+        if truncado:
+            logger.warning(
+                f"[{self.nombre}] Texto truncado a {max_chars} caracteres (~{MAX_TOKENS_TEXTO_PROMPT} tokens)"
+            )
+
+        return f"""Analiza el siguiente texto de un tema de oposiciones y extrae TODAS las referencias legales.
+
+TEXTO A ANALIZAR:
+---
+{texto}{marca_truncado}
+---
+"""
 
     def _construir_prompt(
         self,
@@ -143,22 +299,16 @@ IMPORTANTE: Devuelve SOLO JSON válido, sin texto adicional."""
         Returns:
             Prompt formateado
         """
-        # Truncar texto si es muy largo (Gemini tiene límite)
-        max_chars = 50000  # ~12,500 tokens
-        if len(texto) > max_chars:
-            texto = texto[:max_chars] + "\n\n[... texto truncado ...]"
-            logger.warning(f"[{self.nombre}] Texto truncado a {max_chars} caracteres")
-
-        prompt = f"""Analiza el siguiente texto de un tema de oposiciones y extrae TODAS las referencias legales.
-
-TEXTO A ANALIZAR:
----
-{texto}
----
-
-RONDA DE EXTRACCIÓN: {ronda}
+        # Se acumulan las partes y se unen una sola vez al final. Orden de lo
+        # más estable a lo que más cambia entre rondas (prefijo con el texto,
+        # bloques fijos por texto, previas, formato y por último el número de
+        # ronda), para que las rondas compartan el prefijo más largo posible
+        partes = [self._prefijo_prompt(texto), "\n"]
 
-"""
+        # Inyectar siglas legales conocidas
+        siglas_text = cargar_siglas_para_prompt(max_siglas=20)
+        if siglas_text:
+            partes.append(f"\n{siglas_text}\n")
 
         # Si hay referencias previas, mencionarlas para evitar duplicados
         if referencias_previas and ronda > 1:
@@ -167,71 +317,18 @@ RONDA DE EXTRACCIÓN: {ronda}
                 for ref in referencias_previas[:10]  # Solo primeras 10
             ])
 
-            prompt += f"""REFERENCIAS YA ENCONTRADAS (no las repitas):
+            partes.append(f"""REFERENCIAS YA ENCONTRADAS (no las repitas):
 {refs_previas_str}
 {"... y más" if len(referencias_previas) > 10 else ""}
 
 TAREA: Encuentra NUEVAS referencias que NO estén en la lista anterior.
 
-"""
+""")
 
-        # Inyectar siglas legales conocidas
-        siglas_text = cargar_siglas_para_prompt(max_siglas=20)
-        if siglas_text:
-            prompt += f"\n{siglas_text}\n"
+        partes.append(_PROMPT_FORMATO)
+        partes.append(f"\n\nRONDA DE EXTRACCIÓN: {ronda}\n")
 
-        prompt += """FORMATO DE RESPUESTA (JSON):
-```json
-{
-  "referencias": [
-    {
-      "texto_completo": "Artículo 24 de la Constitución Española",
-      "tipo": "artículo",
-      "ley": "Constitución Española",
-      "articulo": "24",
-      "contexto": "El artículo 24 de la Constitución Española reconoce el derecho...",
-      "confianza": 100
-    },
-    {
-      "texto_completo": "Ley 39/2015, de 1 de octubre, del Procedimiento Administrativo Común",
-      "tipo": "ley",
-      "ley": "Ley 39/2015",
-      "fecha": "1 de octubre de 2015",
-      "nombre_completo": "del Procedimiento Administrativo Común de las Administraciones Públicas",
-      "contexto": "La Ley 39/2015 establece...",
-      "confianza": 100
-    },
-    {
-      "texto_completo": "artículo 23.2.b de la LPAC",
-      "tipo": "artículo",
-      "ley": "LPAC",
-      "articulo": "23.2.b",
-      "contexto": "Según el artículo 23.2.b de la LPAC...",
-      "confianza": 95
-    }
-  ]
-}
-```
-
-TIPOS DE REFERENCIAS A BUSCAR:
-- Leyes (Ley X/YYYY)
-- Real Decreto (RD X/YYYY, Real Decreto X/YYYY)
-- Artículos de leyes (Artículo X de la Ley Y)
-- Constitución Española (artículos específicos)
-- Reglamentos
-- Directivas UE
-- Tratados internacionales
-- Siglas (LPAC, LRJSP, LEC, LJCA, etc.)
-
-NIVEL DE CONFIANZA:
-- 100: Referencia completamente explícita
-- 90-99: Referencia muy clara
-- 80-89: Referencia clara pero puede tener ambigüedad menor
-- NO incluyas referencias con confianza < 80
-
-Responde SOLO con el JSON, sin texto adicional antes o después."""
-
-        return prompt
+        return "".join(partes)
 
     def _parsear_respuesta(self, respuesta_raw: str) -> List[Dict]:
         """
@@ -243,21 +340,43 @@ Responde SOLO con el JSON, sin texto adicional antes o después."""
         Returns:
             Lista de referencias extraídas
         """
+        # Caso habitual: la respuesta ya es JSON limpio, sin regex
+        try:
+            data = cargar_json(respuesta_raw)
+            if isinstance(data, dict):
+                referencias = data.get('referencias', [])
+                logger.debug(f"[{self.nombre}] Parseadas {len(referencias)} referencias")
+                return referencias
+        except json.JSONDecodeError:
+            pass
+
+        # Texto alrededor del JSON: localizar el objeto contando llaves
+        json_str = _objeto_json_completo(respuesta_raw)
+        if json_str is not None:
+            try:
+                data = cargar_json(json_str)
+                if isinstance(data, dict) and 'referencias' in data:
+                    referencias = data['referencias']
+                    logger.debug(f"[{self.nombre}] Parseadas {len(referencias)} referencias")
+                    return referencias
+            except json.JSONDecodeError:
+                pass
+
         try:
             # Extraer JSON del markdown si está envuelto en ```json
-            json_match = re.search(r'```json\s*(\{.*?\})\s*```', respuesta_raw, re.DOTALL)
+            json_match = _JSON_MD_RE.search(respuesta_raw)
             if json_match:
                 json_str = json_match.group(1)
             else:
                 # Intentar buscar cualquier JSON en la respuesta
-                json_match = re.search(r'\{.*"referencias".*\}', respuesta_raw, re.DOTALL)
+                json_match = _JSON_RE.search(respuesta_raw)
                 if json_match:
                     json_str = json_match.group(0)
                 else:
                     json_str = respuesta_raw
 
             # Parsear JSON
-            data = json.loads(json_str)
+            data = cargar_json(json_str)
             referencias = data.get('referencias', [])
 
             logger.debug(f"[{self.nombre}] Parseadas {len(referencias)} referencias")
@@ -285,23 +404,15 @@ Responde SOLO con el JSON, sin texto adicional antes o después."""
 
         referencias = []
 
-        # Buscar patrones de leyes
-        patrones_ley = [
-            r'Ley\s+(\d+/\d{4})',
-            r'Real\s+Decreto\s+(\d+/\d{4})',
-            r'RD\s+(\d+/\d{4})',
-        ]
-
-        for patron in patrones_ley:
-            matches = re.finditer(patron, respuesta_raw, re.IGNORECASE)
-            for match in matches:
-                referencias.append({
-                    'texto_completo': match.group(0),
-                    'tipo': 'ley',
-                    'ley': match.group(1),
-                    'confianza': 80,
-                    'contexto': '(extraído por fallback)'
-                })
+        # Buscar patrones de leyes (Ley, Real Decreto o RD en una sola pasada)
+        for match in _LEY_RE.finditer(respuesta_raw):
+            referencias.append({
+                'texto_completo': match.group(0),
+                'tipo': 'ley',
+                'ley': match.group(1),
+                'confianza': 80,
+                'contexto': '(extraído por fallback)'
+            })
 
         logger.info(f"[{self.nombre}] Fallback encontró {len(referencias)} referencias")
 
@@ -310,7 +421,8 @@ Responde SOLO con el JSON, sin texto adicional antes o después."""
     def _filtrar_duplicados(
         self,
         referencias_nuevas: List[Dict],
-        referencias_previas: List[Dict]
+        referencias_previas: List[Dict],
+        indice_previas: Optional[AbstractSet[int]] = None
     ) -> List[Dict]:
         """
         Filtra referencias duplicadas
@@ -318,24 +430,25 @@ Responde SOLO con el JSON, sin texto adicional antes o después."""
         Args:
             referencias_nuevas: Nuevas referencias encontradas
             referencias_previas: Referencias ya encontradas antes
+            indice_previas: Huellas de los textos de referencias_previas ya
+                calculadas por el orquestador (si no, se construyen aquí)
 
         Returns:
             Lista de referencias únicas
         """
-        # Crear set de textos completos previos (normalizados)
-        textos_previos = set()
-        for ref in referencias_previas:
-            texto = (ref.get('texto_completo') or ref.get('texto') or '').lower().strip()
-            if texto:
-                textos_previos.add(texto)
-
-        # Filtrar duplicados
+        if indice_previas is None:
+            indice_previas = {
+                h for ref in referencias_previas if (h := huella(normalizar_texto_referencia(ref)))
+            }
+
+        # Filtrar duplicados (el índice compartido no se modifica)
+        vistos = set()
         referencias_unicas = []
         for ref in referencias_nuevas:
-            texto = (ref.get('texto_completo') or ref.get('texto') or '').lower().strip()
-            if texto and texto not in textos_previos:
+            h = huellas_referencia(ref)[0]
+            if h and h not in indice_previas and h not in vistos:
                 referencias_unicas.append(ref)
-                textos_previos.add(texto)  # Agregar para evitar duplicados internos
+                vistos.add(h)  # Evitar duplicados internos
 
         logger.debug(
             f"[{self.nombre}] Filtrados duplicados: "
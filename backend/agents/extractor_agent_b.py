@@ -12,15 +12,183 @@ Version: 0.2.0
 License: MIT
 """
 
+import asyncio
 import json
 import logging
 import re
-from typing import Dict, List, Any
-from .base_agent import BaseAgent
+from typing import AbstractSet, Any, Dict, List, Optional, Union
+from .base_agent import (
+    BaseAgent, MAX_CHARS_TEXTO_PROMPT, MAX_TOKENS_TEXTO_PROMPT, cargar_json,
+    huella, huellas_referencia, normalizar_ley_referencia, normalizar_texto_referencia, truncar_texto_prompt,
+)
+from modules.explicit_extractor import extraer_referencias_explicitas, extraer_siglas, formatear_explicitas_para_prompt
 from modules.siglas_loader import cargar_siglas_para_prompt
 
 logger = logging.getLogger(__name__)
 
+# RE2 (tiempo lineal garantizado, sin backtracking) para el parseo fallback
+# si está instalado; si no, el módulo re estándar
+try:
+    import re2 as _re_fallback
+except ImportError:
+    _re_fallback = re
+
+# Patrones compilados una sola vez al cargar el módulo
+# JSON envuelto en ```json (grupo 1) o cualquier objeto con "referencias"
+# (grupo 2), buscados en una sola pasada
+_JSON_ANY_RE = re.compile(r'```json\s*(\{.*?\})\s*```|(\{.*"referencias".*\})', re.DOTALL)
+
+# Patrones del parseo fallback (más agresivos): (grupo, tipo, patrón).
+# Cada patrón tiene un único grupo interno con el valor de 'ley'.
+_FALLBACK_PATTERNS = (
+    ('ley', 'ley', r'Ley\s+(?:Orgánica\s+)?(\d+/\d{4})'),
+    ('rd', 'real_decreto', r'Real\s+Decreto\s+(?:Ley\s+)?(\d+/\d{4})'),
+    ('rdl', 'real_decreto', r'RDL?\s+(\d+/\d{4})'),
+    ('sigla', 'sigla', r'\b(LPAC|LRJSP|LEC|LJCA|CE|LAECSP)\b'),
+    ('art', 'artículo', r'art(?:ículo|\.)?\s+(\d+(?:\.\d+)?(?:\.[a-z])?)'),
+)
+
+# Todos los patrones en una sola alternancia: una única pasada sobre el texto
+_FALLBACK_RE = _re_fallback.compile(
+    '(?i)' + '|'.join(f'(?P<{grupo}>{patron})' for grupo, _, patron in _FALLBACK_PATTERNS)
+)
+_GROUP_TO_TIPO = {grupo: tipo for grupo, tipo, _ in _FALLBACK_PATTERNS}
+
+# Instrucción de sistema, idéntica en todas las llamadas
+_SYSTEM_INSTRUCTION = """Eres un asistente legal especializado en extracción EXHAUSTIVA de referencias legales para oposiciones del Estado español.
+
+Tu tarea es identificar TODAS las referencias legales, incluyendo las IMPLÍCITAS y las que se mencionan mediante SIGLAS.
+
+REGLAS:
+1. Busca referencias EXPLÍCITAS (escritas claramente)
+2. Busca referencias IMPLÍCITAS (mencionadas indirectamente)
+3. Identifica SIGLAS legales (LPAC, LRJSP, LEC, CE, etc.) y expándelas
+4. Detecta referencias a "la ley", "el reglamento", etc. y deduce cuál es según el contexto
+5. SÉ MÁS INCLUSIVO: en caso de duda razonable, INCLUYE la referencia
+6. Marca el nivel de confianza según cuán explícita sea la referencia
+
+IMPORTANTE: Devuelve SOLO JSON válido, sin texto adicional."""
+
+# Parte final del prompt (formato JSON, tipos e instrucciones),
+# idéntica en todas las llamadas
+_PROMPT_FORMATO_JSON = """FORMATO DE RESPUESTA (JSON):
+```json
+{
+  "referencias": [
+    {
+      "texto_completo": "LPAC",
+      "tipo": "sigla",
+      "ley": "Ley 39/2015",
+      "nombre_completo": "Ley del Procedimiento Administrativo Común de las Administraciones Públicas",
+      "contexto": "Según la LPAC, los interesados...",
+      "confianza": 95
+    },
+    {
+      "texto_completo": "la Constitución (implícito: artículo 14)",
+      "tipo": "artículo",
+      "ley": "Constitución Española",
+      "articulo": "14",
+      "contexto": "El principio de igualdad ante la ley...",
+      "confianza": 75,
+      "es_implicita": true
+    },
+    {
+      "texto_completo": "Real Decreto 203/2021",
+      "tipo": "real_decreto",
+      "ley": "Real Decreto 203/2021",
+      "fecha": "2021",
+      "nombre_completo": "Reglamento de actuación y funcionamiento del sector público por medios electrónicos",
+      "contexto": "El RD 203/2021 desarrolla...",
+      "confianza": 100
+    }
+  ]
+}
+```
+
+"""
+
+_PROMPT_TIPOS = """TIPOS DE REFERENCIAS A BUSCAR (SÉ EXHAUSTIVO):
+
+1. REFERENCIAS EXPLÍCITAS:
+   - Leyes: "Ley 39/2015", "Ley Orgánica 3/2007"
+   - Reales Decretos: "Real Decreto 203/2021", "RD 203/2021"
+   - Artículos: "artículo 24 de la CE", "art. 23.2.b de la LPAC"
+   - Constitución: "Constitución Española", "CE"
+
+2. SIGLAS Y ABREVIATURAS (EXPÁNDELAS):
+   - LPAC → Ley 39/2015
+   - LRJSP → Ley 40/2015
+   - LEC → Ley 1/2000 (Enjuiciamiento Civil)
+   - LJCA → Ley 29/1998 (Jurisdicción Contencioso-Administrativa)
+   - CE → Constitución Española
+   - LRJPAC → Ley 30/1992 (antigua)
+   - LAECSP → Ley 11/2007
+   - ... y muchas más
+
+3. REFERENCIAS IMPLÍCITAS:
+   - "la ley" → deducir cuál según contexto
+   - "el reglamento" → identificar cuál
+   - "dicha norma" → identificar a qué se refiere
+   - "como establece el apartado anterior" → identificar artículo
+
+4. MENCIONES INDIRECTAS:
+   - "el derecho a la tutela judicial efectiva" → art. 24 CE
+   - "el procedimiento administrativo común" → Ley 39/2015
+   - "la jurisdicción contencioso-administrativa" → Ley 29/1998
+
+NIVEL DE CONFIANZA:
+- 100: Referencia completamente explícita con número
+- 90-99: Referencia muy clara o sigla conocida
+- 80-89: Referencia clara pero implícita
+- 70-79: Referencia deducida del contexto
+- 60-69: Referencia probable pero con ambigüedad
+- Incluye referencias con confianza >= 60
+
+INSTRUCCIÓN ESPECIAL:
+Busca referencias que un agente conservador podría haber pasado por alto.
+Sé más inclusivo y exhaustivo. La validación posterior filtrará falsos positivos.
+
+Responde SOLO con el JSON, sin texto adicional antes o después."""
+
+_PROMPT_FORMATO = _PROMPT_FORMATO_JSON + _PROMPT_TIPOS
+
+# Procesamiento por lotes: varios temas en una sola llamada. El límite de
+# temas acota también el tamaño del JSON de salida
+MAX_TEMAS_LOTE = 5
+MAX_CHARS_LOTE = 3 * MAX_CHARS_TEXTO_PROMPT
+
+_PROMPT_FORMATO_LOTE = """FORMATO DE RESPUESTA (JSON), un resultado por cada texto con su número:
+```json
+{
+  "resultados": [
+    {
+      "tema_id": 1,
+      "referencias": [
+        {
+          "texto_completo": "LPAC",
+          "tipo": "sigla",
+          "ley": "Ley 39/2015",
+          "nombre_completo": "Ley del Procedimiento Administrativo Común de las Administraciones Públicas",
+          "contexto": "Según la LPAC, los interesados...",
+          "confianza": 95
+        }
+      ]
+    },
+    {
+      "tema_id": 2,
+      "referencias": []
+    }
+  ]
+}
+```
+
+Incluye TODOS los textos en "resultados", aunque no tengan referencias.
+Cada referencia usa los mismos campos que en una extracción individual
+(texto_completo, tipo, ley, nombre_completo, articulo, fecha, contexto,
+confianza, es_implicita).
+
+"""
+
 
 class ExtractorAgentB(BaseAgent):
     """
@@ -33,18 +201,21 @@ class ExtractorAgentB(BaseAgent):
     - Identifica siglas y abreviaturas
     """
 
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, client=None):
         """
         Inicializa el Agente 1B (Agresivo)
 
         Args:
             api_key: API key de Gemini (opcional)
+            client: Cliente de Gemini compartido con otros agentes (opcional)
         """
         super().__init__(
             nombre="Agente1B-Agresivo",
             modelo="gemini-2.0-flash-exp",
             temperatura=0.4,  # Más agresivo
-            api_key=api_key
+            api_key=api_key,
+            request_timeout=120.0,  # La extracción devuelve JSON largo
+            client=client
         )
 
     def procesar(self, entrada: Dict[str, Any]) -> Dict[str, Any]:
@@ -64,6 +235,144 @@ class ExtractorAgentB(BaseAgent):
                 - 'agente': str - Nombre del agente
                 - 'ronda': int - Número de ronda
         """
+        prompt = self.preparar_prompt(entrada)
+
+        # Llamar a Gemini
+        try:
+            respuesta_raw = self.generar_contenido(prompt, self._get_system_instruction())
+            return self.procesar_respuesta(respuesta_raw, entrada)
+
+        except Exception as e:
+            return self._resultado_error(entrada, e)
+
+    async def procesar_async(self, entrada: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Variante asíncrona de procesar (cliente aio de google-genai)
+
+        Args:
+            entrada: Igual que en procesar
+
+        Returns:
+            Igual que procesar
+        """
+        prompt = self.preparar_prompt(entrada)
+
+        try:
+            respuesta_raw = await self.generar_contenido_async(prompt, self._get_system_instruction())
+            return self.procesar_respuesta(respuesta_raw, entrada)
+
+        except Exception as e:
+            return self._resultado_error(entrada, e)
+
+    def procesar_batch(self, entradas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Procesa varios temas agrupándolos en el menor número de llamadas
+
+        Pensado para la primera ronda de muchos temas (un temario completo):
+        cada llamada lleva hasta MAX_TEMAS_LOTE textos y MAX_CHARS_LOTE
+        caracteres, y la respuesta se reparte por tema_id. Los temas que el
+        modelo no devuelva se procesan de nuevo de forma individual.
+
+        Args:
+            entradas: Lista de entradas como las de procesar
+
+        Returns:
+            Lista de resultados (como los de procesar) en el mismo orden
+        """
+        resultados = []
+        for lote in self._agrupar_lote(entradas):
+            try:
+                respuesta_raw = self.generar_contenido(
+                    self._construir_prompt_lote(lote), self._get_system_instruction()
+                )
+                por_tema = self._parsear_respuesta_lote(respuesta_raw)
+            except Exception as e:
+                logger.error(f"[{self.nombre}] Error en lote de {len(lote)} temas: {e}")
+                por_tema = {}
+
+            for i, entrada in enumerate(lote, 1):
+                if i in por_tema:
+                    resultados.append(self._resultado_desde_referencias(por_tema[i], entrada))
+                else:
+                    resultados.append(self.procesar(entrada))
+
+        return resultados
+
+    async def procesar_batch_async(self, entradas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Variante asíncrona de procesar_batch (los lotes se lanzan a la vez)
+
+        Args:
+            entradas: Lista de entradas como las de procesar
+
+        Returns:
+            Igual que procesar_batch
+        """
+        async def _procesar_lote(lote: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+            try:
+                respuesta_raw = await self.generar_contenido_async(
+                    self._construir_prompt_lote(lote), self._get_system_instruction()
+                )
+                por_tema = self._parsear_respuesta_lote(respuesta_raw)
+            except Exception as e:
+                logger.error(f"[{self.nombre}] Error en lote de {len(lote)} temas: {e}")
+                por_tema = {}
+
+            return [
+                self._resultado_desde_referencias(por_tema[i], entrada) if i in por_tema
+                else await self.procesar_async(entrada)
+                for i, entrada in enumerate(lote, 1)
+            ]
+
+        # Contar antes (sin bloquear) los tokens de los textos largos
+        await asyncio.gather(*(self.contar_tokens_texto_async(e.get('texto', '')) for e in entradas))
+
+        lotes = await asyncio.gather(*(_procesar_lote(lote) for lote in self._agrupar_lote(entradas)))
+        return [resultado for lote in lotes for resultado in lote]
+
+    def _agrupar_lote(self, entradas: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """
+        Reparte las entradas en lotes de como máximo MAX_TEMAS_LOTE temas y
+        MAX_CHARS_LOTE caracteres de texto (un tema nunca se parte)
+
+        Args:
+            entradas: Lista de entradas como las de procesar
+
+        Returns:
+            Lista de lotes en el orden original
+        """
+        lotes = []
+        lote_actual = []
+        chars_actual = 0
+
+        for entrada in entradas:
+            chars = min(len(entrada.get('texto', '')), MAX_CHARS_TEXTO_PROMPT)
+            if lote_actual and (
+                len(lote_actual) >= MAX_TEMAS_LOTE or chars_actual + chars > MAX_CHARS_LOTE
+            ):
+                lotes.append(lote_actual)
+                lote_actual = []
+                chars_actual = 0
+            lote_actual.append(entrada)
+            chars_actual += chars
+
+        if lote_actual:
+            lotes.append(lote_actual)
+
+        logger.info(f"[{self.nombre}] {len(entradas)} temas agrupados en {len(lotes)} lotes")
+
+        return lotes
+
+    def preparar_prompt(self, entrada: Dict[str, Any]) -> str:
+        """
+        Construye el prompt de extracción para una entrada
+
+        Args:
+            entrada: Igual que en procesar
+
+        Returns:
+            Prompt listo para enviar a Gemini
+        """
         texto = entrada.get('texto', '')
         ronda = entrada.get('ronda', 1)
         referencias_previas = entrada.get('referencias_previas', [])
@@ -72,60 +381,118 @@ class ExtractorAgentB(BaseAgent):
         logger.info(f"[{self.nombre}] Texto: {len(texto)} caracteres")
         logger.info(f"[{self.nombre}] Referencias previas: {len(referencias_previas)}")
 
-        # Construir prompt
-        prompt = self._construir_prompt(texto, ronda, referencias_previas)
+        return self._construir_prompt(texto, ronda, referencias_previas)
 
-        # System instruction
-        system_instruction = self._get_system_instruction()
+    async def preparar_cache_async(self, texto: str) -> bool:
+        """
+        Cachea en Gemini el prefijo del prompt (con el texto) para todas las rondas
 
-        # Llamar a Gemini
-        try:
-            respuesta_raw = self.generar_contenido(prompt, system_instruction)
+        Args:
+            texto: Texto del tema
 
-            # Parsear respuesta JSON
-            referencias = self._parsear_respuesta(respuesta_raw)
+        Returns:
+            True si la caché está activa
+        """
+        return await self.crear_cache_contexto_async(
+            self._prefijo_prompt(texto), self._get_system_instruction()
+        )
+
+    def procesar_respuesta(self, respuesta_raw: str, entrada: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Parsea la respuesta de Gemini y filtra las referencias ya encontradas
 
-            # Filtrar referencias ya encontradas
-            if referencias_previas:
-                referencias_nuevas = self._filtrar_duplicados(referencias, referencias_previas)
-            else:
-                referencias_nuevas = referencias
+        Args:
+            respuesta_raw: Respuesta de Gemini
+            entrada: Entrada con la que se construyó el prompt
 
-            logger.info(f"[{self.nombre}] Encontradas {len(referencias_nuevas)} referencias nuevas")
+        Returns:
+            Igual que procesar
+        """
+        return self._resultado_desde_referencias(self._parsear_respuesta(respuesta_raw), entrada)
 
-            return {
-                'referencias': referencias_nuevas,
-                'total': len(referencias_nuevas),
-                'agente': self.nombre,
-                'ronda': ronda,
-                'temperatura': self.temperatura
-            }
+    def _resultado_desde_referencias(self, referencias: List[Dict], entrada: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Completa y filtra las referencias devueltas por el modelo para una entrada
 
-        except Exception as e:
-            logger.error(f"[{self.nombre}] Error en procesamiento: {e}")
-            return {
-                'referencias': [],
-                'total': 0,
-                'agente': self.nombre,
-                'ronda': ronda,
-                'error': str(e)
-            }
+        Args:
+            referencias: Referencias parseadas de la respuesta
+            entrada: Entrada con la que se construyó el prompt
+
+        Returns:
+            Igual que procesar
+        """
+        ronda = entrada.get('ronda', 1)
+        referencias_previas = entrada.get('referencias_previas', [])
+
+        # Añadir las normas y siglas detectadas localmente que el modelo no
+        # repitió (una por ley)
+        leyes_modelo = {(ref.get('ley') or '').lower().strip() for ref in referencias}
+        for ref in self._detectadas_localmente(entrada.get('texto', '')):
+            ley = ref['ley'].lower()
+            if ley not in leyes_modelo:
+                referencias.append(ref)
+                leyes_modelo.add(ley)
+
+        # Filtrar referencias ya encontradas
+        if referencias_previas:
+            referencias_nuevas = self._filtrar_duplicados(
+                referencias, referencias_previas,
+                entrada.get('referencias_previas_index'), entrada.get('referencias_previas_leyes')
+            )
+        else:
+            referencias_nuevas = referencias
+
+        logger.info(f"[{self.nombre}] Encontradas {len(referencias_nuevas)} referencias nuevas")
+
+        return {
+            'referencias': referencias_nuevas,
+            'total': len(referencias_nuevas),
+            'agente': self.nombre,
+            'ronda': ronda,
+            'temperatura': self.temperatura
+        }
+
+    def _resultado_error(self, entrada: Dict[str, Any], error: Exception) -> Dict[str, Any]:
+        """Resultado vacío cuando falla la llamada o el procesamiento"""
+        logger.error(f"[{self.nombre}] Error en procesamiento: {error}")
+        return {
+            'referencias': [],
+            'total': 0,
+            'agente': self.nombre,
+            'ronda': entrada.get('ronda', 1),
+            'error': str(error)
+        }
 
     def _get_system_instruction(self) -> str:
         """Devuelve la instrucción de sistema para el agente"""
-        return """Eres un asistente legal especializado en extracción EXHAUSTIVA de referencias legales para oposiciones del Estado español.
+        return _SYSTEM_INSTRUCTION
 
-Tu tarea es identificar TODAS las referencias legales, incluyendo las IMPLÍCITAS y las que se mencionan mediante SIGLAS.
+    def _prefijo_prompt(self, texto: Union[str, bytes]) -> str:
+        """
+        Parte inicial del prompt (instrucción + texto), común a todas las rondas
 
-REGLAS:
-1. Busca referencias EXPLÍCITAS (escritas claramente)
-2. Busca referencias IMPLÍCITAS (mencionadas indirectamente)
-3. Identifica SIGLAS legales (LPAC, LRJSP, LEC, CE, etc.) y expándelas
-4. Detecta referencias a "la ley", "el reglamento", etc. y deduce cuál es según el contexto
-5. SÉ MÁS INCLUSIVO: en caso de duda razonable, INCLUYE la referencia
-6. Marca el nivel de confianza según cuán explícita sea la referencia
+        Args:
+            texto: Texto del tema (str o bytes UTF-8)
 
-IMPORTANTE: Devuelve SOLO JSON válido, sin texto adicional."""
+        Returns:
+            Prefijo del prompt
+        """
+        # Truncar texto si es muy largo
+        max_chars = self.limite_chars_texto(texto)
+        texto, truncado = truncar_texto_prompt(texto, max_chars)
+        marca_truncado = "\n\n[... texto truncado ...]" if truncado else ""
+        if truncado:
+            logger.warning(
+                f"[{self.nombre}] Texto truncado a {max_chars} caracteres (~{MAX_TOKENS_TEXTO_PROMPT} tokens)"
+            )
+
+        return f"""Analiza EXHAUSTIVAMENTE el siguiente texto de un tema de oposiciones y extrae TODAS las referencias legales, incluyendo las implícitas.
+
+TEXTO A ANALIZAR:
+---
+{texto}{marca_truncado}
+---
+"""
 
     def _construir_prompt(
         self,
@@ -144,22 +511,16 @@ IMPORTANTE: Devuelve SOLO JSON válido, sin texto adicional."""
         Returns:
             Prompt formateado
         """
-        # Truncar texto si es muy largo
-        max_chars = 50000  # ~12,500 tokens
-        if len(texto) > max_chars:
-            texto = texto[:max_chars] + "\n\n[... texto truncado ...]"
-            logger.warning(f"[{self.nombre}] Texto truncado a {max_chars} caracteres")
-
-        prompt = f"""Analiza EXHAUSTIVAMENTE el siguiente texto de un tema de oposiciones y extrae TODAS las referencias legales, incluyendo las implícitas.
-
-TEXTO A ANALIZAR:
----
-{texto}
----
+        # Se acumulan las partes y se unen una sola vez al final. Orden de lo
+        # más estable a lo que más cambia entre rondas (prefijo con el texto,
+        # bloques fijos por texto, previas, formato y por último el número de
+        # ronda), para que las rondas compartan el prefijo más largo posible
+        partes = [self._prefijo_prompt(texto), "\n"]
 
-RONDA DE EXTRACCIÓN: {ronda}
-
-"""
+        # Normas con número y siglas conocidas ya detectadas localmente (se
+        # añaden al resultado). Sustituye a la lista genérica de siglas: el
+        # modelo solo ve las que aparecen en el texto, ya expandidas
+        partes.append(formatear_explicitas_para_prompt(self._detectadas_localmente(texto)))
 
         # Si hay referencias previas, mencionarlas para evitar duplicados
         if referencias_previas and ronda > 1:
@@ -168,98 +529,99 @@ RONDA DE EXTRACCIÓN: {ronda}
                 for ref in referencias_previas[:10]  # Solo primeras 10
             ])
 
-            prompt += f"""REFERENCIAS YA ENCONTRADAS (no las repitas):
+            partes.append(f"""REFERENCIAS YA ENCONTRADAS (no las repitas):
 {refs_previas_str}
 {"... y más" if len(referencias_previas) > 10 else ""}
 
 TAREA: Encuentra NUEVAS referencias que NO estén en la lista anterior.
 Busca referencias que el agente conservador pudo haber pasado por alto.
 
-"""
+""")
+
+        partes.append(_PROMPT_FORMATO)
+        partes.append(f"\n\nRONDA DE EXTRACCIÓN: {ronda}\n")
+
+        return "".join(partes)
+
+    def _detectadas_localmente(self, texto: Union[str, bytes]) -> List[Dict]:
+        """
+        Normas con número (por patrón) y siglas conocidas (Aho-Corasick) del texto
+
+        Args:
+            texto: Texto del tema
+
+        Returns:
+            Referencias detectadas sin llamar al modelo
+        """
+        return extraer_referencias_explicitas(texto) + extraer_siglas(texto)
+
+    def _construir_prompt_lote(self, entradas: List[Dict[str, Any]]) -> str:
+        """
+        Construye un único prompt con varios textos numerados (TEXTO 1, TEXTO 2...)
+
+        Args:
+            entradas: Entradas del lote
 
-        # Inyectar siglas legales conocidas
+        Returns:
+            Prompt formateado
+        """
+        partes = [f"""Analiza EXHAUSTIVAMENTE cada uno de los siguientes {len(entradas)} textos de temas de oposiciones y extrae, POR SEPARADO para cada texto, TODAS las referencias legales, incluyendo las implícitas.
+
+"""]
+
+        for i, entrada in enumerate(entradas, 1):
+            texto = entrada.get('texto', '')
+            texto, truncado = truncar_texto_prompt(texto, self.limite_chars_texto(texto))
+            marca_truncado = "\n\n[... texto truncado ...]" if truncado else ""
+            partes.append(f"""TEXTO {i}:
+---
+{texto}{marca_truncado}
+---
+
+""")
+
+        # Inyectar siglas legales conocidas (una vez para todo el lote)
         siglas_text = cargar_siglas_para_prompt(max_siglas=20)
         if siglas_text:
-            prompt += f"\n{siglas_text}\n"
+            partes.append(f"\n{siglas_text}\n")
 
-        prompt += """FORMATO DE RESPUESTA (JSON):
-```json
-{
-  "referencias": [
-    {
-      "texto_completo": "LPAC",
-      "tipo": "sigla",
-      "ley": "Ley 39/2015",
-      "nombre_completo": "Ley del Procedimiento Administrativo Común de las Administraciones Públicas",
-      "contexto": "Según la LPAC, los interesados...",
-      "confianza": 95
-    },
-    {
-      "texto_completo": "la Constitución (implícito: artículo 14)",
-      "tipo": "artículo",
-      "ley": "Constitución Española",
-      "articulo": "14",
-      "contexto": "El principio de igualdad ante la ley...",
-      "confianza": 75,
-      "es_implicita": true
-    },
-    {
-      "texto_completo": "Real Decreto 203/2021",
-      "tipo": "real_decreto",
-      "ley": "Real Decreto 203/2021",
-      "fecha": "2021",
-      "nombre_completo": "Reglamento de actuación y funcionamiento del sector público por medios electrónicos",
-      "contexto": "El RD 203/2021 desarrolla...",
-      "confianza": 100
-    }
-  ]
-}
-```
+        partes.append(_PROMPT_FORMATO_LOTE)
+        partes.append(_PROMPT_TIPOS)
 
-TIPOS DE REFERENCIAS A BUSCAR (SÉ EXHAUSTIVO):
+        return "".join(partes)
 
-1. REFERENCIAS EXPLÍCITAS:
-   - Leyes: "Ley 39/2015", "Ley Orgánica 3/2007"
-   - Reales Decretos: "Real Decreto 203/2021", "RD 203/2021"
-   - Artículos: "artículo 24 de la CE", "art. 23.2.b de la LPAC"
-   - Constitución: "Constitución Española", "CE"
+    def _parsear_respuesta_lote(self, respuesta_raw: str) -> Dict[int, List[Dict]]:
+        """
+        Parsea la respuesta de un lote y la reparte por tema
 
-2. SIGLAS Y ABREVIATURAS (EXPÁNDELAS):
-   - LPAC → Ley 39/2015
-   - LRJSP → Ley 40/2015
-   - LEC → Ley 1/2000 (Enjuiciamiento Civil)
-   - LJCA → Ley 29/1998 (Jurisdicción Contencioso-Administrativa)
-   - CE → Constitución Española
-   - LRJPAC → Ley 30/1992 (antigua)
-   - LAECSP → Ley 11/2007
-   - ... y muchas más
+        Args:
+            respuesta_raw: Texto de respuesta de Gemini
 
-3. REFERENCIAS IMPLÍCITAS:
-   - "la ley" → deducir cuál según contexto
-   - "el reglamento" → identificar cuál
-   - "dicha norma" → identificar a qué se refiere
-   - "como establece el apartado anterior" → identificar artículo
+        Returns:
+            Dict tema_id -> referencias (sin los temas que falten o no se puedan leer)
+        """
+        try:
+            json_match = _JSON_ANY_RE.search(respuesta_raw)
+            json_str = (json_match.group(1) or json_match.group(2)) if json_match else respuesta_raw
+            data = cargar_json(json_str)
 
-4. MENCIONES INDIRECTAS:
-   - "el derecho a la tutela judicial efectiva" → art. 24 CE
-   - "el procedimiento administrativo común" → Ley 39/2015
-   - "la jurisdicción contencioso-administrativa" → Ley 29/1998
+        except json.JSONDecodeError as e:
+            logger.error(f"[{self.nombre}] Error parseando JSON del lote: {e}")
+            return {}
 
-NIVEL DE CONFIANZA:
-- 100: Referencia completamente explícita con número
-- 90-99: Referencia muy clara o sigla conocida
-- 80-89: Referencia clara pero implícita
-- 70-79: Referencia deducida del contexto
-- 60-69: Referencia probable pero con ambigüedad
-- Incluye referencias con confianza >= 60
+        if not isinstance(data, dict):
+            return {}
 
-INSTRUCCIÓN ESPECIAL:
-Busca referencias que un agente conservador podría haber pasado por alto.
-Sé más inclusivo y exhaustivo. La validación posterior filtrará falsos positivos.
+        por_tema = {}
+        for resultado in data.get('resultados', []):
+            try:
+                por_tema[int(resultado['tema_id'])] = list(resultado.get('referencias') or [])
+            except (KeyError, TypeError, ValueError):
+                continue
 
-Responde SOLO con el JSON, sin texto adicional antes o después."""
+        logger.debug(f"[{self.nombre}] Lote parseado: {len(por_tema)} temas")
 
-        return prompt
+        return por_tema
 
     def _parsear_respuesta(self, respuesta_raw: str) -> List[Dict]:
         """
@@ -272,20 +634,12 @@ Responde SOLO con el JSON, sin texto adicional antes o después."""
             Lista de referencias extraídas
         """
         try:
-            # Extraer JSON del markdown si está envuelto en ```json
-            json_match = re.search(r'```json\s*(\{.*?\})\s*```', respuesta_raw, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-            else:
-                # Intentar buscar cualquier JSON en la respuesta
-                json_match = re.search(r'\{.*"referencias".*\}', respuesta_raw, re.DOTALL)
-                if json_match:
-                    json_str = json_match.group(0)
-                else:
-                    json_str = respuesta_raw
+            # Extraer JSON del markdown (```json) o cualquier JSON de la respuesta
+            json_match = _JSON_ANY_RE.search(respuesta_raw)
+            json_str = (json_match.group(1) or json_match.group(2)) if json_match else respuesta_raw
 
             # Parsear JSON
-            data = json.loads(json_str)
+            data = cargar_json(json_str)
             referencias = data.get('referencias', [])
 
             logger.debug(f"[{self.nombre}] Parseadas {len(referencias)} referencias")
@@ -313,26 +667,16 @@ Responde SOLO con el JSON, sin texto adicional antes o después."""
 
         referencias = []
 
-        # Buscar patrones más agresivamente
-        patrones = [
-            (r'Ley\s+(?:Orgánica\s+)?(\d+/\d{4})', 'ley'),
-            (r'Real\s+Decreto\s+(?:Ley\s+)?(\d+/\d{4})', 'real_decreto'),
-            (r'RDL?\s+(\d+/\d{4})', 'real_decreto'),
-            (r'\b(LPAC|LRJSP|LEC|LJCA|CE|LAECSP)\b', 'sigla'),
-            (r'art(?:ículo|\.)?\s+(\d+(?:\.\d+)?(?:\.[a-z])?)', 'artículo'),
-        ]
-
-        for patron, tipo in patrones:
-            matches = re.finditer(patron, respuesta_raw, re.IGNORECASE)
-            for match in matches:
-                referencias.append({
-                    'texto_completo': match.group(0),
-                    'tipo': tipo,
-                    'ley': match.group(1) if match.groups() else match.group(0),
-                    'confianza': 70,
-                    'contexto': '(extraído por fallback)',
-                    'es_implicita': True
-                })
+        # Buscar patrones más agresivamente (todos en una sola pasada)
+        for match in _FALLBACK_RE.finditer(respuesta_raw):
+            referencias.append({
+                'texto_completo': match.group(0),
+                'tipo': _GROUP_TO_TIPO[match.lastgroup],
+                'ley': match.group(match.lastindex + 1),  # grupo interno del patrón
+                'confianza': 70,
+                'contexto': '(extraído por fallback)',
+                'es_implicita': True
+            })
 
         logger.info(f"[{self.nombre}] Fallback encontró {len(referencias)} referencias")
 
@@ -341,42 +685,50 @@ Responde SOLO con el JSON, sin texto adicional antes o después."""
     def _filtrar_duplicados(
         self,
         referencias_nuevas: List[Dict],
-        referencias_previas: List[Dict]
+        referencias_previas: List[Dict],
+        indice_previas: Optional[AbstractSet[int]] = None,
+        indice_leyes: Optional[AbstractSet[int]] = None
     ) -> List[Dict]:
         """
-        Filtra referencias duplicadas
+        Filtra referencias duplicadas (por texto completo o por ley)
 
         Args:
             referencias_nuevas: Nuevas referencias encontradas
             referencias_previas: Referencias ya encontradas antes
+            indice_previas: Huellas de los textos de referencias_previas ya
+                calculadas por el orquestador (si no, se construyen aquí)
+            indice_leyes: Huellas de las leyes de referencias_previas (ídem)
 
         Returns:
             Lista de referencias únicas
         """
-        # Crear set de textos completos previos (normalizados)
-        textos_previos = set()
-        for ref in referencias_previas:
-            texto = (ref.get('texto_completo') or ref.get('texto') or '').lower().strip()
-            if texto:
-                textos_previos.add(texto)
-
-            # También agregar la ley sin contexto adicional
-            ley = (ref.get('ley') or '').lower().strip()
-            if ley:
-                textos_previos.add(ley)
+        if indice_previas is None or indice_leyes is None:
+            indice_previas = {h for ref in referencias_previas if (h := huella(normalizar_texto_referencia(ref)))}
+            indice_leyes = {h for ref in referencias_previas if (h := huella(normalizar_ley_referencia(ref)))}
+
+        # Columnas de huellas (texto, ley), calculadas antes del filtrado
+        textos, leyes = zip(*map(huellas_referencia, referencias_nuevas)) if referencias_nuevas else ((), ())
+
+        # 1) Descartar en una pasada las que ya están en los índices previos
+        # (textos y leyes se comparan entre sí; los índices no se modifican)
+        en_previas = indice_previas.__contains__
+        en_leyes = indice_leyes.__contains__
+        candidatas = [
+            i for i, (texto, ley) in enumerate(zip(textos, leyes))
+            if not (en_previas(texto) or en_leyes(texto) or en_previas(ley) or en_leyes(ley))
+        ]
 
-        # Filtrar duplicados
+        # 2) Duplicados internos entre las nuevas (depende del orden)
+        vistos = set()
         referencias_unicas = []
-        for ref in referencias_nuevas:
-            texto = (ref.get('texto_completo') or ref.get('texto') or '').lower().strip()
-            ley = (ref.get('ley') or '').lower().strip()
-
-            # Verificar si es duplicado
-            if texto not in textos_previos and ley not in textos_previos:
-                referencias_unicas.append(ref)
-                textos_previos.add(texto)
+        for i in candidatas:
+            texto, ley = textos[i], leyes[i]
+            if texto not in vistos and ley not in vistos:
+                referencias_unicas.append(referencias_nuevas[i])
+                if texto:
+                    vistos.add(texto)
                 if ley:
-                    textos_previos.add(ley)
+                    vistos.add(ley)
 
         logger.debug(
             f"[{self.nombre}] Filtrados duplicados: "
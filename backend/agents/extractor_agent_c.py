@@ -15,110 +15,44 @@ License: MIT
 import json
 import logging
 import re
-from typing import Dict, List, Any
-from .base_agent import BaseAgent
+from typing import AbstractSet, Any, Dict, List, Optional, Union
+from .base_agent import (
+    BaseAgent, MAX_TOKENS_TEXTO_PROMPT, cargar_json,
+    huella, huellas_referencia, normalizar_texto_referencia, truncar_texto_prompt,
+)
+from modules.explicit_extractor import extraer_referencias_explicitas, formatear_explicitas_para_prompt
 
 logger = logging.getLogger(__name__)
 
-
-class ExtractorAgentC(BaseAgent):
-    """
-    Agente extractor "SABUESO" - No contaminado por siglas
-
-    Características:
-    - Temperatura: 0.4 (balanceado)
-    - NO recibe mapeo de siglas (busca sin sesgos)
-    - Enfocado en menciones en lenguaje natural
-    - Captura referencias como:
-      * "el Código establece"
-      * "según la Constitución"
-      * "el Estatuto prevé"
-      * "la normativa vigente"
-      * "el Reglamento dispone"
-    - Mayor cobertura que A y B en referencias no estándar
-    """
-
-    def __init__(self, api_key: str = None):
-        """
-        Inicializa el Agente 1C (Sabueso)
-
-        Args:
-            api_key: API key de Gemini (opcional)
-        """
-        super().__init__(
-            nombre="Agente1C-Sabueso",
-            modelo="gemini-2.0-flash-exp",
-            temperatura=0.4,  # Balanceado: más agresivo que A, más conservador que B
-            api_key=api_key
-        )
-
-    def procesar(self, entrada: Dict[str, Any]) -> Dict[str, Any]:
-        """
-        Procesa un texto y extrae referencias legales sin conocimiento de siglas
-
-        Args:
-            entrada: Dict con:
-                - 'texto': str - Texto del tema a procesar
-                - 'ronda': int - Número de ronda de convergencia (opcional)
-                - 'referencias_previas': List[Dict] - Referencias ya encontradas (opcional)
-
-        Returns:
-            Dict con:
-                - 'referencias': List[Dict] - Referencias encontradas
-                - 'total': int - Total de referencias
-                - 'agente': str - Nombre del agente
-                - 'ronda': int - Número de ronda
-        """
-        texto = entrada.get('texto', '')
-        ronda = entrada.get('ronda', 1)
-        referencias_previas = entrada.get('referencias_previas', [])
-
-        logger.info(f"[{self.nombre}] Procesando texto (ronda {ronda})")
-        logger.info(f"[{self.nombre}] Texto: {len(texto)} caracteres")
-        logger.info(f"[{self.nombre}] Referencias previas: {len(referencias_previas)}")
-
-        # Construir prompt
-        prompt = self._construir_prompt(texto, ronda, referencias_previas)
-
-        # System instruction
-        system_instruction = self._get_system_instruction()
-
-        # Llamar a Gemini
-        try:
-            respuesta_raw = self.generar_contenido(prompt, system_instruction)
-
-            # Parsear respuesta JSON
-            referencias = self._parsear_respuesta(respuesta_raw)
-
-            # Filtrar referencias ya encontradas
-            if referencias_previas:
-                referencias_nuevas = self._filtrar_duplicados(referencias, referencias_previas)
-            else:
-                referencias_nuevas = referencias
-
-            logger.info(f"[{self.nombre}] Encontradas {len(referencias_nuevas)} referencias nuevas")
-
-            return {
-                'referencias': referencias_nuevas,
-                'total': len(referencias_nuevas),
-                'agente': self.nombre,
-                'ronda': ronda,
-                'temperatura': self.temperatura
-            }
-
-        except Exception as e:
-            logger.error(f"[{self.nombre}] Error en procesamiento: {e}")
-            return {
-                'referencias': [],
-                'total': 0,
-                'agente': self.nombre,
-                'ronda': ronda,
-                'error': str(e)
-            }
-
-    def _get_system_instruction(self) -> str:
-        """Devuelve la instrucción de sistema para el agente"""
-        return """Eres un experto en extracción de referencias legales españolas.
+# RE2 (tiempo lineal garantizado, sin backtracking) para el parseo fallback
+# si está instalado; si no, el módulo re estándar
+try:
+    import re2 as _re_fallback
+except ImportError:
+    _re_fallback = re
+
+# Patrones compilados una sola vez al cargar el módulo
+# JSON envuelto en ```json (grupo 1) o cualquier objeto con "referencias"
+# (grupo 2), buscados en una sola pasada
+_JSON_ANY_RE = re.compile(r'```json\s*(\{.*?\})\s*```|(\{.*"referencias".*\})', re.DOTALL)
+
+# Patrones del parseo fallback: (grupo, tipo, patrón)
+_FALLBACK_PATTERNS = (
+    ('ley', 'ley', r'Ley\s+(\d+/\d{4})'),
+    ('rd', 'real_decreto', r'Real\s+Decreto\s+(?:Legislativo\s+)?(\d+/\d{4})'),
+    ('rd_sigla', 'real_decreto', r'RD\s+(\d+/\d{4})'),
+    ('ce', 'constitucion', r'Constitución\s+Española'),
+    ('codigo', 'codigo', r'Código\s+(Civil|Penal)'),
+)
+
+# Todos los patrones en una sola alternancia: una única pasada sobre el texto
+_FALLBACK_RE = _re_fallback.compile(
+    '(?i)' + '|'.join(f'(?P<{grupo}>{patron})' for grupo, _, patron in _FALLBACK_PATTERNS)
+)
+_GROUP_TO_TIPO = {grupo: tipo for grupo, tipo, _ in _FALLBACK_PATTERNS}
+
+# Instrucción de sistema, idéntica en todas las llamadas
+_SYSTEM_INSTRUCTION = """Eres un experto en extracción de referencias legales españolas.
 
 Tu especialidad es encontrar referencias que otros sistemas podrían pasar por alto,
 especialmente aquellas mencionadas en LENGUAJE NATURAL sin formato estándar.
@@ -155,61 +89,9 @@ REGLAS:
 
 IMPORTANTE: Devuelve SOLO JSON válido, sin texto adicional."""
 
-    def _construir_prompt(
-        self,
-        texto: str,
-        ronda: int,
-        referencias_previas: List[Dict]
-    ) -> str:
-        """
-        Construye el prompt para Gemini (SIN inyección de siglas)
-
-        Args:
-            texto: Texto del tema
-            ronda: Número de ronda
-            referencias_previas: Referencias ya encontradas
-
-        Returns:
-            Prompt formateado
-        """
-        # Truncar texto si es muy largo
-        max_chars = 50000  # ~12,500 tokens
-        if len(texto) > max_chars:
-            texto = texto[:max_chars] + "\n\n[... texto truncado ...]"
-            logger.warning(f"[{self.nombre}] Texto truncado a {max_chars} caracteres")
-
-        prompt = f"""Analiza el siguiente texto y extrae TODAS las referencias legales,
-especialmente aquellas mencionadas en lenguaje natural que otros extractores
-podrían haber pasado por alto.
-
-TEXTO A ANALIZAR:
----
-{texto}
----
-
-RONDA DE EXTRACCIÓN: {ronda}
-
-"""
-
-        # Si hay referencias previas, mencionarlas
-        if referencias_previas and ronda > 1:
-            refs_previas_str = "\n".join([
-                f"- {ref.get('texto_completo', ref.get('texto', 'N/A'))}"
-                for ref in referencias_previas[:10]
-            ])
-
-            prompt += f"""REFERENCIAS YA ENCONTRADAS (no las repitas):
-{refs_previas_str}
-{"... y más" if len(referencias_previas) > 10 else ""}
-
-TAREA: Encuentra NUEVAS referencias que NO estén en la lista anterior.
-Especialmente busca menciones en lenguaje natural.
-
-"""
-
-        # NOTA: NO inyectamos siglas aquí - el agente debe trabajar sin sesgos
-
-        prompt += """FORMATO DE RESPUESTA (JSON):
+# Parte final del prompt (formato JSON, tipos e instrucciones),
+# idéntica en todas las llamadas
+_PROMPT_FORMATO = """FORMATO DE RESPUESTA (JSON):
 ```json
 {
   "referencias": [
@@ -283,7 +165,255 @@ en formato estándar.
 
 Responde SOLO con el JSON, sin texto adicional antes o después."""
 
-        return prompt
+
+class ExtractorAgentC(BaseAgent):
+    """
+    Agente extractor "SABUESO" - No contaminado por siglas
+
+    Características:
+    - Temperatura: 0.4 (balanceado)
+    - NO recibe mapeo de siglas (busca sin sesgos)
+    - Enfocado en menciones en lenguaje natural
+    - Captura referencias como:
+      * "el Código establece"
+      * "según la Constitución"
+      * "el Estatuto prevé"
+      * "la normativa vigente"
+      * "el Reglamento dispone"
+    - Mayor cobertura que A y B en referencias no estándar
+    """
+
+    def __init__(self, api_key: str = None, client=None):
+        """
+        Inicializa el Agente 1C (Sabueso)
+
+        Args:
+            api_key: API key de Gemini (opcional)
+            client: Cliente de Gemini compartido con otros agentes (opcional)
+        """
+        super().__init__(
+            nombre="Agente1C-Sabueso",
+            modelo="gemini-2.0-flash-exp",
+            temperatura=0.4,  # Balanceado: más agresivo que A, más conservador que B
+            api_key=api_key,
+            request_timeout=120.0,  # La extracción devuelve JSON largo
+            client=client
+        )
+
+    def procesar(self, entrada: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Procesa un texto y extrae referencias legales sin conocimiento de siglas
+
+        Args:
+            entrada: Dict con:
+                - 'texto': str - Texto del tema a procesar
+                - 'ronda': int - Número de ronda de convergencia (opcional)
+                - 'referencias_previas': List[Dict] - Referencias ya encontradas (opcional)
+
+        Returns:
+            Dict con:
+                - 'referencias': List[Dict] - Referencias encontradas
+                - 'total': int - Total de referencias
+                - 'agente': str - Nombre del agente
+                - 'ronda': int - Número de ronda
+        """
+        prompt = self.preparar_prompt(entrada)
+
+        # Llamar a Gemini
+        try:
+            respuesta_raw = self.generar_contenido(prompt, self._get_system_instruction())
+            return self.procesar_respuesta(respuesta_raw, entrada)
+
+        except Exception as e:
+            return self._resultado_error(entrada, e)
+
+    async def procesar_async(self, entrada: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Variante asíncrona de procesar (cliente aio de google-genai)
+
+        Args:
+            entrada: Igual que en procesar
+
+        Returns:
+            Igual que procesar
+        """
+        prompt = self.preparar_prompt(entrada)
+
+        try:
+            respuesta_raw = await self.generar_contenido_async(prompt, self._get_system_instruction())
+            return self.procesar_respuesta(respuesta_raw, entrada)
+
+        except Exception as e:
+            return self._resultado_error(entrada, e)
+
+    def preparar_prompt(self, entrada: Dict[str, Any]) -> str:
+        """
+        Construye el prompt de extracción para una entrada
+
+        Args:
+            entrada: Igual que en procesar
+
+        Returns:
+            Prompt listo para enviar a Gemini
+        """
+        texto = entrada.get('texto', '')
+        ronda = entrada.get('ronda', 1)
+        referencias_previas = entrada.get('referencias_previas', [])
+
+        logger.info(f"[{self.nombre}] Procesando texto (ronda {ronda})")
+        logger.info(f"[{self.nombre}] Texto: {len(texto)} caracteres")
+        logger.info(f"[{self.nombre}] Referencias previas: {len(referencias_previas)}")
+
+        return self._construir_prompt(texto, ronda, referencias_previas)
+
+    async def preparar_cache_async(self, texto: str) -> bool:
+        """
+        Cachea en Gemini el prefijo del prompt (con el texto) para todas las rondas
+
+        Args:
+            texto: Texto del tema
+
+        Returns:
+            True si la caché está activa
+        """
+        return await self.crear_cache_contexto_async(
+            self._prefijo_prompt(texto), self._get_system_instruction()
+        )
+
+    def procesar_respuesta(self, respuesta_raw: str, entrada: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Parsea la respuesta de Gemini y filtra las referencias ya encontradas
+
+        Args:
+            respuesta_raw: Respuesta de Gemini
+            entrada: Entrada con la que se construyó el prompt
+
+        Returns:
+            Igual que procesar
+        """
+        ronda = entrada.get('ronda', 1)
+        referencias_previas = entrada.get('referencias_previas', [])
+
+        # Parsear respuesta JSON
+        referencias = self._parsear_respuesta(respuesta_raw)
+
+        # Añadir las normas con número detectadas por patrón que el modelo no repitió
+        leyes_modelo = {(ref.get('ley') or '').lower().strip() for ref in referencias}
+        referencias.extend(
+            ref for ref in extraer_referencias_explicitas(entrada.get('texto', ''))
+            if ref['ley'].lower() not in leyes_modelo
+        )
+
+        # Filtrar referencias ya encontradas
+        if referencias_previas:
+            referencias_nuevas = self._filtrar_duplicados(
+                referencias, referencias_previas, entrada.get('referencias_previas_index')
+            )
+        else:
+            referencias_nuevas = referencias
+
+        logger.info(f"[{self.nombre}] Encontradas {len(referencias_nuevas)} referencias nuevas")
+
+        return {
+            'referencias': referencias_nuevas,
+            'total': len(referencias_nuevas),
+            'agente': self.nombre,
+            'ronda': ronda,
+            'temperatura': self.temperatura
+        }
+
+    def _resultado_error(self, entrada: Dict[str, Any], error: Exception) -> Dict[str, Any]:
+        """Resultado vacío cuando falla la llamada o el procesamiento"""
+        logger.error(f"[{self.nombre}] Error en procesamiento: {error}")
+        return {
+            'referencias': [],
+            'total': 0,
+            'agente': self.nombre,
+            'ronda': entrada.get('ronda', 1),
+            'error': str(error)
+        }
+
+    def _get_system_instruction(self) -> str:
+        """Devuelve la instrucción de sistema para el agente"""
+        return _SYSTEM_INSTRUCTION
+
+    def _prefijo_prompt(self, texto: Union[str, bytes]) -> str:
+        """
+        Parte inicial del prompt (instrucción + texto), común a todas las rondas
+
+        Args:
+            texto: Texto del tema (str o bytes UTF-8)
+
+        Returns:
+            Prefijo del prompt
+        """
+        # Truncar texto si es muy largo
+        max_chars = self.limite_chars_texto(texto)
+        texto, truncado = truncar_texto_prompt(texto, max_chars)
+        marca_truncado = "\n\n[... texto truncado ...]" if truncado else ""
+        if truncado:
+            logger.warning(
+                f"[{self.nombre}] Texto truncado a {max_chars} caracteres (~{MAX_TOKENS_TEXTO_PROMPT} tokens)"
+            )
+
+        return f"""Analiza el siguiente texto y extrae TODAS las referencias legales,
+especialmente aquellas mencionadas en lenguaje natural que otros extractores
+podrían haber pasado por alto.
+
+TEXTO A ANALIZAR:
+---
+{texto}{marca_truncado}
+---
+"""
+
+    def _construir_prompt(
+        self,
+        texto: str,
+        ronda: int,
+        referencias_previas: List[Dict]
+    ) -> str:
+        """
+        Construye el prompt para Gemini (SIN inyección de siglas)
+
+        Args:
+            texto: Texto del tema
+            ronda: Número de ronda
+            referencias_previas: Referencias ya encontradas
+
+        Returns:
+            Prompt formateado
+        """
+        # Se acumulan las partes y se unen una sola vez al final. Orden de lo
+        # más estable a lo que más cambia entre rondas (prefijo con el texto,
+        # bloques fijos por texto, previas, formato y por último el número de
+        # ronda), para que las rondas compartan el prefijo más largo posible
+        partes = [self._prefijo_prompt(texto), "\n"]
+
+        # Normas con número ya detectadas por patrón (se añaden al resultado)
+        partes.append(formatear_explicitas_para_prompt(extraer_referencias_explicitas(texto)))
+
+        # NOTA: NO inyectamos siglas aquí - el agente debe trabajar sin sesgos
+
+        # Si hay referencias previas, mencionarlas
+        if referencias_previas and ronda > 1:
+            refs_previas_str = "\n".join([
+                f"- {ref.get('texto_completo', ref.get('texto', 'N/A'))}"
+                for ref in referencias_previas[:10]
+            ])
+
+            partes.append(f"""REFERENCIAS YA ENCONTRADAS (no las repitas):
+{refs_previas_str}
+{"... y más" if len(referencias_previas) > 10 else ""}
+
+TAREA: Encuentra NUEVAS referencias que NO estén en la lista anterior.
+Especialmente busca menciones en lenguaje natural.
+
+""")
+
+        partes.append(_PROMPT_FORMATO)
+        partes.append(f"\n\nRONDA DE EXTRACCIÓN: {ronda}\n")
+
+        return "".join(partes)
 
     def _parsear_respuesta(self, respuesta_raw: str) -> List[Dict]:
         """
@@ -296,20 +426,12 @@ Responde SOLO con el JSON, sin texto adicional antes o después."""
             Lista de referencias extraídas
         """
         try:
-            # Extraer JSON del markdown si está envuelto en ```json
-            json_match = re.search(r'```json\s*(\{.*?\})\s*```', respuesta_raw, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-            else:
-                # Intentar buscar cualquier JSON en la respuesta
-                json_match = re.search(r'\{.*"referencias".*\}', respuesta_raw, re.DOTALL)
-                if json_match:
-                    json_str = json_match.group(0)
-                else:
-                    json_str = respuesta_raw
+            # Extraer JSON del markdown (```json) o cualquier JSON de la respuesta
+            json_match = _JSON_ANY_RE.search(respuesta_raw)
+            json_str = (json_match.group(1) or json_match.group(2)) if json_match else respuesta_raw
 
             # Parsear JSON
-            data = json.loads(json_str)
+            data = cargar_json(json_str)
             referencias = data.get('referencias', [])
 
             logger.debug(f"[{self.nombre}] Parseadas {len(referencias)} referencias")
@@ -337,25 +459,15 @@ Responde SOLO con el JSON, sin texto adicional antes o después."""
 
         referencias = []
 
-        # Buscar patrones comunes
-        patrones = [
-            (r'Ley\s+(\d+/\d{4})', 'ley'),
-            (r'Real\s+Decreto\s+(?:Legislativo\s+)?(\d+/\d{4})', 'real_decreto'),
-            (r'RD\s+(\d+/\d{4})', 'real_decreto'),
-            (r'Constitución\s+Española', 'constitucion'),
-            (r'Código\s+(Civil|Penal)', 'codigo'),
-        ]
-
-        for patron, tipo in patrones:
-            matches = re.finditer(patron, respuesta_raw, re.IGNORECASE)
-            for match in matches:
-                referencias.append({
-                    'texto_completo': match.group(0),
-                    'tipo': tipo,
-                    'ley': match.group(0),
-                    'confianza': 75,
-                    'contexto': '(extraído por fallback)'
-                })
+        # Buscar patrones comunes (todos en una sola pasada)
+        for match in _FALLBACK_RE.finditer(respuesta_raw):
+            referencias.append({
+                'texto_completo': match.group(0),
+                'tipo': _GROUP_TO_TIPO[match.lastgroup],
+                'ley': match.group(0),
+                'confianza': 75,
+                'contexto': '(extraído por fallback)'
+            })
 
         logger.info(f"[{self.nombre}] Fallback encontró {len(referencias)} referencias")
 
@@ -364,7 +476,8 @@ Responde SOLO con el JSON, sin texto adicional antes o después."""
     def _filtrar_duplicados(
         self,
         referencias_nuevas: List[Dict],
-        referencias_previas: List[Dict]
+        referencias_previas: List[Dict],
+        indice_previas: Optional[AbstractSet[int]] = None
     ) -> List[Dict]:
         """
         Filtra referencias que ya existen en la lista previa
@@ -372,31 +485,27 @@ Responde SOLO con el JSON, sin texto adicional antes o después."""
         Args:
             referencias_nuevas: Referencias encontradas en esta ronda
             referencias_previas: Referencias de rondas anteriores
+            indice_previas: Huellas de los textos de referencias_previas ya
+                calculadas por el orquestador (si no, se construyen aquí)
 
         Returns:
             Solo referencias nuevas (no duplicadas)
         """
         filtradas = []
 
-        # Crear conjunto de textos previos (normalizados)
-        textos_previos = set()
-        for ref in referencias_previas:
-            texto = ref.get('texto_completo', ref.get('texto', ''))
-            if texto:
-                # Normalizar: lowercase y sin espacios múltiples
-                texto_norm = ' '.join(texto.lower().split())
-                textos_previos.add(texto_norm)
+        # Huellas de los textos previos normalizados (lowercase y sin espacios múltiples)
+        if indice_previas is None:
+            indice_previas = {h for ref in referencias_previas if (h := huella(normalizar_texto_referencia(ref)))}
 
-        # Filtrar duplicados
+        # Filtrar duplicados (el índice compartido no se modifica)
+        vistos = set()
         for ref in referencias_nuevas:
-            texto = ref.get('texto_completo', ref.get('texto', ''))
-            if texto:
-                texto_norm = ' '.join(texto.lower().split())
-
-                if texto_norm not in textos_previos:
+            h = huellas_referencia(ref)[0]
+            if h:
+                if h not in indice_previas and h not in vistos:
                     filtradas.append(ref)
-                    textos_previos.add(texto_norm)  # Agregar para evitar duplicados internos
+                    vistos.add(h)  # Agregar para evitar duplicados internos
                 else:
-                    logger.debug(f"[{self.nombre}] Duplicado filtrado: {texto[:50]}")
+                    logger.debug(f"[{self.nombre}] Duplicado filtrado: {normalizar_texto_referencia(ref)[:50]}")
 
         return filtradas
@@ -14,8 +14,14 @@ Version: 0.2.0
 License: MIT
 """
 
+import json
 import logging
-from typing import List, Dict, Optional, Set
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Dict, FrozenSet, Optional, Set
 from google import genai
 from google.genai import types
 
@@ -30,6 +36,161 @@ except ImportError:
     settings = None
     get_boe_index_fetcher = None
 
+# Caracteres del documento que ven la detección de conceptos y el mapeo
+MAX_CHARS_TEXTO_CONCEPTOS = 4000
+MAX_CHARS_CONTEXTO_MAPEO = 2000
+
+# Conceptos como máximo por documento; la detección se corta al tenerlos
+MAX_CONCEPTOS = 10
+
+# Tope de tokens de la detección (en gemini-2.5 incluye el razonamiento,
+# que se limita al mínimo: la respuesta es una lista corta)
+MAX_TOKENS_CONCEPTOS = 1024
+PRESUPUESTO_RAZONAMIENTO_CONCEPTOS = 128
+
+# Confianza mínima para aceptar un mapeo concepto → ley
+CONFIANZA_MINIMA_MAPEO = 70
+
+# Esquema de la respuesta de mapeo: Gemini devuelve directamente el array JSON
+_ESQUEMA_MAPEOS = {
+    'type': 'ARRAY',
+    'items': {
+        'type': 'OBJECT',
+        'properties': {
+            'indice': {'type': 'INTEGER'},
+            'ley': {'type': 'STRING'},
+            'boe_id': {'type': 'STRING'},
+            'articulos_inicio': {'type': 'STRING'},
+            'articulos_fin': {'type': 'STRING'},
+            'confianza': {'type': 'INTEGER'}
+        },
+        'required': ['indice', 'confianza']
+    }
+}
+
+# Descargas simultáneas de índices del BOE
+MAX_DESCARGAS_INDICE = 8
+
+# Mapeos concepto → ley recordados entre documentos (y entre ejecuciones, en disco)
+MAX_MAPEOS_MEMORIZADOS = 2048
+
+# Parte fija de los prompts: va como system instruction para que el prompt
+# de cada llamada lleve solo el texto, los conceptos y el contexto
+_INSTRUCCIONES_CONCEPTOS = """Analizas textos de temarios de oposiciones.
+
+TAREA: Identifica CONCEPTOS LEGALES mencionados que NO tengan una referencia legal explícita.
+
+Ejemplos de conceptos legales:
+- homicidio, asesinato
+- aborto
+- lesiones, lesiones al feto
+- delitos contra la libertad
+- delitos contra la libertad sexual
+- delitos contra el honor
+- delitos de violencia de género
+- procedimiento administrativo
+- recurso contencioso-administrativo
+
+IMPORTANTE:
+- Solo detecta conceptos que claramente se refieran a materias reguladas por leyes españolas
+- NO incluyas conceptos que ya tengan una referencia legal explícita (ej: "art. 138 CP")
+- Usa terminología jurídica precisa
+
+Responde SOLO con una lista de conceptos, uno por línea, sin numeración ni explicaciones.
+Si no hay conceptos relevantes, responde: NINGUNO"""
+
+_INSTRUCCIONES_MAPEO = """Eres un experto en legislación española.
+
+TAREA: Para cada concepto detectado, identifica la ley española que lo regula y sugiere los artículos relevantes.
+
+LEYES PRINCIPALES (con BOE-ID):
+- Código Penal: BOE-A-1995-25444
+- Constitución Española: BOE-A-1978-31229
+- Ley 39/2015 (Procedimiento Administrativo): BOE-A-2015-10565
+- Ley 40/2015 (Régimen Jurídico Sector Público): BOE-A-2015-10566
+- LOPJ (Ley Orgánica del Poder Judicial): BOE-A-1985-12666
+- LECrim (Ley de Enjuiciamiento Criminal): BOE-A-1882-6036
+- LEC (Ley de Enjuiciamiento Civil): BOE-A-2000-323
+- Estatuto de los Trabajadores: BOE-A-2015-11430
+
+Responde EN FORMATO JSON, con un objeto por concepto:
+[
+    {
+        "indice": número del concepto en la lista,
+        "ley": "Nombre completo de la ley",
+        "boe_id": "BOE-A-XXXX-XXXXX",
+        "articulos_inicio": "número del primer artículo relevante",
+        "articulos_fin": "número del último artículo relevante",
+        "confianza": 0-100
+    }
+]
+
+IMPORTANTE:
+- Solo sugiere leyes si estás MUY SEGURO (confianza >= 70)
+- Los artículos deben ser rangos reales de la legislación española
+- Ejemplo: homicidio en CP = arts. 138-143
+- Ejemplo: jurisdicción voluntaria = arts. 1-20
+- Si no estás seguro de un concepto, responde para él: {"indice": N, "confianza": 0}"""
+
+
+def _array_json(texto: str) -> Optional[str]:
+    """
+    Devuelve el primer array JSON de nivel superior del texto
+
+    Una sola pasada contando corchetes (ignorando los que van dentro de
+    strings), sin backtracking; sirve si la respuesta llega envuelta en
+    ```json o con texto alrededor.
+
+    Returns:
+        Substring con el array completo o None si no hay ninguno cerrado
+    """
+    inicio = texto.find('[')
+    if inicio == -1:
+        return None
+
+    profundidad = 0
+    en_string = False
+    escapado = False
+
+    for i in range(inicio, len(texto)):
+        c = texto[i]
+        if en_string:
+            if escapado:
+                escapado = False
+            elif c == '\\':
+                escapado = True
+            elif c == '"':
+                en_string = False
+        elif c == '"':
+            en_string = True
+        elif c == '[':
+            profundidad += 1
+        elif c == ']':
+            profundidad -= 1
+            if profundidad == 0:
+                return texto[inicio:i + 1]
+
+    return None
+
+
+def _parsear_conceptos(respuesta: str) -> List[str]:
+    """Conceptos de la respuesta de detección (uno por línea, sin viñetas ni títulos)"""
+    return [
+        linea.strip().strip('-•*').strip()
+        for linea in respuesta.split('\n')
+        if linea.strip() and not linea.strip().startswith('#')
+    ]
+
+
+def _clave_concepto(concepto: str) -> str:
+    """Clave de un concepto para recordar su mapeo ("Homicidio " y "homicidio" son el mismo)"""
+    return concepto.lower().strip()
+
+
+def _cache_en_disco() -> bool:
+    """Los mapeos se guardan en disco solo con LLM_CACHE_ENABLED=true (igual que la caché LLM)"""
+    return os.getenv('LLM_CACHE_ENABLED', 'false').lower() in ('true', '1', 'yes')
+
 
 class InferenceAgent:
     """
@@ -49,7 +210,6 @@ class InferenceAgent:
         if settings:
             self.model_name = settings.GEMINI_MODEL
         else:
-            import os
             self.model_name = os.getenv('GEMINI_MODEL', 'gemini-2.5-pro')
 
         # Validar que sea gemini-2.5-pro
@@ -58,7 +218,6 @@ class InferenceAgent:
             self.model_name = 'gemini-2.5-pro'
 
         # Crear cliente de Gemini
-        import os
         api_key = os.getenv('GEMINI_API_KEY')
         if not api_key and settings:
             api_key = settings.GEMINI_API_KEY
@@ -68,6 +227,10 @@ class InferenceAgent:
 
         self.client = genai.Client(api_key=api_key)
 
+        # Mapeos ya resueltos: concepto normalizado -> mapeo (sin el concepto)
+        self._ruta_mapeos = Path(__file__).parent.parent.parent / "data" / "cache" / "conceptos_leyes.json"
+        self._mapeos_memorizados: OrderedDict = self._cargar_mapeos_memorizados()
+
         # Obtener BOEIndexFetcher
         if get_boe_index_fetcher:
             self.boe_fetcher = get_boe_index_fetcher()
@@ -108,8 +271,13 @@ class InferenceAgent:
         """
         logger.info("🔍 Iniciando detección de conceptos legales...")
 
+        # El documento se recorta una sola vez; el contexto del mapeo es el
+        # principio del mismo fragmento
+        texto_conceptos = texto[:MAX_CHARS_TEXTO_CONCEPTOS]
+        contexto_mapeo = texto_conceptos[:MAX_CHARS_CONTEXTO_MAPEO]
+
         # Paso 1: Detectar conceptos legales
-        conceptos = self._detectar_conceptos(texto)
+        conceptos = self._detectar_conceptos(texto_conceptos)
 
         if not conceptos:
             logger.info("   No se detectaron conceptos legales para inferir")
@@ -117,23 +285,26 @@ class InferenceAgent:
 
         logger.info(f"   Detectados {len(conceptos)} conceptos: {', '.join(conceptos)}")
 
-        # Paso 2: Mapear conceptos a leyes + artículos
-        referencias_inferidas = []
+        # Paso 2: Mapear todos los conceptos a leyes + artículos en una sola llamada
+        mapeos = self._mapear_conceptos_a_leyes(conceptos, contexto_mapeo)
 
-        for concepto in conceptos:
-            logger.info(f"   Mapeando: {concepto}")
+        # Cada índice del BOE se descarga una sola vez (en paralelo), aunque
+        # varios conceptos apunten a la misma ley
+        articulos_leyes = self._obtener_articulos_leyes({mapeo['boe_id'] for mapeo in mapeos})
 
-            mapeo = self._mapear_concepto_a_ley(concepto, texto)
+        referencias_inferidas = []
 
-            if mapeo:
-                # Validar que los artículos existan
-                validado = self._validar_articulos(mapeo)
+        for mapeo in mapeos:
+            concepto = mapeo['concepto_detectado']
 
-                if validado:
-                    referencias_inferidas.append(validado)
-                    logger.info(f"   ✅ {concepto} → {mapeo['ley']} (arts. {', '.join(mapeo['articulos'])})")
-                else:
-                    logger.warning(f"   ⚠️  {concepto} → Artículos no validados")
+            # Validar que los artículos existan
+            validado = self._validar_articulos(mapeo, articulos_leyes.get(mapeo['boe_id']))
+
+            if validado:
+                referencias_inferidas.append(validado)
+                logger.info(f"   ✅ {concepto} → {mapeo['ley']} (arts. {', '.join(mapeo['articulos'])})")
+            else:
+                logger.warning(f"   ⚠️  {concepto} → Artículos no validados")
 
         # Paso 3: Eliminar duplicados con referencias existentes
         referencias_unicas = self._deduplicar(referencias_inferidas, referencias_existentes)
@@ -142,10 +313,14 @@ class InferenceAgent:
 
         return referencias_unicas
 
-    def _detectar_conceptos(self, texto: str) -> List[str]:
+    def _detectar_conceptos(self, texto_conceptos: str) -> List[str]:
         """
         Detecta conceptos legales mencionados en el texto
 
+        Args:
+            texto_conceptos: Fragmento del documento ya recortado
+                             (MAX_CHARS_TEXTO_CONCEPTOS)
+
         Ejemplos de conceptos:
         - homicidio, asesinato
         - aborto
@@ -154,161 +329,264 @@ class InferenceAgent:
         - delitos sexuales
         - etc.
         """
-        prompt = f"""Analiza el siguiente texto de un temario de oposiciones.
-
-TAREA: Identifica CONCEPTOS LEGALES mencionados que NO tengan una referencia legal explícita.
-
-Ejemplos de conceptos legales:
-- homicidio, asesinato
-- aborto
-- lesiones, lesiones al feto
-- delitos contra la libertad
-- delitos contra la libertad sexual
-- delitos contra el honor
-- delitos de violencia de género
-- procedimiento administrativo
-- recurso contencioso-administrativo
-
-IMPORTANTE:
-- Solo detecta conceptos que claramente se refieran a materias reguladas por leyes españolas
-- NO incluyas conceptos que ya tengan una referencia legal explícita (ej: "art. 138 CP")
-- Usa terminología jurídica precisa
-
-TEXTO:
-{texto[:4000]}
-
-Responde SOLO con una lista de conceptos, uno por línea, sin numeración ni explicaciones.
-Si no hay conceptos relevantes, responde: NINGUNO"""
+        prompt = f"""TEXTO:
+{texto_conceptos}"""
 
         try:
-            response = self.client.models.generate_content(
+            # En streaming: en cuanto llegan MAX_CONCEPTOS líneas completas
+            # se deja de leer (y de esperar al resto de la generación)
+            partes = []
+
+            stream = self.client.models.generate_content_stream(
                 model=self.model_name,
                 contents=prompt,
                 config={
+                    'system_instruction': _INSTRUCCIONES_CONCEPTOS,
                     'temperature': 0.3,  # Más conservador
-                    'max_output_tokens': 65000
+                    'max_output_tokens': MAX_TOKENS_CONCEPTOS,
+                    'thinking_config': {'thinking_budget': PRESUPUESTO_RAZONAMIENTO_CONCEPTOS}
                 }
             )
+            for chunk in stream:
+                if chunk.text:
+                    partes.append(chunk.text)
+                    lineas_completas = "".join(partes).rpartition('\n')[0]
+                    if len(_parsear_conceptos(lineas_completas)) >= MAX_CONCEPTOS:
+                        break
 
-            respuesta = response.text.strip()
+            respuesta = "".join(partes).strip()
 
             if respuesta == "NINGUNO" or not respuesta:
                 return []
 
-            # Parsear conceptos (uno por línea)
-            conceptos = [
-                linea.strip().strip('-•*').strip()
-                for linea in respuesta.split('\n')
-                if linea.strip() and not linea.strip().startswith('#')
-            ]
-
-            return conceptos[:10]  # Limitar a 10 conceptos máximo
+            return _parsear_conceptos(respuesta)[:MAX_CONCEPTOS]
 
         except Exception as e:
             logger.error(f"❌ Error detectando conceptos: {e}")
             return []
 
-    def _mapear_concepto_a_ley(self, concepto: str, texto: str) -> Optional[Dict]:
+    def _mapear_conceptos_a_leyes(self, conceptos: List[str], contexto: str) -> List[Dict]:
         """
-        Mapea un concepto legal a una ley específica con artículos sugeridos
+        Mapea todos los conceptos legales a leyes con artículos sugeridos
+
+        El mapeo de un concepto no depende del documento: los ya resueltos
+        (en este o en otros documentos) se reutilizan y solo los nuevos van
+        a Gemini, todos en una única llamada.
 
         Returns:
-            {
-                'ley': 'Ley Orgánica 10/1995, del Código Penal',
-                'boe_id': 'BOE-A-1995-25444',
-                'articulos': ['138', '139', '140'],
-                'concepto_detectado': 'homicidio',
-                'confianza': 85
-            }
+            Lista de mapeos con confianza suficiente, en el orden de los conceptos:
+            [
+                {
+                    'ley': 'Ley Orgánica 10/1995, del Código Penal',
+                    'boe_id': 'BOE-A-1995-25444',
+                    'articulos': ['138', '139', '140'],
+                    'concepto_detectado': 'homicidio',
+                    'confianza': 85
+                },
+                ...
+            ]
         """
-        prompt = f"""Eres un experto en legislación española.
+        claves = [_clave_concepto(concepto) for concepto in conceptos]
+        pendientes = [
+            concepto for concepto, clave in zip(conceptos, claves)
+            if clave not in self._mapeos_memorizados
+        ]
 
-CONCEPTO DETECTADO: {concepto}
+        if pendientes:
+            nuevos = self._mapear_con_gemini(pendientes, contexto)
+            for mapeo in nuevos.values():
+                self._memorizar_mapeo(mapeo)
+            if nuevos:
+                self._guardar_mapeos_memorizados()
 
-CONTEXTO DEL TEXTO:
-{texto[:2000]}
+        mapeos = []
 
-TAREA: Identifica la ley española que regula este concepto y sugiere los artículos relevantes.
+        for concepto, clave in zip(conceptos, claves):
+            memorizado = self._mapeos_memorizados.get(clave)
+            if memorizado is not None:
+                self._mapeos_memorizados.move_to_end(clave)
+                mapeos.append({
+                    **memorizado,
+                    'articulos': list(memorizado['articulos']),
+                    'concepto_detectado': concepto
+                })
 
-LEYES PRINCIPALES (con BOE-ID):
-- Código Penal: BOE-A-1995-25444
-- Constitución Española: BOE-A-1978-31229
-- Ley 39/2015 (Procedimiento Administrativo): BOE-A-2015-10565
-- Ley 40/2015 (Régimen Jurídico Sector Público): BOE-A-2015-10566
-- LOPJ (Ley Orgánica del Poder Judicial): BOE-A-1985-12666
-- LECrim (Ley de Enjuiciamiento Criminal): BOE-A-1882-6036
-- LEC (Ley de Enjuiciamiento Civil): BOE-A-2000-323
-- Estatuto de los Trabajadores: BOE-A-2015-11430
+        return mapeos
 
-Responde EN FORMATO JSON:
-{{
-    "ley": "Nombre completo de la ley",
-    "boe_id": "BOE-A-XXXX-XXXXX",
-    "articulos_inicio": "número del primer artículo relevante",
-    "articulos_fin": "número del último artículo relevante",
-    "confianza": 0-100
-}}
+    def _mapear_con_gemini(self, conceptos: List[str], contexto: str) -> Dict[int, Dict]:
+        """
+        Mapea conceptos a leyes con una única llamada a Gemini
 
-IMPORTANTE:
-- Solo sugiere leyes si estás MUY SEGURO (confianza >= 70)
-- Los artículos deben ser rangos reales de la legislación española
-- Ejemplo: homicidio en CP = arts. 138-143
-- Ejemplo: jurisdicción voluntaria = arts. 1-20
-- Si no estás seguro, responde: {{"confianza": 0}}"""
+        La respuesta es un array JSON con un objeto por concepto,
+        identificado por su índice.
+
+        Returns:
+            Dict índice del concepto -> mapeo (solo los de confianza suficiente)
+        """
+        lista_conceptos = "\n".join(f"{i}. {concepto}" for i, concepto in enumerate(conceptos))
+
+        prompt = f"""CONCEPTOS DETECTADOS:
+{lista_conceptos}
+
+CONTEXTO DEL TEXTO:
+{contexto}"""
 
         try:
             response = self.client.models.generate_content(
                 model=self.model_name,
                 contents=prompt,
                 config={
+                    'system_instruction': _INSTRUCCIONES_MAPEO,
                     'temperature': 0.2,
-                    'max_output_tokens': 65000
+                    'max_output_tokens': 65000,
+                    'response_mime_type': 'application/json',
+                    'response_schema': _ESQUEMA_MAPEOS
                 }
             )
 
             respuesta = response.text.strip()
 
-            # Extraer JSON (puede venir con ```json o sin él)
-            import json
-            import re
+            try:
+                datos_mapeos = json.loads(respuesta)
+            except ValueError:
+                # Respuesta con texto alrededor (```json...): buscar el array
+                array = _array_json(respuesta)
+                if array is None:
+                    return {}
+                datos_mapeos = json.loads(array)
 
-            # Buscar JSON en la respuesta
-            json_match = re.search(r'\{[^}]+\}', respuesta, re.DOTALL)
-            if not json_match:
-                return None
+            if not isinstance(datos_mapeos, list):
+                return {}
 
-            datos = json.loads(json_match.group())
+        except Exception as e:
+            logger.error(f"❌ Error mapeando conceptos: {e}")
+            return {}
 
-            # Validar confianza
-            if datos.get('confianza', 0) < 70:
-                logger.info(f"   Confianza baja ({datos.get('confianza')}%) para {concepto}")
-                return None
+        # Un mapeo por concepto (si el modelo repite un índice, gana el primero)
+        mapeos = {}
 
-            # Generar lista de artículos
+        for datos in datos_mapeos:
             try:
-                inicio = int(datos['articulos_inicio'])
-                fin = int(datos['articulos_fin'])
-                articulos = [str(i) for i in range(inicio, fin + 1)]
-            except (KeyError, ValueError):
-                logger.warning(f"   Formato de artículos inválido para {concepto}")
-                return None
+                indice = int(datos['indice'])
+            except (KeyError, TypeError, ValueError):
+                continue
 
-            return {
-                'ley': datos['ley'],
-                'boe_id': datos['boe_id'],
-                'articulos': articulos,
-                'concepto_detectado': concepto,
-                'confianza': datos['confianza']
-            }
+            if 0 <= indice < len(conceptos) and indice not in mapeos:
+                mapeo = self._mapeo_desde_datos(datos, conceptos[indice])
+                if mapeo:
+                    mapeos[indice] = mapeo
 
-        except Exception as e:
-            logger.error(f"❌ Error mapeando {concepto}: {e}")
+        return mapeos
+
+    def _mapeo_desde_datos(self, datos: Dict, concepto: str) -> Optional[Dict]:
+        """
+        Convierte el objeto JSON de un concepto en un mapeo
+
+        Descarta los de confianza baja y expande el rango de artículos.
+        """
+        # Validar confianza
+        try:
+            confianza = int(datos.get('confianza', 0))
+        except (TypeError, ValueError):
+            confianza = 0
+
+        if confianza < CONFIANZA_MINIMA_MAPEO:
+            logger.info(f"   Confianza baja ({datos.get('confianza')}%) para {concepto}")
             return None
 
-    def _validar_articulos(self, mapeo: Dict) -> Optional[Dict]:
+        # Generar lista de artículos
+        try:
+            inicio = int(datos['articulos_inicio'])
+            fin = int(datos['articulos_fin'])
+            articulos = [str(i) for i in range(inicio, fin + 1)]
+            ley = datos['ley']
+            boe_id = datos['boe_id']
+        except (KeyError, TypeError, ValueError):
+            logger.warning(f"   Formato de artículos inválido para {concepto}")
+            return None
+
+        return {
+            'ley': ley,
+            'boe_id': boe_id,
+            'articulos': articulos,
+            'concepto_detectado': concepto,
+            'confianza': confianza
+        }
+
+    def _memorizar_mapeo(self, mapeo: Dict):
+        """Recuerda el mapeo de un concepto (solo se llama con confianza suficiente)"""
+        clave = _clave_concepto(mapeo['concepto_detectado'])
+        self._mapeos_memorizados[clave] = {
+            campo: valor for campo, valor in mapeo.items() if campo != 'concepto_detectado'
+        }
+        self._mapeos_memorizados.move_to_end(clave)
+        if len(self._mapeos_memorizados) > MAX_MAPEOS_MEMORIZADOS:
+            self._mapeos_memorizados.popitem(last=False)
+
+    def _cargar_mapeos_memorizados(self) -> OrderedDict:
+        """
+        Carga los mapeos guardados en disco por ejecuciones anteriores
+
+        Las entradas con confianza por debajo del mínimo se descartan para
+        que se vuelvan a consultar. Sin caché en disco (LLM_CACHE_ENABLED no
+        activada) se empieza vacío.
+        """
+        if not _cache_en_disco() or not self._ruta_mapeos.exists():
+            return OrderedDict()
+
+        try:
+            with open(self._ruta_mapeos, 'r', encoding='utf-8') as f:
+                guardados = json.load(f)
+
+            return OrderedDict(
+                (clave, mapeo) for clave, mapeo in guardados.items()
+                if mapeo.get('confianza', 0) >= CONFIANZA_MINIMA_MAPEO
+            )
+
+        except Exception as e:
+            logger.warning(f"⚠️  Error leyendo mapeos de conceptos: {e}")
+            return OrderedDict()
+
+    def _guardar_mapeos_memorizados(self):
+        """Guarda en disco los mapeos recordados (escritura atómica)"""
+        if not _cache_en_disco():
+            return
+
+        tmp_file = self._ruta_mapeos.with_name(f"{self._ruta_mapeos.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+        try:
+            self._ruta_mapeos.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(self._mapeos_memorizados, f, ensure_ascii=False)
+            os.replace(tmp_file, self._ruta_mapeos)
+
+        except Exception as e:
+            logger.warning(f"⚠️  Error guardando mapeos de conceptos: {e}")
+
+    def _obtener_articulos_leyes(self, boe_ids: Set[str]) -> Dict[str, Optional[FrozenSet[str]]]:
+        """
+        Obtiene en paralelo los números de artículo de cada ley (una vez por BOE-ID)
+
+        Returns:
+            Dict BOE-ID -> frozenset de artículos (None si no se pudo obtener
+            el índice); vacío si no hay BOEIndexFetcher
+        """
+        if self.boe_fetcher is None or not boe_ids:
+            return {}
+
+        boe_ids = sorted(boe_ids)
+
+        with ThreadPoolExecutor(max_workers=min(MAX_DESCARGAS_INDICE, len(boe_ids))) as executor:
+            return dict(zip(boe_ids, executor.map(self.boe_fetcher.obtener_articulos_set, boe_ids)))
+
+    def _validar_articulos(self, mapeo: Dict, articulos_ley: Optional[FrozenSet[str]]) -> Optional[Dict]:
         """
         Valida que los artículos sugeridos existan en la ley real
         usando BOEIndexFetcher
+
+        Args:
+            mapeo: Resultado de _mapear_conceptos_a_leyes()
+            articulos_ley: Artículos de la ley (de _obtener_articulos_leyes())
         """
         # Si no hay fetcher disponible, aceptar los artículos tal cual
         if self.boe_fetcher is None:
@@ -325,21 +603,15 @@ IMPORTANTE:
         boe_id = mapeo['boe_id']
         articulos_sugeridos = mapeo['articulos']
 
-        # Obtener índice real del BOE
-        indice = self.boe_fetcher.obtener_indice(boe_id)
-
-        if not indice:
+        if articulos_ley is None:
             logger.warning(f"   No se pudo obtener índice de {boe_id}")
             return None
 
-        # Obtener números de artículos reales
-        articulos_reales = {art['numero'] for art in indice['articulos']}
-
-        # Filtrar solo artículos que existan
-        articulos_validos = [
-            art for art in articulos_sugeridos
-            if art in articulos_reales
-        ]
+        # Caso habitual: todo el rango sugerido existe
+        if articulos_ley.issuperset(articulos_sugeridos):
+            articulos_validos = list(articulos_sugeridos)
+        else:
+            articulos_validos = [art for art in articulos_sugeridos if art in articulos_ley]
 
         if not articulos_validos:
             logger.warning(f"   Ningún artículo sugerido existe en {boe_id}")
@@ -373,31 +645,30 @@ IMPORTANTE:
         - Mismo BOE-ID
         - Artículos que se solapen significativamente (>50%)
         """
-        # Crear set de (boe_id, articulo) existentes
-        existentes_set: Set[tuple] = set()
+        # Artículos existentes agrupados por BOE-ID (como str, una sola vez)
+        existentes_por_ley: Dict[str, Set[str]] = {}
 
         for ref in existentes:
-            boe_id = ref.get('boe_id', '')
-            articulos = ref.get('articulos', [])
-
-            for art in articulos:
-                existentes_set.add((boe_id, str(art)))
+            articulos = ref.get('articulos')
+            if articulos:
+                existentes_por_ley.setdefault(ref.get('boe_id', ''), set()).update(map(str, articulos))
 
-        # Filtrar inferidas
+        # Filtrar inferidas (sus artículos ya son str, de _mapeo_desde_datos)
         unicas = []
 
         for ref in inferidas:
-            boe_id = ref['boe_id']
             articulos = ref['articulos']
+            ya_existentes = existentes_por_ley.get(ref['boe_id'])
 
-            # Contar cuántos artículos ya existen
-            articulos_nuevos = [
-                art for art in articulos
-                if (boe_id, str(art)) not in existentes_set
-            ]
+            # Ley sin artículos existentes: todos son nuevos
+            if not ya_existentes:
+                unicas.append(ref)
+                continue
+
+            articulos_nuevos = [art for art in articulos if art not in ya_existentes]
 
             # Si al menos 50% son nuevos, incluir la referencia
-            if len(articulos_nuevos) >= len(articulos) * 0.5:
+            if 2 * len(articulos_nuevos) >= len(articulos):
                 # Actualizar con solo los artículos nuevos
                 ref['articulos'] = articulos_nuevos
                 unicas.append(ref)
@@ -26,6 +26,14 @@ from .routes import router
 from .models import ErrorResponse
 from .security import SecurityHeadersMiddleware, RateLimitMiddleware
 
+# Serialización de respuestas con orjson si está instalado (las respuestas
+# de procesamiento incluyen listas de cientos de referencias)
+try:
+    import orjson  # noqa: F401
+    from fastapi.responses import ORJSONResponse as RespuestaPorDefecto
+except ImportError:
+    RespuestaPorDefecto = JSONResponse
+
 # Configurar logging
 from pathlib import Path
 from logging.handlers import RotatingFileHandler
@@ -119,6 +127,7 @@ app = FastAPI(
     version=settings.API_VERSION,
     description=settings.API_DESCRIPTION,
     lifespan=lifespan,
+    default_response_class=RespuestaPorDefecto,
     docs_url="/docs",
     redoc_url="/redoc",
     openapi_url="/openapi.json"
@@ -217,15 +217,18 @@ class TemaProcessor:
         # Ejecutar pipeline
         # NOTA: Aquí usamos asyncio.run_coroutine_threadsafe para actualizar progreso
         # desde el hilo del executor
-        informe = pipeline.procesar_tema(
-            json_path,
-            limite_texto=request.limite_texto,
-            exportar=request.exportar,
-            formatos_export=formatos,
-            use_context_agent=request.use_context_agent,
-            use_inference_agent=request.use_inference_agent,
-            umbral_confianza=request.umbral_confianza
-        )
+        try:
+            informe = pipeline.procesar_tema(
+                json_path,
+                limite_texto=request.limite_texto,
+                exportar=request.exportar,
+                formatos_export=formatos,
+                use_context_agent=request.use_context_agent,
+                use_inference_agent=request.use_inference_agent,
+                umbral_confianza=request.umbral_confianza
+            )
+        finally:
+            pipeline.close()
 
         # Procesar resultado para response
         resultado = self._format_resultado(informe)
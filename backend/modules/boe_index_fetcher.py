@@ -17,12 +17,21 @@ License: MIT
 import requests
 import xml.etree.ElementTree as ET
 import logging
-from typing import Optional, Dict, List
+from typing import Optional, Dict, FrozenSet, List
 from functools import lru_cache
 import re
 
 logger = logging.getLogger(__name__)
 
+# Patrones precompilados: se aplican a cada bloque del índice de la ley
+_ARTICULO_ID_RE = re.compile(r'^a\d+')
+_TITULO_ID_RE = re.compile(r'^t[ivxlcdm]+$')
+_LIBRO_ID_RE = re.compile(r'^l[ivxlcdm]+$')
+_CAPITULO_ID_RE = re.compile(r'^c[ivxlcdm]+$')
+_SECCION_ID_RE = re.compile(r'^s[ivxlcdm]+$')
+_NUMERO_ARTICULO_NOMBRE_RE = re.compile(r'[Aa]rt[íi]culo\s+(\d+(?:\.\d+)?)')
+_NUMERO_ARTICULO_ID_RE = re.compile(r'a(\d+)')
+
 
 class BOEIndexFetcher:
     """
@@ -43,7 +52,12 @@ class BOEIndexFetcher:
             'Accept': 'application/xml'
         })
 
-    @lru_cache(maxsize=50)
+        # Caché en memoria de índices por BOE-ID, propia de cada instancia.
+        # Solo guarda descargas correctas: un fallo puntual del BOE no deja
+        # la ley sin índice para el resto del proceso
+        self._descargar_indice = lru_cache(maxsize=50)(self._descargar_indice_ley)
+        self._numeros_articulos = lru_cache(maxsize=50)(self._calcular_numeros_articulos)
+
     def obtener_indice(self, boe_id: str) -> Optional[Dict]:
         """
         Obtiene el índice completo de una ley
@@ -78,46 +92,78 @@ class BOEIndexFetcher:
             None si no se puede obtener
         """
         try:
-            logger.info(f"📥 Obteniendo índice del BOE: {boe_id}")
+            return self._descargar_indice(boe_id)
 
-            # Endpoint del índice
-            url = f"{self.BOE_API_BASE}/legislacion-consolidada/id/{boe_id}/texto/indice"
+        except Exception as e:
+            logger.error(f"❌ Error obteniendo índice de {boe_id}: {e}")
+            return None
 
-            response = self.session.get(url, timeout=30)
+    def obtener_articulos_set(self, boe_id: str) -> Optional[FrozenSet[str]]:
+        """
+        Números de todos los artículos de una ley, como conjunto
 
-            if response.status_code != 200:
-                logger.warning(f"⚠️  BOE API retornó {response.status_code} para {boe_id}")
-                return None
+        Se calcula una vez por ley (sobre el índice ya memoizado), para
+        validar artículos con una simple comprobación de pertenencia.
 
-            # Parsear XML
-            root = ET.fromstring(response.content)
+        Args:
+            boe_id: ID del BOE
 
-            # Extraer nombre de la ley
-            nombre_ley = self._extraer_nombre_ley(root, boe_id)
+        Returns:
+            frozenset de números de artículo ('138', '139'...) o None si no
+            se puede obtener el índice
+        """
+        try:
+            return self._numeros_articulos(boe_id)
 
-            # Parsear estructura
-            titulos = self._parsear_estructura(root)
+        except Exception as e:
+            logger.error(f"❌ Error obteniendo índice de {boe_id}: {e}")
+            return None
 
-            # Crear lista plana de artículos
-            articulos_planos = self._crear_lista_plana(titulos)
+    def _calcular_numeros_articulos(self, boe_id: str) -> FrozenSet[str]:
+        """Conjunto de números de artículo del índice (lanza excepción si falla)"""
+        return frozenset(art['numero'] for art in self._descargar_indice(boe_id)['articulos'])
 
-            indice = {
-                'boe_id': boe_id,
-                'ley': nombre_ley,
-                'titulos': titulos,
-                'articulos': articulos_planos,
-                'total_articulos': len(articulos_planos)
-            }
+    def _descargar_indice_ley(self, boe_id: str) -> Dict:
+        """
+        Descarga y parsea el índice de una ley (lanza excepción si falla)
 
-            logger.info(f"✅ Índice obtenido: {nombre_ley}")
-            logger.info(f"   Títulos: {len(titulos)}")
-            logger.info(f"   Artículos: {len(articulos_planos)}")
+        Se usa a través de self._descargar_indice, que lo memoiza.
+        """
+        logger.info(f"📥 Obteniendo índice del BOE: {boe_id}")
 
-            return indice
+        # Endpoint del índice
+        url = f"{self.BOE_API_BASE}/legislacion-consolidada/id/{boe_id}/texto/indice"
 
-        except Exception as e:
-            logger.error(f"❌ Error obteniendo índice de {boe_id}: {e}")
-            return None
+        response = self.session.get(url, timeout=30)
+
+        if response.status_code != 200:
+            raise RuntimeError(f"BOE API retornó {response.status_code}")
+
+        # Parsear XML
+        root = ET.fromstring(response.content)
+
+        # Extraer nombre de la ley
+        nombre_ley = self._extraer_nombre_ley(root, boe_id)
+
+        # Parsear estructura
+        titulos = self._parsear_estructura(root)
+
+        # Crear lista plana de artículos
+        articulos_planos = self._crear_lista_plana(titulos)
+
+        indice = {
+            'boe_id': boe_id,
+            'ley': nombre_ley,
+            'titulos': titulos,
+            'articulos': articulos_planos,
+            'total_articulos': len(articulos_planos)
+        }
+
+        logger.info(f"✅ Índice obtenido: {nombre_ley}")
+        logger.info(f"   Títulos: {len(titulos)}")
+        logger.info(f"   Artículos: {len(articulos_planos)}")
+
+        return indice
 
     def _extraer_nombre_ley(self, root: ET.Element, boe_id: str) -> str:
         """Extrae el nombre de la ley del XML"""
@@ -236,26 +282,26 @@ class BOEIndexFetcher:
         bloque_id_lower = bloque_id.lower()
 
         # Artículos (más común)
-        if re.match(r'^a\d+', bloque_id_lower):
+        if _ARTICULO_ID_RE.match(bloque_id_lower):
             return 'articulo'
 
         # Títulos
         if bloque_id_lower.startswith('t') and (
             bloque_id_lower == 'tpreliminar' or
-            re.match(r'^t[ivxlcdm]+$', bloque_id_lower)
+            _TITULO_ID_RE.match(bloque_id_lower)
         ):
             return 'titulo'
 
         # Libros
-        if bloque_id_lower.startswith('l') and re.match(r'^l[ivxlcdm]+$', bloque_id_lower):
+        if bloque_id_lower.startswith('l') and _LIBRO_ID_RE.match(bloque_id_lower):
             return 'libro'
 
         # Capítulos
-        if bloque_id_lower.startswith('c') and re.match(r'^c[ivxlcdm]+$', bloque_id_lower):
+        if bloque_id_lower.startswith('c') and _CAPITULO_ID_RE.match(bloque_id_lower):
             return 'capitulo'
 
         # Secciones
-        if bloque_id_lower.startswith('s') and re.match(r'^s[ivxlcdm]+$', bloque_id_lower):
+        if bloque_id_lower.startswith('s') and _SECCION_ID_RE.match(bloque_id_lower):
             return 'seccion'
 
         return 'otro'
@@ -301,12 +347,12 @@ class BOEIndexFetcher:
         - ID: "a138" → "138"
         """
         # Intentar extraer del nombre
-        match = re.search(r'[Aa]rt[íi]culo\s+(\d+(?:\.\d+)?)', nombre)
+        match = _NUMERO_ARTICULO_NOMBRE_RE.search(nombre)
         if match:
             return match.group(1)
 
         # Intentar extraer del ID (ej: "a138" → "138")
-        match = re.search(r'a(\d+)', art_id)
+        match = _NUMERO_ARTICULO_ID_RE.search(art_id)
         if match:
             return match.group(1)
 
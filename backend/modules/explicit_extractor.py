@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+LexAgents - Sistema Multi-Agente de Extracción Legal
+https://github.com/686f6c61/lexagents
+
+Módulo: Explicit Extractor
+Extracción determinista (por patrón) de las referencias explícitas con
+número oficial: Ley X/YYYY, Ley Orgánica X/YYYY, Real Decreto X/YYYY,
+Real Decreto-ley X/YYYY y Real Decreto Legislativo X/YYYY; y de las
+siglas legales conocidas (LPAC, LRJSP, CE...), todas a la vez en una
+sola pasada con un autómata Aho-Corasick.
+
+Los agentes B y C analizan el mismo texto; estas referencias se calculan
+una sola vez por texto y se pasan ya resueltas, de modo que el modelo
+pueda centrarse en las implícitas.
+
+Author: 686f6c61
+Version: 0.2.0
+License: MIT
+"""
+
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from modules.siglas_loader import get_siglas_loader
+
+try:
+    import ahocorasick
+except ImportError:
+    # Sin pyahocorasick las siglas se buscan con una alternancia regex
+    ahocorasick = None
+
+# Un único patrón para todas las normas con número oficial
+_EXPLICITA_RE = re.compile(
+    r'\b(?P<norma>Ley\s+Orgánica|Ley|Real\s+Decreto(?:[-\s][Ll]ey|\s+Legislativo)?)'
+    r'\s+(?P<numero>\d{1,4}/\d{4})\b'
+)
+
+# Caracteres de contexto a cada lado de la referencia
+_CONTEXTO_CHARS = 80
+
+# Las siglas más cortas (CE, CC, LG) son ambiguas: chocan con abreviaturas
+# (CC.AA.), con el (CE) de los reglamentos europeos, etc. No se detectan
+# localmente; las resuelve el modelo
+MIN_LONGITUD_SIGLA = 3
+
+
+def _es_caracter_palabra(caracter: str) -> bool:
+    """True si el carácter forma parte de una palabra (mismo criterio que \\w)"""
+    return caracter.isalnum() or caracter == '_'
+
+
+def _en_abreviatura_con_puntos(texto: str, inicio: int, fin: int) -> bool:
+    """
+    True si texto[inicio:fin] es parte de una abreviatura con puntos
+
+    "CC" en "CC.AA." o "UU" en "EE.UU." no son siglas legales: van
+    seguidas de punto y mayúscula, o precedidas de mayúscula y punto.
+    """
+    if fin + 1 < len(texto) and texto[fin] == '.' and texto[fin + 1].isupper():
+        return True
+    return inicio >= 2 and texto[inicio - 1] == '.' and texto[inicio - 2].isupper()
+
+
+@lru_cache(maxsize=1)
+def _siglas_conocidas() -> Dict[str, str]:
+    """
+    Siglas legales conocidas -> ley, a partir de SiglasLoader
+
+    Las entradas con variantes ("LPACAP/LPAC") se separan y se quita el
+    punto final ("LOTCu."). Si una sigla se repite, gana la primera (las
+    prioritarias van antes). Se omiten las de menos de MIN_LONGITUD_SIGLA
+    caracteres.
+    """
+    siglas = {}
+    for info in get_siglas_loader().cargar_siglas_todas():
+        for sigla in info['sigla'].split('/'):
+            sigla = sigla.strip().rstrip('.')
+            if len(sigla) >= MIN_LONGITUD_SIGLA:
+                siglas.setdefault(sigla, info['ley'])
+    return siglas
+
+
+@lru_cache(maxsize=1)
+def _automata_siglas() -> Optional[Any]:
+    """Autómata Aho-Corasick con todas las siglas (None sin pyahocorasick o sin siglas)"""
+    siglas = _siglas_conocidas()
+    if ahocorasick is None or not siglas:
+        return None
+
+    automata = ahocorasick.Automaton()
+    for sigla, ley in siglas.items():
+        automata.add_word(sigla, (sigla, ley))
+    automata.make_automaton()
+    return automata
+
+
+@lru_cache(maxsize=1)
+def _siglas_re() -> Optional[re.Pattern]:
+    """Alternativa sin pyahocorasick: todas las siglas en una alternancia (las largas primero)"""
+    siglas = _siglas_conocidas()
+    if not siglas:
+        return None
+    return re.compile(
+        r'(?<!\w)(' + '|'.join(sorted(map(re.escape, siglas), key=len, reverse=True)) + r')(?!\w)'
+    )
+
+
+@lru_cache(maxsize=16)
+def _extraer(texto: str) -> Tuple[Tuple[Tuple[str, Any], ...], ...]:
+    """
+    Extrae las referencias explícitas de un texto (memoizado por texto)
+
+    Se guarda como tuplas inmutables para que nadie modifique la caché.
+    """
+    referencias = []
+    vistas = set()
+
+    for match in _EXPLICITA_RE.finditer(texto):
+        norma = ' '.join(match.group('norma').split())
+        ley = f"{norma} {match.group('numero')}"
+        if ley in vistas:
+            continue
+        vistas.add(ley)
+
+        inicio = max(0, match.start() - _CONTEXTO_CHARS)
+        fin = min(len(texto), match.end() + _CONTEXTO_CHARS)
+
+        referencias.append((
+            ('texto_completo', ley),
+            ('tipo', 'ley' if norma.startswith('Ley') else 'real_decreto'),
+            ('ley', ley),
+            ('contexto', ' '.join(texto[inicio:fin].split())),
+            ('confianza', 100),
+        ))
+
+    return tuple(referencias)
+
+
+@lru_cache(maxsize=16)
+def _extraer_siglas(texto: str) -> Tuple[Tuple[Tuple[str, Any], ...], ...]:
+    """
+    Extrae las siglas legales conocidas de un texto (memoizado por texto)
+
+    Con pyahocorasick, una única pasada lineal encuentra todas las siglas a
+    la vez, sean cuantas sean; solo cuentan las que aparecen como palabra
+    completa (LEC no casa dentro de LECrim) y fuera de abreviaturas con
+    puntos (CC.AA.).
+    """
+    siglas = _siglas_conocidas()
+    apariciones = []
+
+    automata = _automata_siglas()
+    if automata is not None:
+        for fin, (sigla, _) in automata.iter(texto):
+            inicio = fin - len(sigla) + 1
+            if inicio > 0 and _es_caracter_palabra(texto[inicio - 1]):
+                continue
+            if fin + 1 < len(texto) and _es_caracter_palabra(texto[fin + 1]):
+                continue
+            apariciones.append((inicio, fin + 1, sigla))
+    elif (patron := _siglas_re()) is not None:
+        apariciones = [(m.start(), m.end(), m.group(1)) for m in patron.finditer(texto)]
+
+    referencias = []
+    vistas = set()
+
+    for inicio, fin, sigla in apariciones:
+        if sigla in vistas or _en_abreviatura_con_puntos(texto, inicio, fin):
+            continue
+        vistas.add(sigla)
+
+        contexto_inicio = max(0, inicio - _CONTEXTO_CHARS)
+        contexto_fin = min(len(texto), fin + _CONTEXTO_CHARS)
+
+        referencias.append((
+            ('texto_completo', sigla),
+            ('tipo', 'sigla'),
+            ('ley', siglas[sigla]),
+            ('contexto', ' '.join(texto[contexto_inicio:contexto_fin].split())),
+            ('confianza', 95),
+        ))
+
+    return tuple(referencias)
+
+
+def extraer_referencias_explicitas(texto: Union[str, bytes]) -> List[Dict]:
+    """
+    Devuelve las referencias explícitas (normas con número) de un texto
+
+    Cada norma aparece una sola vez, en orden de primera aparición.
+
+    Args:
+        texto: Texto del tema (str o bytes UTF-8)
+
+    Returns:
+        Lista de referencias (dicts nuevos en cada llamada)
+    """
+    if isinstance(texto, (bytes, bytearray)):
+        texto = texto.decode('utf-8', 'ignore')
+    return [dict(referencia) for referencia in _extraer(texto)]
+
+
+def extraer_siglas(texto: Union[str, bytes]) -> List[Dict]:
+    """
+    Devuelve las siglas legales conocidas que aparecen en un texto
+
+    Cada sigla aparece una sola vez, en orden de primera aparición, con su
+    ley en el campo 'ley'.
+
+    Args:
+        texto: Texto del tema (str o bytes UTF-8)
+
+    Returns:
+        Lista de referencias de tipo 'sigla' (dicts nuevos en cada llamada)
+    """
+    if isinstance(texto, (bytes, bytearray)):
+        texto = texto.decode('utf-8', 'ignore')
+    return [dict(referencia) for referencia in _extraer_siglas(texto)]
+
+
+def formatear_explicitas_para_prompt(referencias: List[Dict], max_refs: int = 30) -> str:
+    """
+    Formatea las referencias explícitas para inyección en prompts
+
+    Args:
+        referencias: Resultado de extraer_referencias_explicitas()
+        max_refs: Número máximo de referencias a listar
+
+    Returns:
+        String para añadir al prompt ("" si no hay referencias)
+    """
+    if not referencias:
+        return ""
+
+    lista = "\n".join(
+        f"- {ref['texto_completo']} → {ref['ley']}" if ref['texto_completo'] != ref['ley'] else f"- {ref['ley']}"
+        for ref in referencias[:max_refs]
+    )
+    resto = f"\n... y {len(referencias) - max_refs} más" if len(referencias) > max_refs else ""
+
+    titulo = "NORMAS Y SIGLAS" if any(ref['tipo'] == 'sigla' for ref in referencias) else "NORMAS CON NÚMERO"
+
+    return f"""{titulo} YA DETECTADAS AUTOMÁTICAMENTE (no hace falta que las devuelvas como referencia a la norma completa):
+{lista}{resto}
+
+Céntrate en las referencias implícitas, por siglas o en lenguaje natural, y en los artículos concretos (esos SÍ debes devolverlos aunque su norma esté en la lista).
+
+"""
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+LexAgents - Sistema Multi-Agente de Extracción Legal
+https://github.com/686f6c61/lexagents
+
+Módulo: LLM Cache
+Caché exacta en disco de respuestas de Gemini, indexada por
+(modelo, temperatura, prompt). Reprocesar el mismo tema (pruebas,
+reejecuciones) no vuelve a pagar la llamada a la API.
+
+Author: 686f6c61
+Version: 0.2.0
+License: MIT
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LLMCache:
+    """Caché de respuestas del modelo en disco (un fichero JSON por prompt)"""
+
+    def __init__(self, cache_dir: Optional[str] = None, cache_days: int = 7):
+        """
+        Inicializa la caché
+
+        Args:
+            cache_dir: Directorio de la caché (por defecto data/cache/llm)
+            cache_days: Días de validez de cada respuesta
+        """
+        if cache_dir is None:
+            base_path = Path(__file__).parent.parent.parent
+            cache_dir = str(base_path / "data" / "cache" / "llm")
+
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.cache_days = cache_days
+
+    @staticmethod
+    def get_key(modelo: str, temperatura: float, prompt: str) -> str:
+        """
+        Genera la clave de una llamada
+
+        Args:
+            modelo: Modelo de Gemini
+            temperatura: Temperatura de generación
+            prompt: Prompt completo (incluida la system instruction)
+
+        Returns:
+            Hash hexadecimal de la llamada
+        """
+        datos = f"{modelo}|{temperatura}|{prompt.strip()}"
+        return hashlib.sha256(datos.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Obtiene una respuesta de la caché
+
+        Args:
+            key: Clave de get_key()
+
+        Returns:
+            Texto de la respuesta o None si no está o ha caducado
+        """
+        cache_file = self.cache_dir / f"{key}.json"
+        if not cache_file.exists():
+            return None
+
+        try:
+            edad = datetime.now() - datetime.fromtimestamp(cache_file.stat().st_mtime)
+            if edad > timedelta(days=self.cache_days):
+                return None
+
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                return json.load(f)['respuesta']
+
+        except Exception as e:
+            logger.warning(f"⚠️  Error leyendo caché LLM: {e}")
+            return None
+
+    def set(self, key: str, respuesta: str):
+        """
+        Guarda una respuesta en la caché (escritura atómica)
+
+        Args:
+            key: Clave de get_key()
+            respuesta: Texto generado por el modelo
+        """
+        cache_file = self.cache_dir / f"{key}.json"
+        tmp_file = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({'respuesta': respuesta}, f, ensure_ascii=False)
+            os.replace(tmp_file, cache_file)
+
+        except Exception as e:
+            logger.warning(f"⚠️  Error guardando caché LLM: {e}")
+
+
+# Instancia global para uso fácil
+_llm_cache = None
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    """
+    Obtiene la instancia singleton de LLMCache
+
+    Desactivada por defecto (en producción se quieren respuestas nuevas,
+    no las muestreadas hace días); se activa con LLM_CACHE_ENABLED=true y
+    la validez se configura con LLM_CACHE_DAYS.
+
+    Returns:
+        Instancia de LLMCache o None si la caché está desactivada
+    """
+    global _llm_cache
+
+    if os.getenv('LLM_CACHE_ENABLED', 'false').lower() not in ('true', '1', 'yes'):
+        return None
+
+    if _llm_cache is None:
+        _llm_cache = LLMCache(cache_days=int(os.getenv('LLM_CACHE_DAYS', '7')))
+
+    return _llm_cache
@@ -290,10 +290,14 @@ def get_siglas_loader() -> SiglasLoader:
 
 
 # Funciones helper para uso rápido
+@lru_cache(maxsize=8)
 def cargar_siglas_para_prompt(max_siglas: int = 30) -> str:
     """
     Carga y formatea siglas para inyección en prompts
 
+    Memoizado por max_siglas: el CSV no cambia durante la ejecución (para
+    recargarlo, cargar_siglas_para_prompt.cache_clear()).
+
     Args:
         max_siglas: Número máximo de siglas
 
@@ -191,6 +191,16 @@ class PipelineOptimizado:
 
         logger.info(f"✅ Pipeline optimizado - Max workers: {max_workers}, Cache: {use_cache}")
 
+    def close(self):
+        """Libera los recursos del sistema de convergencia (event loop y sesiones HTTP)"""
+        self.sistema_convergencia.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
     def _report_progress(self, percent: float, message: str):
         """
         Reporta progreso si hay callback configurado
@@ -774,18 +784,17 @@ if __name__ == "__main__":
     json_path = str(json_files[0])
 
     # Ejecutar pipeline optimizado
-    pipeline = PipelineOptimizado(
+    with PipelineOptimizado(
         max_rondas_convergencia=2,  # Solo 2 rondas para test rápido
         max_workers=4,  # 4 workers paralelos
         use_cache=True  # Cache habilitado
-    )
-
-    informe = pipeline.procesar_tema(
-        json_path,
-        limite_texto=15000,  # Limitar para rapidez
-        exportar=True,
-        formatos_export=['md', 'txt', 'docx']
-    )
+    ) as pipeline:
+        informe = pipeline.procesar_tema(
+            json_path,
+            limite_texto=15000,  # Limitar para rapidez
+            exportar=True,
+            formatos_export=['md', 'txt', 'docx']
+        )
 
     # Mostrar informe
     pipeline.mostrar_informe(informe)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Tests de modules/explicit_extractor.py
+
+Extracción determinista de normas con número y de siglas legales
+(con y sin pyahocorasick).
+"""
+
+import pytest
+
+from modules import explicit_extractor
+from modules.explicit_extractor import extraer_referencias_explicitas, extraer_siglas
+
+
+def _limpiar_caches():
+    explicit_extractor._automata_siglas.cache_clear()
+    explicit_extractor._siglas_re.cache_clear()
+    explicit_extractor._extraer_siglas.cache_clear()
+
+
+@pytest.fixture(params=['ahocorasick', 'regex'])
+def motor_siglas(request, monkeypatch):
+    """Ejecuta cada test de siglas con el autómata y con la alternativa regex"""
+    if request.param == 'ahocorasick' and explicit_extractor.ahocorasick is None:
+        pytest.skip("pyahocorasick no instalado")
+    if request.param == 'regex':
+        monkeypatch.setattr(explicit_extractor, 'ahocorasick', None)
+
+    _limpiar_caches()
+    yield request.param
+    _limpiar_caches()
+
+
+class TestReferenciasExplicitas:
+
+    def test_tipos_de_norma(self):
+        texto = (
+            "Según la Ley 39/2015, la Ley Orgánica 3/2018, el Real Decreto-ley 7/2012, "
+            "el Real Decreto Legislativo 2/2015 y el Real Decreto 203/2021."
+        )
+
+        refs = extraer_referencias_explicitas(texto)
+
+        assert [(r['ley'], r['tipo']) for r in refs] == [
+            ('Ley 39/2015', 'ley'),
+            ('Ley Orgánica 3/2018', 'ley'),
+            ('Real Decreto-ley 7/2012', 'real_decreto'),
+            ('Real Decreto Legislativo 2/2015', 'real_decreto'),
+            ('Real Decreto 203/2021', 'real_decreto'),
+        ]
+        assert all(r['confianza'] == 100 for r in refs)
+
+    def test_una_vez_por_norma_en_orden_de_aparicion(self):
+        texto = "La Ley 40/2015 completa la Ley 39/2015. Vuelve a citarse la Ley 40/2015."
+
+        refs = extraer_referencias_explicitas(texto)
+
+        assert [r['ley'] for r in refs] == ['Ley 40/2015', 'Ley 39/2015']
+
+    def test_normaliza_espacios(self):
+        refs = extraer_referencias_explicitas("la Ley   Orgánica\n6/1985 del Poder Judicial")
+
+        assert refs[0]['ley'] == 'Ley Orgánica 6/1985'
+        assert '\n' not in refs[0]['contexto']
+
+    def test_sin_numero_no_es_explicita(self):
+        assert extraer_referencias_explicitas("la Ley de Enjuiciamiento Civil") == []
+
+    def test_acepta_bytes(self):
+        refs = extraer_referencias_explicitas("Ley Orgánica 3/2018".encode('utf-8'))
+
+        assert [r['ley'] for r in refs] == ['Ley Orgánica 3/2018']
+
+    def test_devuelve_dicts_nuevos(self):
+        texto = "Ley 39/2015"
+
+        extraer_referencias_explicitas(texto)[0]['ley'] = 'modificada'
+
+        assert extraer_referencias_explicitas(texto)[0]['ley'] == 'Ley 39/2015'
+
+
+class TestSiglas:
+
+    def test_sigla_conocida(self, motor_siglas):
+        refs = extraer_siglas("El procedimiento se regula en la LPAC y en la LRJSP.")
+
+        assert [(r['texto_completo'], r['ley'], r['tipo']) for r in refs] == [
+            ('LPAC', 'Ley 39/2015', 'sigla'),
+            ('LRJSP', 'Ley 40/2015', 'sigla'),
+        ]
+        assert all(r['confianza'] == 95 for r in refs)
+
+    def test_solo_palabra_completa(self, motor_siglas):
+        assert extraer_siglas("La LECrim regula el proceso penal") == []
+
+    def test_abreviatura_con_puntos_no_es_sigla(self, motor_siglas):
+        assert extraer_siglas("Las competencias de las CC.AA. y de los EE.UU.") == []
+
+    def test_siglas_de_dos_letras_no_se_detectan(self, motor_siglas):
+        texto = "El art. 14 CE, el CC y el Reglamento (CE) n.º 1907/2006"
+
+        assert extraer_siglas(texto) == []
+
+    def test_una_vez_por_sigla(self, motor_siglas):
+        refs = extraer_siglas("La LEC. Según la LEC, y otra vez la LEC")
+
+        assert [r['texto_completo'] for r in refs] == ['LEC']
+        assert refs[0]['ley'] == 'Ley 1/2000'
+
+    def test_acepta_bytes(self, motor_siglas):
+        refs = extraer_siglas("según la LOPJ".encode('utf-8'))
+
+        assert [r['ley'] for r in refs] == ['Ley Orgánica 6/1985']